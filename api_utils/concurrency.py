@@ -0,0 +1,26 @@
+"""Helpers for running coroutines concurrently.
+"""
+import asyncio
+from typing import Awaitable, List
+
+
+async def gather_with_concurrency(
+    semaphore: asyncio.Semaphore, *aws: Awaitable
+) -> List:
+    """Run awaitables concurrently, holding `semaphore` for the duration of each one. Results are returned in the
+    same order as `aws`, as with `asyncio.gather`.
+
+    Args:
+        semaphore (asyncio.Semaphore): semaphore bounding the number of awaitables running at once. Can be shared
+            between several calls to cap concurrency across them.
+        *aws (Awaitable): coroutines or futures to run
+
+    Returns:
+        List: results of each awaitable
+    """
+
+    async def _run(aw: Awaitable):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(_run(aw) for aw in aws))
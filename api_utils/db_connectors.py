@@ -1,11 +1,16 @@
 """Submodule for connecting to and querying databases.
 """
+import asyncio
+import itertools
 import json
-import time
-import urllib
-from elasticsearch import Elasticsearch
-from SPARQLWrapper import SPARQLWrapper, JSON
-from api_utils import logging
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import httpx
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch import ConnectionError as ElasticsearchConnectionError
+from elasticsearch.helpers import async_scan
+from api_utils import logging, metrics, resilience
+from api_utils.limiter import AdaptiveLimiter
+from api_utils.singleflight import SingleFlight
 
 logger = logging.get_logger(__name__)
 
@@ -32,80 +37,280 @@ def get_elasticsearch_connector(
 
 
 class SPARQLConnector:
-    def __init__(self, endpoint):
+    """Asynchronous SPARQL client which keeps a pool of keep-alive connections open to a single endpoint.
+
+    The underlying HTTP client is created lazily on first use so the connector can be instantiated at import time,
+    and should be closed with `close()` when the app shuts down.
+    """
+
+    user_agent = "heritageconnector-api"
+
+    def __init__(
+        self,
+        endpoint: str,
+        timeout: float = 30.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        upstream: Optional[resilience.Upstream] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ):
+        """
+        Args:
+            endpoint (str): URL of the SPARQL endpoint
+            timeout (float, optional): timeout in seconds for connecting to and reading from the endpoint. Defaults to 30.0.
+            max_connections (int, optional): maximum number of concurrent connections to the endpoint. Defaults to 100.
+            max_keepalive_connections (int, optional): maximum number of idle connections kept open. Defaults to 20.
+            upstream (Optional[resilience.Upstream], optional): retry, deadline and circuit breaker policy for queries.
+                Defaults to 3 attempts with no deadline other than `timeout` per attempt.
+            limiter (Optional[AdaptiveLimiter], optional): adaptive limit on the number of queries in flight,
+                with load shedding. Defaults to one with at most `max_connections` queries in flight.
+        """
         self.endpoint = endpoint
+        self.timeout = httpx.Timeout(timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.upstream = upstream or resilience.Upstream("sparql")
+        self.limiter = limiter or AdaptiveLimiter("sparql", max_limit=max_connections)
+        self._client = None
+        self._single_flight = SingleFlight("sparql")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                headers={
+                    "User-Agent": self.user_agent,
+                    "Accept": "application/sparql-results+json",
+                },
+            )
+
+        return self._client
+
+    async def close(self):
+        """Close all pooled connections to the endpoint."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
-    def get_sparql_results(self, query: str) -> dict:
+    async def get_sparql_results(self, query: str) -> dict:
         """
         Makes a SPARQL query to endpoint_url. From the heritageconnector repo
 
+        Identical queries made while one is already in flight share its result, which mustn't be mutated.
+
         Args:
             query (str): SPARQL query
 
         Returns:
             query_result (dict): the JSON result of the query as a dict
         """
-        user_agent = "heritageconnector-api"
-
-        sparql = SPARQLWrapper(self.endpoint)
-        sparql.setQuery(query)
-        sparql.setMethod("POST")
-        sparql.setReturnFormat(JSON)
-        sparql.addCustomHttpHeader(
-            "User-Agent",
-            user_agent,
+        return await self._single_flight.do(
+            query, lambda: self._get_sparql_results(query)
         )
+
+    async def _get_sparql_results(self, query: str) -> dict:
+        # rate limiting (429) is retried by `upstream`, respecting the endpoint's Retry-After
+        async with self.limiter.slot() as slot:
+            try:
+                response = await self.upstream.request(
+                    lambda: self.client.post(self.endpoint, data={"query": query})
+                )
+            except resilience.UpstreamUnavailableError as e:
+                if e.status_code in (429, 503):
+                    slot.mark_overloaded()
+                raise
+        if response.status_code == 403:
+            logger.warning("403 from SPARQL endpoint")
+            return response.text
+        response.raise_for_status()
+
         try:
-            return sparql.query().convert()
-        except urllib.error.HTTPError as e:
-            if e.code == 429:
-                print("429")
-                if e.headers.get("retry-after", None):
-                    print(f"Retrying after {e.headers['retry-after']} seconds")
-                    time.sleep(int(e.headers["retry-after"]))
-                else:
-                    time.sleep(10)
-                return self.get_sparql_results(self.endpoint, query)
-            elif e.code == 403:
-                print("403")
-                return e.read().decode("utf8", "ignore")
-            raise e
+            return response.json()
         except json.decoder.JSONDecodeError as e:
-            print("JSONDecodeError. Query:")
-            print(query)
+            logger.error(f"JSONDecodeError. Query: {query}")
             raise e
 
 
 class ElasticsearchConnector:
-    def __init__(self, es_cluster: str, es_user: str, es_password: str):
+    """Asynchronous Elasticsearch client for looking up Heritage Connector records by URI, using a pool of keep-alive
+    connections. Documents are keyed by URI, so many can be fetched at once with `mget`.
+
+    As with `SPARQLConnector`, the underlying client is created lazily on first use, and should be closed with
+    `close()` when the app shuts down.
+    """
+
+    def __init__(
+        self,
+        es_cluster: str,
+        es_user: str,
+        es_password: str,
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        max_docs_per_request: int = 500,
+        upstream: Optional[resilience.Upstream] = None,
+    ):
+        """
+        Args:
+            es_cluster (str): URL of the Elasticsearch cluster
+            es_user (str)
+            es_password (str)
+            timeout (float, optional): timeout in seconds for each request. Defaults to 10.0.
+            max_connections (int, optional): maximum number of concurrent connections. Defaults to 20.
+            max_docs_per_request (int, optional): maximum number of documents fetched in each `mget` request.
+                Defaults to 500.
+            upstream (Optional[resilience.Upstream], optional): circuit breaker for requests. Retries are left to the
+                Elasticsearch client. Defaults to one named "elasticsearch".
+        """
         self.endpoint = es_cluster
-        self.es = Elasticsearch(
-            [self.endpoint],
-            http_auth=(es_user, es_password),
+        self.auth = (es_user, es_password)
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_docs_per_request = max_docs_per_request
+        self.upstream = upstream or resilience.Upstream("elasticsearch")
+        self._es = None
+        self._single_flight = SingleFlight("elasticsearch")
+
+    @property
+    def es(self) -> AsyncElasticsearch:
+        if self._es is None:
+            self._es = AsyncElasticsearch(
+                [self.endpoint],
+                http_auth=self.auth,
+                timeout=self.timeout,
+                maxsize=self.max_connections,
+            )
+
+        return self._es
+
+    async def close(self):
+        """Close all pooled connections to the cluster."""
+        if self._es is not None:
+            await self._es.close()
+            self._es = None
+
+    async def _mget(self, index: str, ids: Tuple[str, ...]) -> List[dict]:
+        self.upstream.check()
+        try:
+            with metrics.time_upstream(self.upstream.name):
+                response = await self.es.mget(index=index, body={"ids": list(ids)})
+        except asyncio.CancelledError:
+            self.upstream.breaker.release()
+            raise
+        except ElasticsearchConnectionError as e:
+            self.upstream.breaker.record_failure()
+            raise resilience.UpstreamUnavailableError(
+                self.upstream.name, repr(e)
+            ) from e
+        except Exception:
+            # the cluster responded, e.g. with a 404 because the index doesn't exist
+            self.upstream.breaker.record_success()
+            raise
+
+        self.upstream.breaker.record_success()
+
+        return response["docs"]
+
+    async def get_docs_by_uris(
+        self, index: str, uris: Iterable[str], simplify: bool = True
+    ) -> Dict[str, Optional[dict]]:
+        """Get the documents for many URIs, in one `mget` request per `max_docs_per_request` URIs.
+
+        Identical requests made while one is already in flight share its result.
+
+        Args:
+            index (str): name of the index
+            uris (Iterable[str]): URIs of the documents
+            simplify (bool, optional): return each document as a record from `_simplify_document` rather than
+                as it is. Defaults to True.
+
+        Returns:
+            Dict[str, Optional[dict]]: mapping of each URI to its document, or None if it isn't in the index
+        """
+        uris = list(dict.fromkeys(uris))
+        chunks = [
+            tuple(itertools.islice(uris, start, start + self.max_docs_per_request))
+            for start in range(0, len(uris), self.max_docs_per_request)
+        ]
+        chunk_docs = await asyncio.gather(
+            *[
+                self._single_flight.do(
+                    (index, chunk), lambda chunk=chunk: self._mget(index, chunk)
+                )
+                for chunk in chunks
+            ]
         )
 
-    def get_doc_by_uri(self, index: str, uri: str, simplify=True) -> dict:
+        docs = {uri: None for uri in uris}
+        for doc in itertools.chain.from_iterable(chunk_docs):
+            if doc.get("found"):
+                docs[doc["_id"]] = self._simplify_document(doc) if simplify else doc
+
+        return docs
+
+    async def get_doc_by_uri(
+        self, index: str, uri: str, simplify: bool = True
+    ) -> Optional[dict]:
         """
-        Get doc by SMG URI.
+        Get doc by SMG URI, or None if it isn't in the index.
         """
-        res = self.es.search(
-            index=index, body={"query": {"term": {"uri.keyword": uri}}}
-        )
-        if len(res["hits"]["hits"]):
-            res_doc = res["hits"]["hits"][0]
+        return (await self.get_docs_by_uris(index, [uri], simplify))[uri]
+
+    async def iter_labels(
+        self, index: str, page_size: int = 5000
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """Yield the URI and label of every document in an index which has a label, scrolling through the index
+        `page_size` documents at a time.
+
+        Args:
+            index (str): name of the index
+            page_size (int, optional): documents fetched per request. Defaults to 5000.
+        """
+        self.upstream.check()
+        try:
+            async for doc in async_scan(
+                self.es,
+                index=index,
+                query={"query": {"match_all": {}}},
+                _source=["graph.@rdfs:label"],
+                size=page_size,
+            ):
+                label = self._simplify_document(doc)["label"]
+                if label:
+                    yield doc["_id"], label
+        except ElasticsearchConnectionError as e:
+            self.upstream.breaker.record_failure()
+            raise resilience.UpstreamUnavailableError(
+                self.upstream.name, repr(e)
+            ) from e
+        except Exception:
+            # the cluster responded, e.g. with a 404 because the index doesn't exist
+            self.upstream.breaker.record_success()
+            raise
+        except BaseException:
+            # cancelled, or the caller stopped iterating
+            self.upstream.breaker.release()
+            raise
 
-        return self._simplify_document(res_doc) if simplify else res_doc
+        self.upstream.breaker.record_success()
 
-    def _simplify_document(self, doc: dict) -> dict:
+    @staticmethod
+    def _simplify_document(doc: dict) -> dict:
         """
-        Extracts just the URI, topconcept, label and description from an Elasticsearch document.
+        Extracts just the URI, topconcept, label and description from an Elasticsearch document. Fields which the
+        document doesn't have are None.
         """
+        source = doc.get("_source", {})
+        graph = source.get("graph", {})
 
         return {
             "uri": doc["_id"],
-            "topconcept": doc["_source"]["graph"]["@skos:hasTopConcept"]["@value"],
-            "label": doc["_source"]["graph"]["@rdfs:label"]["@value"],
-            "description": doc["_source"]["data"][
+            "topconcept": graph.get("@skos:hasTopConcept", {}).get("@value"),
+            "label": graph.get("@rdfs:label", {}).get("@value"),
+            "description": source.get("data", {}).get(
                 "http://www.w3.org/2001/XMLSchema#description"
-            ],
+            ),
         }
@@ -0,0 +1,307 @@
+"""In-process embedding index, which can be used in place of the vectors API to answer neighbours and distance
+queries from local files.
+
+The index is made of two files:
+- a `.npy` matrix with one embedding per row, which is memory-mapped rather than read into memory
+- a text file with the URI of each row, one per line, in the same order as the matrix
+
+Scores follow the same contract as the vectors API: they are cosine *distances*, i.e. `1 - cosine similarity`.
+"""
+import asyncio
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from api_utils import logging, metrics
+
+logger = logging.get_logger(__name__)
+
+
+class EmbeddingIndex:
+    def __init__(
+        self,
+        embeddings_path: str,
+        uris_path: str,
+        n_lists: int = 0,
+        n_probe: int = 8,
+        ivf_path: Optional[str] = None,
+        chunk_size: int = 65536,
+    ):
+        """
+        Args:
+            embeddings_path (str): path to a `.npy` file containing the embeddings matrix
+            uris_path (str): path to a text file containing the URI of each row of the embeddings matrix
+            n_lists (int, optional): number of inverted lists (clusters) to use for an IVF index. If 0, neighbours are
+                found by brute force over all embeddings. Must be at most the number of embeddings. Defaults to 0.
+            n_probe (int, optional): number of inverted lists searched for each query when using an IVF index.
+                Defaults to 8.
+            ivf_path (Optional[str], optional): path of a `.npz` file to save the IVF index to once built, and to load
+                it from on later starts. It's rebuilt if the embeddings have changed since. If None the index is built
+                every time.
+            chunk_size (int, optional): number of embeddings scored at once, which bounds the memory used by each
+                query. Defaults to 65536.
+        """
+        if ivf_path and not ivf_path.endswith(".npz"):
+            # np.savez would add the extension, so the index would never be found again
+            raise ValueError(f"IVF index path {ivf_path} must end in .npz")
+
+        self.embeddings = np.load(embeddings_path, mmap_mode="r")
+        with open(uris_path) as f:
+            self.uris = [line.rstrip("\n") for line in f]
+
+        if len(self.uris) != self.embeddings.shape[0]:
+            raise ValueError(
+                f"{uris_path} has {len(self.uris)} URIs but {embeddings_path} has {self.embeddings.shape[0]} rows"
+            )
+
+        self.uri_index = {uri: idx for idx, uri in enumerate(self.uris)}
+        self.chunk_size = chunk_size
+        self.norms = self._get_norms()
+        self.n_probe = n_probe
+
+        if n_lists > self.embeddings.shape[0]:
+            raise ValueError(
+                f"Can't build an IVF index with {n_lists} lists from {self.embeddings.shape[0]} embeddings: n_lists "
+                "must be at most the number of embeddings"
+            )
+
+        self.centroids = None
+        if n_lists:
+            self._load_or_build_ivf(n_lists, ivf_path)
+
+        logger.info(
+            f"Loaded {self.embeddings.shape[0]} embeddings of dimension {self.embeddings.shape[1]} from {embeddings_path}"
+        )
+
+    def _chunks(self, n_rows: int):
+        for start in range(0, n_rows, self.chunk_size):
+            yield start, min(start + self.chunk_size, n_rows)
+
+    def _get_norms(self) -> np.ndarray:
+        norms = np.empty(self.embeddings.shape[0], dtype=np.float32)
+        for start, end in self._chunks(self.embeddings.shape[0]):
+            norms[start:end] = np.linalg.norm(
+                np.asarray(self.embeddings[start:end], dtype=np.float32), axis=1
+            )
+        # zero vectors have a similarity of 0 with everything, rather than NaN
+        norms[norms == 0] = 1
+
+        return norms
+
+    def _get_normalised_rows(self, rows) -> np.ndarray:
+        return (
+            np.asarray(self.embeddings[rows], dtype=np.float32)
+            / self.norms[rows, np.newaxis]
+        )
+
+    def _fingerprint(self) -> str:
+        """Checksum of the shape and norms of the embeddings, saved with the IVF index to tell whether it was built
+        from the same embeddings."""
+        digest = hashlib.sha256(np.array(self.embeddings.shape, dtype=np.int64))
+        digest.update(self.norms.tobytes())
+
+        return digest.hexdigest()
+
+    def _load_or_build_ivf(self, n_lists: int, ivf_path: Optional[str]):
+        fingerprint = self._fingerprint()
+
+        if ivf_path and os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            if (
+                ivf["centroids"].shape[0] == n_lists
+                and "fingerprint" in ivf.files
+                and str(ivf["fingerprint"]) == fingerprint
+            ):
+                self.centroids = ivf["centroids"]
+                self.list_offsets = ivf["list_offsets"]
+                self.list_rows = ivf["list_rows"]
+                logger.info(f"Loaded IVF index with {n_lists} lists from {ivf_path}")
+                return
+
+            logger.info(
+                f"Rebuilding IVF index at {ivf_path}, as it was built with a different number of lists or embeddings"
+            )
+
+        self._build_ivf(n_lists)
+
+        if ivf_path:
+            np.savez(
+                ivf_path,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+                fingerprint=np.array(fingerprint),
+            )
+
+    def _build_ivf(self, n_lists: int, n_iter: int = 10, sample_size: int = 100_000):
+        """Build an inverted file index by clustering the normalised embeddings with spherical k-means and assigning
+        each embedding to its nearest centroid."""
+        n_rows = self.embeddings.shape[0]
+        rng = np.random.default_rng(0)
+        sample = np.sort(
+            # at least one sample per list, so that each list has a distinct initial centroid
+            rng.choice(
+                n_rows, size=min(max(sample_size, n_lists), n_rows), replace=False
+            )
+        )
+        sample_vectors = self._get_normalised_rows(sample)
+
+        centroids = sample_vectors[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(sample_vectors @ centroids.T, axis=1)
+            for list_idx in range(n_lists):
+                members = sample_vectors[assignments == list_idx]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[list_idx] = centroid / (np.linalg.norm(centroid) or 1)
+
+        assignments = np.empty(n_rows, dtype=np.int32)
+        for start, end in self._chunks(n_rows):
+            assignments[start:end] = np.argmax(
+                self._get_normalised_rows(slice(start, end)) @ centroids.T, axis=1
+            )
+
+        self.centroids = centroids
+        self.list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        self.list_offsets = np.searchsorted(
+            assignments[self.list_rows], np.arange(n_lists + 1)
+        )
+        logger.info(f"Built IVF index with {n_lists} lists")
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        nearest_lists = np.argsort(-(self.centroids @ query))[: self.n_probe]
+
+        return np.sort(
+            np.concatenate(
+                [
+                    self.list_rows[
+                        slice(self.list_offsets[idx], self.list_offsets[idx + 1])
+                    ]
+                    for idx in nearest_lists
+                ]
+            )
+        )
+
+    @staticmethod
+    def _top_k(
+        scores: np.ndarray, rows: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the `k` highest scores in each row of `scores`, along with the corresponding values of `rows`."""
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            rows = np.take_along_axis(rows, top, axis=1)
+
+        return scores, rows
+
+    def _search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the `k` embeddings with the highest cosine similarity to each of `queries`, which should be
+        normalised. Returns (similarities, row indices), each sorted by descending similarity."""
+        if self.centroids is not None:
+            results = []
+            for query in queries:
+                rows = self._candidate_rows(query)
+                sims = (self._get_normalised_rows(rows) @ query)[np.newaxis, :]
+                results.append(self._top_k(sims, rows[np.newaxis, :], k))
+            best_sims = [sims[0] for sims, _ in results]
+            best_rows = [rows[0] for _, rows in results]
+        else:
+            best_sims = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+            for start, end in self._chunks(self.embeddings.shape[0]):
+                sims = queries @ self._get_normalised_rows(slice(start, end)).T
+                rows = np.broadcast_to(np.arange(start, end), sims.shape)
+                best_sims, best_rows = self._top_k(
+                    np.hstack([best_sims, sims]), np.hstack([best_rows, rows]), k
+                )
+
+        order = [np.argsort(-sims, kind="stable") for sims in best_sims]
+
+        return (
+            [sims[o] for sims, o in zip(best_sims, order)],
+            [rows[o] for rows, o in zip(best_rows, order)],
+        )
+
+    def neighbours(self, entities: List[str], k: int) -> Dict[str, List[list]]:
+        """Get the `k` nearest neighbours of each entity in `entities`. Entities which aren't in the index get an
+        empty list of neighbours.
+
+        Returns:
+            Dict[str, List[list]]: mapping of each entity to a list of `[neighbour, distance]` pairs
+        """
+        response = {ent: [] for ent in entities}
+        known_entities = [ent for ent in response if ent in self.uri_index]
+        if not known_entities or k < 1:
+            return response
+
+        queries = self._get_normalised_rows(
+            [self.uri_index[ent] for ent in known_entities]
+        )
+        all_sims, all_rows = self._search(queries, k)
+
+        for ent, sims, rows in zip(known_entities, all_sims, all_rows):
+            response[ent] = [
+                [self.uris[row], max(0.0, float(1 - sim))]
+                for sim, row in zip(sims, rows)
+            ]
+
+        return response
+
+    def distance(self, entity_a: str, entity_b: str) -> float:
+        """Get the cosine distance between two entities. Raises a `KeyError` if either entity isn't in the index."""
+        vectors = self._get_normalised_rows(
+            [self.uri_index[entity_a], self.uri_index[entity_b]]
+        )
+
+        # rounding in float32 can take the distance between near-identical vectors just below 0
+        return max(0.0, float(1 - vectors[0] @ vectors[1]))
+
+    def distance_matrix(
+        self, entities_a: List[str], entities_b: List[str]
+    ) -> List[List[Optional[float]]]:
+        """Get the cosine distance between every entity in `entities_a` and every entity in `entities_b` in one
+        vectorised pass. Pairs involving an entity which isn't in the index have a distance of None."""
+        vectors_a, known_a = self._get_vectors(entities_a)
+        vectors_b, known_b = self._get_vectors(entities_b)
+
+        distances = np.maximum(1 - vectors_a @ vectors_b.T, 0).astype(object)
+        distances[~known_a, :] = None
+        distances[:, ~known_b] = None
+
+        return distances.tolist()
+
+    def _get_vectors(self, entities: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Get normalised vectors for `entities`, with zero vectors for entities which aren't in the index, and a
+        boolean mask of which entities are in the index."""
+        known = np.array([ent in self.uri_index for ent in entities], dtype=bool)
+        vectors = np.zeros((len(entities), self.embeddings.shape[1]), dtype=np.float32)
+        vectors[known] = self._get_normalised_rows(
+            [self.uri_index[ent] for ent in entities if ent in self.uri_index]
+        )
+
+        return vectors, known
+
+    async def get_neighbours(self, entities: List[str], k: int) -> Dict[str, list]:
+        """Same as `neighbours`, run in a thread so as not to block the event loop. Matches the interface of
+        `vectors.VectorsClient`."""
+        with metrics.time_upstream("vectors"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.neighbours, entities, k
+            )
+
+    async def get_distance(self, entity_a: str, entity_b: str) -> float:
+        with metrics.time_upstream("vectors"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.distance, entity_a, entity_b
+            )
+
+    async def get_distance_matrix(
+        self, entities_a: List[str], entities_b: List[str]
+    ) -> List[List[Optional[float]]]:
+        with metrics.time_upstream("vectors"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.distance_matrix, entities_a, entities_b
+            )
+
+    async def close(self):
+        pass
@@ -0,0 +1,54 @@
+"""Shared pooled HTTP clients for calling external APIs.
+"""
+from typing import Dict
+import httpx
+from api_utils import logging
+
+logger = logging.get_logger(__name__)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(
+    name: str,
+    timeout: float = 10.0,
+    max_connections: int = 20,
+    max_keepalive_connections: int = 10,
+    **kwargs,
+) -> httpx.AsyncClient:
+    """Get the pooled client registered under `name`, creating it on first use. Connections are kept alive between
+    calls so repeated requests to the same host don't pay for a new TCP/TLS handshake each time.
+
+    Args:
+        name (str): name for the client, usually the name of the API it's used for
+        timeout (float, optional): timeout in seconds. Defaults to 10.0.
+        max_connections (int, optional): maximum number of concurrent connections. Defaults to 20.
+        max_keepalive_connections (int, optional): maximum number of idle connections kept open. Defaults to 10.
+        **kwargs: passed to `httpx.AsyncClient`
+
+    Returns:
+        httpx.AsyncClient
+    """
+    client = _clients.get(name)
+
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            **kwargs,
+        )
+        _clients[name] = client
+        logger.debug(f"Created HTTP client {name}")
+
+    return client
+
+
+async def close_all():
+    """Close every client created by `get_client`."""
+    for client in _clients.values():
+        await client.aclose()
+
+    _clients.clear()
@@ -0,0 +1,255 @@
+"""Two-tier cache for entity labels: a bounded in-process LRU in front of an SQLite store on local disk.
+
+The SQLite store survives restarts and, as it runs in WAL mode, can be shared by every uvicorn worker on the same
+host. It's read and written in a thread so that a worker waiting for another's write doesn't block its event loop,
+and expired labels are deleted from it every `purge_interval` seconds. Labels are namespaced by source (e.g. `kg`,
+`wikidata`, `vam`) so that each source can have its own TTL. A label of `None` is cached as a negative result,
+meaning the URI is known to have no label in that source.
+"""
+import asyncio
+from collections import OrderedDict, defaultdict
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from api_utils import logging
+
+logger = logging.get_logger(__name__)
+
+# sentinel returned by `LabelCache.get` when a URI isn't in the cache
+MISSING = object()
+
+DEFAULT_TTLS = {
+    "kg": 7 * 24 * 60 * 60,
+    "wikidata": 7 * 24 * 60 * 60,
+    "vam": 30 * 24 * 60 * 60,
+    "elasticsearch": 7 * 24 * 60 * 60,
+}
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+DEFAULT_PURGE_INTERVAL = 60 * 60
+SQLITE_MAX_PARAMS = 500
+
+
+class LabelCache:
+    def __init__(
+        self,
+        path: Optional[str],
+        max_size: int = 100_000,
+        ttls: Optional[Dict[str, float]] = None,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        busy_timeout: float = 1.0,
+        purge_interval: float = DEFAULT_PURGE_INTERVAL,
+    ):
+        """
+        Args:
+            path (Optional[str]): path to the SQLite file. If None only the in-memory LRU is used.
+            max_size (int, optional): maximum number of labels held in memory. Defaults to 100_000.
+            ttls (Optional[Dict[str, float]], optional): time-to-live in seconds of labels from each source. Sources
+                not listed here fall back to the longest TTL in `DEFAULT_TTLS`.
+            negative_ttl (float, optional): time-to-live in seconds of negative results. Defaults to one day.
+            busy_timeout (float, optional): time in seconds to wait for another worker's write to the SQLite file
+                before giving up, in which case labels are left unread or unwritten. Defaults to 1.0.
+            purge_interval (float, optional): time in seconds between deletions of expired labels from the SQLite
+                file, which happen after writes. Defaults to one hour.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.negative_ttl = negative_ttl
+        self.busy_timeout = busy_timeout
+        self.purge_interval = purge_interval
+
+        self._lru = OrderedDict()
+        # guards the in-memory LRU
+        self._lock = threading.Lock()
+        # guards the SQLite connection, which is used from executor threads
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._last_purge = time.time()
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def db(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and self.path:
+            db = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS labels (
+                    source TEXT NOT NULL,
+                    uri TEXT NOT NULL,
+                    label TEXT,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (source, uri)
+                )"""
+            )
+            # only kept once it's set up, so that a failure part way through (e.g. the file being locked by another
+            # worker) is retried next time
+            self._db = db
+            logger.debug(f"Opened label cache at {self.path}")
+
+        return self._db
+
+    def _ttl(self, source: str, label: Optional[str]) -> float:
+        if label is None:
+            return self.negative_ttl
+
+        return self.ttls.get(source, max(DEFAULT_TTLS.values()))
+
+    def _remember(self, key: tuple, label: Optional[str], expires_at: float):
+        self._lru[key] = (label, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    async def get_many(
+        self, source: str, uris: Iterable[str]
+    ) -> Dict[str, Optional[str]]:
+        """Look up the labels for `uris` from `source`.
+
+        Returns:
+            Dict[str, Optional[str]]: mapping of each cached URI to its label. URIs which aren't cached are left out,
+                and URIs cached as having no label map to None.
+        """
+        now = time.time()
+        found = {}
+        not_in_memory = []
+
+        with self._lock:
+            for uri in uris:
+                item = self._lru.get((source, uri))
+                if item is not None and item[1] > now:
+                    self._lru.move_to_end((source, uri))
+                    found[uri] = item[0]
+                    self._counters[source]["memory_hits"] += 1
+                else:
+                    not_in_memory.append(uri)
+
+        disk_hits = 0
+        if not_in_memory and self.path:
+            rows = await asyncio.get_running_loop().run_in_executor(
+                None, self._read, source, not_in_memory, now
+            )
+            with self._lock:
+                for uri, label, expires_at in rows:
+                    self._remember((source, uri), label, expires_at)
+                    found[uri] = label
+            disk_hits = len(rows)
+            self._counters[source]["disk_hits"] += disk_hits
+
+        self._counters[source]["misses"] += len(not_in_memory) - disk_hits
+
+        return found
+
+    async def get(self, source: str, uri: str, default=MISSING):
+        """Look up the label for a single URI. Returns `default` if it isn't cached."""
+        return (await self.get_many(source, [uri])).get(uri, default)
+
+    async def set_many(self, source: str, labels: Dict[str, Optional[str]]):
+        """Store labels from `source`. A label of None is stored as a negative result."""
+        now = time.time()
+        rows = [
+            (source, uri, label, now + self._ttl(source, label))
+            for uri, label in labels.items()
+        ]
+
+        with self._lock:
+            for _, uri, label, expires_at in rows:
+                self._remember((source, uri), label, expires_at)
+
+        if rows and self.path:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+
+    async def set(self, source: str, uri: str, label: Optional[str]):
+        await self.set_many(source, {uri: label})
+
+    def _read(
+        self, source: str, uris: List[str], now: float
+    ) -> List[Tuple[str, Optional[str], float]]:
+        """Read unexpired labels from the SQLite file. Labels which can't be read, e.g. because another worker has
+        held a write lock for longer than `busy_timeout`, are treated as not cached."""
+        rows = []
+        with self._db_lock:
+            try:
+                # stay under SQLite's limit on the number of query parameters
+                for start in range(0, len(uris), SQLITE_MAX_PARAMS):
+                    end = start + SQLITE_MAX_PARAMS
+                    batch = uris[start:end]
+                    rows += self.db.execute(
+                        f"""SELECT uri, label, expires_at FROM labels
+                        WHERE source = ? AND expires_at > ? AND uri IN ({",".join("?" * len(batch))})""",
+                        [source, now, *batch],
+                    ).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Failed to read from label cache: {e!r}")
+
+        return rows
+
+    def _write(self, rows: List[Tuple[str, str, Optional[str], float]]):
+        """Write labels to the SQLite file, and delete expired labels if it's been `purge_interval` seconds since
+        that was last done. Labels which can't be written are only cached in memory."""
+        with self._db_lock:
+            try:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO labels (source, uri, label, expires_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Failed to write to label cache: {e!r}")
+                return
+
+        if time.time() - self._last_purge >= self.purge_interval:
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """Delete expired labels from the on-disk store. Returns the number of labels deleted."""
+        self._last_purge = time.time()
+
+        if not self.path:
+            return 0
+
+        with self._db_lock:
+            try:
+                deleted = self.db.execute(
+                    "DELETE FROM labels WHERE expires_at <= ?", (time.time(),)
+                ).rowcount
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Failed to purge label cache: {e!r}")
+                return 0
+
+        logger.debug(f"Purged {deleted} expired labels from the label cache")
+
+        return deleted
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit and miss counters for each source, plus the current number of labels held in memory."""
+        return {
+            "memory_size": len(self._lru),
+            "sources": {
+                source: dict(counters) for source, counters in self._counters.items()
+            },
+        }
+
+
+def from_env() -> LabelCache:
+    """Create a label cache configured from environment variables."""
+    return LabelCache(
+        path=os.getenv("LABEL_CACHE_PATH", "label_cache.sqlite3") or None,
+        max_size=int(os.getenv("LABEL_CACHE_MAX_SIZE", 100_000)),
+        ttls={
+            source: float(os.environ[f"LABEL_CACHE_TTL_{source.upper()}"])
+            for source in DEFAULT_TTLS
+            if f"LABEL_CACHE_TTL_{source.upper()}" in os.environ
+        },
+        negative_ttl=float(os.getenv("LABEL_CACHE_NEGATIVE_TTL", DEFAULT_NEGATIVE_TTL)),
+        busy_timeout=float(os.getenv("LABEL_CACHE_BUSY_TIMEOUT", 1)),
+        purge_interval=float(
+            os.getenv("LABEL_CACHE_PURGE_INTERVAL", DEFAULT_PURGE_INTERVAL)
+        ),
+    )
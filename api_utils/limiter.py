@@ -0,0 +1,213 @@
+"""Adaptive limits on the number of concurrent requests to an upstream, with load shedding, so that bursts of
+requests queue briefly or are turned away instead of overloading the upstream and slowing every request down.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+from api_utils import logging, metrics
+from api_utils.resilience import UpstreamUnavailableError
+
+logger = logging.get_logger(__name__)
+
+_registry: Dict[str, "AdaptiveLimiter"] = {}
+
+
+class OverloadedError(UpstreamUnavailableError):
+    """Raised when a request to an upstream is shed because too many requests are already waiting for it."""
+
+
+class _Slot:
+    def __init__(self):
+        self.overloaded = False
+
+    def mark_overloaded(self):
+        """Count the request as a sign of overload, e.g. because the upstream responded with 429 or 503."""
+        self.overloaded = True
+
+
+class AdaptiveLimiter:
+    """Limits the number of requests in flight to an upstream, adjusting the limit with AIMD (additive increase,
+    multiplicative decrease) as the upstream's capacity changes.
+
+    Each request which finishes within `latency_target` seconds, while the limit is at least half used, raises the
+    limit by `1 / limit`, so it grows by about one for each limit's worth of requests. A request which fails, is
+    marked as overloaded or takes longer than `latency_target` cuts the limit by `backoff_ratio`, at most once for
+    requests started before the last cut, so one burst of slow responses only cuts it once.
+
+    Requests over the limit wait in a queue of at most `max_queue`, first come first served, for at most
+    `queue_timeout` seconds. Requests which don't fit in the queue or wait too long are shed with `OverloadedError`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 20,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        latency_target: float = 5.0,
+        backoff_ratio: float = 0.9,
+        max_queue: int = 200,
+        queue_timeout: float = 10.0,
+    ):
+        """
+        Args:
+            name (str): name of the upstream, used for metrics and in errors
+            initial_limit (int, optional): concurrency limit to start with. Defaults to 20.
+            min_limit (int, optional): lowest the limit can go. Defaults to 1.
+            max_limit (int, optional): highest the limit can go, e.g. the size of the connection pool. Defaults to
+                100.
+            latency_target (float, optional): seconds above which a request counts as a sign of overload. Defaults
+                to 5.0.
+            backoff_ratio (float, optional): factor the limit is multiplied by on overload. Defaults to 0.9.
+            max_queue (int, optional): number of requests which can wait for a slot. Defaults to 200.
+            queue_timeout (float, optional): seconds a request can wait for a slot. Defaults to 10.0.
+        """
+        self.name = name
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        # moving average of request latency, for estimating how long the queue will take to clear
+        self._mean_latency = 0.0
+        self._counters = {"completed": 0, "overloaded": 0, "shed": 0}
+        metrics.CONCURRENCY_LIMIT.set(self.limit, service=name)
+        _registry[name] = self
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _retry_after(self) -> float:
+        """Estimate of the seconds until the queue has cleared."""
+        return max(len(self._waiters) / self.limit * self._mean_latency, 1.0)
+
+    def _shed(self, reason: str, description: str):
+        self._counters["shed"] += 1
+        metrics.REQUESTS_SHED.inc(service=self.name, reason=reason)
+        raise OverloadedError(self.name, description, self._retry_after())
+
+    async def _acquire(self):
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._shed("queue_full", "too many requests waiting")
+
+        # the future is resolved by `_release` once it has handed over a slot
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self._release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self._shed("queue_timeout", f"no capacity within {self.queue_timeout}s")
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def _record(self, start: float, latency: float, overloaded: bool):
+        self._counters["completed"] += 1
+        self._mean_latency += 0.1 * (latency - self._mean_latency)
+
+        if overloaded or latency > self.latency_target:
+            self._counters["overloaded"] += 1
+            if start >= self._last_decrease:
+                self._limit = max(self._limit * self.backoff_ratio, self.min_limit)
+                self._last_decrease = time.monotonic()
+                logger.info(
+                    f"{self.name} overloaded, cut concurrency limit to {self.limit}"
+                )
+        # only grow the limit when it's being used, so it doesn't drift up while traffic is light
+        elif self._in_flight >= self._limit / 2:
+            self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+
+        metrics.CONCURRENCY_LIMIT.set(self.limit, service=self.name)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for a slot to make a request in, yielding an object whose `mark_overloaded()` can be called if the
+        response shows the upstream is overloaded. Exceptions raised in the block also count as overload.
+
+        Raises:
+            OverloadedError: if the request is shed rather than waiting for a slot
+        """
+        await self._acquire()
+        slot = _Slot()
+        start = time.monotonic()
+        cancelled = False
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            # a cancelled request says nothing about the upstream, so only release its slot
+            cancelled = True
+            raise
+        except Exception:
+            slot.mark_overloaded()
+            raise
+        finally:
+            if not cancelled:
+                self._record(start, time.monotonic() - start, slot.overloaded)
+            self._release()
+
+    def stats(self) -> Dict:
+        """Current limit, requests in flight and waiting, and counters of requests completed, overloaded and shed."""
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            **self._counters,
+        }
+
+
+def from_env(name: str, **defaults) -> AdaptiveLimiter:
+    """Create an `AdaptiveLimiter`, overriding `defaults` with the environment variables `<NAME>_CONCURRENCY_INITIAL`,
+    `<NAME>_CONCURRENCY_MIN`, `<NAME>_CONCURRENCY_MAX`, `<NAME>_LATENCY_TARGET`, `<NAME>_QUEUE_SIZE` and
+    `<NAME>_QUEUE_TIMEOUT` where they're set."""
+    settings = {
+        "initial_limit": ("CONCURRENCY_INITIAL", int),
+        "min_limit": ("CONCURRENCY_MIN", int),
+        "max_limit": ("CONCURRENCY_MAX", int),
+        "latency_target": ("LATENCY_TARGET", float),
+        "max_queue": ("QUEUE_SIZE", int),
+        "queue_timeout": ("QUEUE_TIMEOUT", float),
+    }
+    kwargs = dict(defaults)
+    for arg, (suffix, parse) in settings.items():
+        value = os.getenv(f"{name.upper()}_{suffix}")
+        if value:
+            kwargs[arg] = parse(value)
+
+    return AdaptiveLimiter(name, **kwargs)
+
+
+def all_stats() -> Dict[str, Dict]:
+    """Stats for every `AdaptiveLimiter`, keyed by name."""
+    return {name: limiter.stats() for name, limiter in _registry.items()}
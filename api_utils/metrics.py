@@ -0,0 +1,288 @@
+"""Latency metrics, exported in the Prometheus text format at `/metrics` and per response in `Server-Timing` headers.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+from starlette.datastructures import MutableHeaders
+
+# the charset is added by the response
+CONTENT_TYPE = "text/plain; version=0.0.4"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+# name -> [total seconds, count] for the current request, or None outside a request
+_server_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar(
+    "server_timings", default=None
+)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} has labels {self.label_names}, got {tuple(labels)}"
+            )
+
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines += [
+            f"{name}{_format_labels(labels)} {_format_value(value)}"
+            for name, labels, value in self._samples()
+        ]
+
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield f"{self.name}_total", dict(zip(self.label_names, key)), value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.label_names, key)), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str] = (),
+        buckets: Tuple[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        # buckets are inclusive of their upper bound
+        idx = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            if key not in self._values:
+                # [count in each bucket (not cumulative, the last is +Inf), sum]
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            self._values[key][0][idx] += 1
+            self._values[key][1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                yield f"{self.name}_bucket", bucket_labels, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+REQUEST_DURATION = Histogram(
+    "hc_http_request_duration_seconds",
+    "Time taken to respond to requests, by endpoint.",
+    ("method", "path", "status"),
+)
+UPSTREAM_DURATION = Histogram(
+    "hc_upstream_request_duration_seconds",
+    "Time taken by requests to upstream services.",
+    ("service",),
+)
+UPSTREAM_ERRORS = Counter(
+    "hc_upstream_request_errors",
+    "Requests to upstream services which raised an exception.",
+    ("service",),
+)
+UPSTREAM_REJECTED = Counter(
+    "hc_upstream_requests_rejected",
+    "Requests to upstream services not made because their circuit breaker was open.",
+    ("service",),
+)
+CONCURRENCY_LIMIT = Gauge(
+    "hc_upstream_concurrency_limit",
+    "Current adaptive limit on concurrent requests to upstream services.",
+    ("service",),
+)
+REQUESTS_SHED = Counter(
+    "hc_upstream_requests_shed",
+    "Requests to upstream services not made because too many were already waiting.",
+    ("service", "reason"),
+)
+LABELS_RESOLVED = Counter(
+    "hc_labels_resolved",
+    "Labels found for entities, by the source they were found in.",
+    ("source",),
+)
+STAGE_DURATION = Histogram(
+    "hc_stage_duration_seconds",
+    "Time taken by processing stages within requests.",
+    ("stage",),
+)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format."""
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+def record_server_timing(name: str, seconds: float):
+    """Add `seconds` to the time spent on `name` in the current request's `Server-Timing` header, if there is a
+    current request."""
+    timings = _server_timings.get()
+    if timings is not None:
+        timing = timings.setdefault(name, [0.0, 0])
+        timing[0] += seconds
+        timing[1] += 1
+
+
+@contextmanager
+def time_upstream(service: str):
+    """Time a request to an upstream service, e.g. "sparql" or "wikidata"."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(service=service)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_DURATION.observe(elapsed, service=service)
+        record_server_timing(service, elapsed)
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Time a processing stage within a request, e.g. "flatten" or "render"."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        record_server_timing(stage, elapsed)
+
+
+def format_server_timing(timings: Dict[str, list], total: float) -> str:
+    """Format timings as a `Server-Timing` header value. Time spent on concurrent calls to the same service is
+    summed, so can add up to more than `total`."""
+    metrics = [
+        f'{name};dur={seconds * 1e3:.1f};desc="{count} calls"'
+        if count > 1
+        else f"{name};dur={seconds * 1e3:.1f}"
+        for name, (seconds, count) in timings.items()
+    ]
+
+    return ", ".join(metrics + [f"total;dur={total * 1e3:.1f}"])
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware which times each request, adding a `Server-Timing` header to the response with the time spent
+    in each upstream service and processing stage, and recording the total time in `REQUEST_DURATION`.
+
+    Streaming responses only include timings recorded before the response starts."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _server_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_server_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append(
+                    "Server-Timing",
+                    format_server_timing(timings, time.perf_counter() - start),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            _server_timings.reset(token)
+            # only record requests which matched a route, to bound the number of paths
+            if "endpoint" in scope:
+                REQUEST_DURATION.observe(
+                    time.perf_counter() - start,
+                    method=scope["method"],
+                    path=scope["path"],
+                    status=str(status),
+                )
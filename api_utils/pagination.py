@@ -0,0 +1,26 @@
+"""Opaque cursors for paginated endpoints.
+"""
+import base64
+import binascii
+import json
+
+
+def encode_cursor(state) -> str:
+    """Encode any JSON-serialisable pagination state as an opaque, URL-safe cursor."""
+    return (
+        base64.urlsafe_b64encode(
+            json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode("utf8")
+        )
+        .decode("ascii")
+        .rstrip("=")
+    )
+
+
+def decode_cursor(cursor: str):
+    """Decode a cursor created by `encode_cursor`. Raises a `ValueError` if the cursor is invalid."""
+    try:
+        return json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf8")
+        )
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
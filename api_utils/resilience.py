@@ -0,0 +1,302 @@
+"""Retries, deadlines and circuit breakers for calls to upstream services, so that a slow or failing upstream is
+given up on quickly instead of holding up every request which depends on it.
+"""
+import asyncio
+import email.utils
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+from api_utils import logging, metrics
+
+logger = logging.get_logger(__name__)
+
+# statuses worth retrying: rate limited, or the upstream (or a proxy in front of it) is temporarily unavailable
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+_registry: Dict[str, "Upstream"] = {}
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open, or when a call to an upstream (including
+    any retries) runs past its deadline, gets no response or only gets error responses (5xx or 429)."""
+
+    def __init__(
+        self,
+        service: str,
+        reason: str,
+        retry_after: Optional[float] = None,
+        status_code: Optional[int] = None,
+    ):
+        """
+        Args:
+            service (str): name of the upstream
+            reason (str): why the upstream is unavailable
+            retry_after (Optional[float], optional): seconds after which the upstream may be available again, if
+                known. Defaults to None.
+            status_code (Optional[int], optional): status of the upstream's last response, if it sent one. Defaults
+                to None.
+        """
+        super().__init__(f"{service} unavailable: {reason}")
+        self.service = service
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a `Retry-After` header, which is either a number of seconds or an HTTP date. Returns None
+    if the header is missing or can't be parsed."""
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(
+            email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Fails calls fast once an upstream has failed `failure_threshold` times in a row.
+
+    The breaker is closed (calls go through) until then, when it opens (calls are rejected) for `reset_timeout`
+    seconds. After that it's half-open: one trial call is let through, and the breaker closes if it succeeds or opens
+    again if it fails.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+
+        return "half-open"
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a trial call through."""
+        if self._opened_at is None:
+            return 0.0
+
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        """Whether a call can be made now. In the half-open state only the first caller is allowed through, and must
+        report back with `record_success` or `record_failure`."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+
+        return False
+
+    def release(self):
+        """Let another trial call through in the half-open state, when the trial call was abandoned without an
+        outcome."""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_in_flight or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_after": round(self.retry_after(), 3),
+        }
+
+
+class Upstream:
+    """Policy for calling one upstream service: a circuit breaker, bounded retries with exponential backoff (or the
+    upstream's `Retry-After`) for connection errors and `RETRY_STATUSES`, and a deadline for the whole call including
+    retries. Every attempt is timed in `metrics` under the upstream's name."""
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        deadline: Optional[float] = None,
+        base_delay: float = 0.2,
+        max_delay: float = 5.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        """
+        Args:
+            name (str): name of the upstream, e.g. "sparql", used for metrics and in errors
+            max_attempts (int, optional): attempts per call, including the first. Defaults to 3.
+            deadline (Optional[float], optional): seconds after which a call is given up on, including time spent
+                waiting between attempts. Defaults to None (no deadline other than the client's timeout).
+            base_delay (float, optional): delay in seconds before the first retry, doubling with each retry, when the
+                upstream doesn't send `Retry-After`. Jittered so that callers don't retry in lockstep. Defaults to 0.2.
+            max_delay (float, optional): maximum delay between attempts without `Retry-After`. Defaults to 5.0.
+            failure_threshold (int, optional): consecutive failed calls after which the circuit breaker opens.
+                Defaults to 5.
+            reset_timeout (float, optional): seconds the circuit breaker stays open for. Defaults to 30.0.
+        """
+        self.name = name
+        self.max_attempts = max(max_attempts, 1)
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        _registry[name] = self
+
+    def check(self):
+        """Raise `UpstreamUnavailableError` if the circuit breaker is open. For callers which make their own
+        (e.g. synchronous) requests and report the outcome with `breaker.record_success`/`record_failure`."""
+        if not self.breaker.allow():
+            metrics.UPSTREAM_REJECTED.inc(service=self.name)
+            raise UpstreamUnavailableError(
+                self.name, "circuit breaker open", self.breaker.retry_after()
+            )
+
+    async def request(
+        self, send: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        """Make a request to the upstream with `send`, retrying it if it fails.
+
+        Args:
+            send (Callable[[], Awaitable[httpx.Response]]): function which sends the request, called once per attempt
+
+        Raises:
+            UpstreamUnavailableError: if the circuit breaker is open, the deadline is reached, the last attempt
+                failed to get a response or the last response has a retryable or 5xx status
+
+        Returns:
+            httpx.Response: the first response which isn't retryable. Client errors (4xx other than 429) are returned
+                for the caller to handle.
+        """
+        self.check()
+        start = time.monotonic()
+
+        try:
+            response = await self._request_with_retries(send, start)
+        except asyncio.CancelledError:
+            # the caller gave up, which says nothing about the upstream, but a half-open trial has to be released
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code in RETRY_STATUSES or response.status_code >= 500:
+            self.breaker.record_failure()
+            raise UpstreamUnavailableError(
+                self.name,
+                f"status {response.status_code}",
+                parse_retry_after(response.headers.get("retry-after")),
+                status_code=response.status_code,
+            )
+
+        self.breaker.record_success()
+
+        return response
+
+    def _remaining(self, start: float) -> Optional[float]:
+        if self.deadline is None:
+            return None
+
+        return self.deadline - (time.monotonic() - start)
+
+    async def _request_with_retries(
+        self, send: Callable[[], Awaitable[httpx.Response]], start: float
+    ) -> httpx.Response:
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = self._remaining(start)
+            if remaining is not None and remaining <= 0:
+                raise UpstreamUnavailableError(
+                    self.name, f"no response within {self.deadline}s"
+                )
+
+            response = None
+            try:
+                with metrics.time_upstream(self.name):
+                    response = await asyncio.wait_for(send(), remaining)
+            except asyncio.TimeoutError:
+                raise UpstreamUnavailableError(
+                    self.name, f"no response within {self.deadline}s"
+                )
+            except httpx.TransportError as e:
+                if attempt == self.max_attempts:
+                    raise UpstreamUnavailableError(self.name, repr(e)) from e
+                error = repr(e)
+                retry_after = None
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                metrics.UPSTREAM_ERRORS.inc(service=self.name)
+                if attempt == self.max_attempts:
+                    return response
+                error = f"status {response.status_code}"
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+
+            if retry_after is None:
+                retry_after = random.uniform(
+                    0, min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+                )
+
+            remaining = self._remaining(start)
+            if remaining is not None and retry_after >= remaining:
+                # the upstream won't be ready before the deadline, so don't wait for it
+                if response is not None:
+                    return response
+                raise UpstreamUnavailableError(
+                    self.name, f"no response within {self.deadline}s"
+                )
+
+            logger.warning(
+                f"{self.name} request failed ({error}), retrying in {retry_after:.2f}s "
+                f"(attempt {attempt}/{self.max_attempts})"
+            )
+            await asyncio.sleep(retry_after)
+
+    def stats(self) -> Dict:
+        return self.breaker.stats()
+
+
+def from_env(name: str, **defaults) -> Upstream:
+    """Create an `Upstream`, overriding `defaults` with the environment variables `<NAME>_MAX_ATTEMPTS`,
+    `<NAME>_DEADLINE`, `<NAME>_BREAKER_THRESHOLD` and `<NAME>_BREAKER_RESET` where they're set."""
+    settings = {
+        "max_attempts": ("MAX_ATTEMPTS", int),
+        "deadline": ("DEADLINE", float),
+        "failure_threshold": ("BREAKER_THRESHOLD", int),
+        "reset_timeout": ("BREAKER_RESET", float),
+    }
+    kwargs = dict(defaults)
+    for arg, (suffix, parse) in settings.items():
+        value = os.getenv(f"{name.upper()}_{suffix}")
+        if value:
+            kwargs[arg] = parse(value)
+
+    return Upstream(name, **kwargs)
+
+
+def all_stats() -> Dict[str, Dict]:
+    """Circuit breaker state for every `Upstream`, keyed by name."""
+    return {name: upstream.stats() for name, upstream in _registry.items()}
@@ -0,0 +1,29 @@
+"""Fast JSON responses. Uses orjson if it's installed, falling back to the standard library otherwise.
+"""
+import json
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Serialise `content` to compact UTF-8 JSON."""
+    if orjson is not None:
+        # keys can be subclasses of str, e.g. the `HttpUrl`s in a /labels response
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with `dumps`. Used as the app's default response class, and returned directly by
+    endpoints to skip validation against their `response_model` (see `TRUST_UPSTREAM_RESPONSES` in `main`)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,395 @@
+"""In-memory prefix index of entity labels, for typeahead search.
+
+Labels are normalised (see `normalise`) and stored one after another in a single UTF-8 buffer, each followed by a NUL
+byte. The index itself is an array of the positions in that buffer where each word of each label starts, sorted by
+the text from that position onwards, so the words starting with a prefix are a contiguous range of the array, found by
+binary search. Matches are ranked by how well they match (the whole label, the start of the label, then any word in
+it), then by the entity's score (e.g. its number of connections), then by the length of the label.
+
+Each indexed word costs 4 bytes, and each label its original and normalised text, its URI and a few offsets. See
+`PrefixIndex.memory_usage` and `python -m benchmarks.search` for the memory used by millions of labels.
+"""
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+import numpy as np
+from api_utils import logging
+
+logger = logging.get_logger(__name__)
+
+# most results returned by a single search
+MAX_RESULTS = 50
+# characters of each normalised label which are indexed. Longer queries are truncated to this length.
+MAX_NORMALISED_LENGTH = 64
+# words of each label which are indexed, so that long labels (e.g. object descriptions) don't dominate the index
+MAX_WORDS = 8
+# bytes of each key sorted with numpy when building the index. Keys which share this many bytes are sorted in Python.
+SORT_PREFIX_BYTES = 16
+SORT_CHUNK_SIZE = 1_000_000
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalise(text: str) -> str:
+    """Normalise text for matching: lowercase, without accents, and with runs of punctuation and whitespace replaced
+    by a single space."""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+
+    return _NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def _offsets_dtype(size: int) -> type:
+    return np.uint32 if size < 2**32 else np.int64
+
+
+def _pack(strings: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into a buffer and the offset of each string in it, plus the length of the buffer."""
+    lengths = np.fromiter((len(s) for s in strings), dtype=np.int64, count=len(strings))
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return (
+        np.frombuffer(b"".join(strings), dtype=np.uint8),
+        offsets.astype(_offsets_dtype(int(offsets[-1]))),
+    )
+
+
+def _key_at(data: bytes, position: int) -> bytes:
+    """The NUL-terminated text in `data` starting at `position`."""
+    end = data.index(b"\0", position)
+
+    return data[position:end]
+
+
+def _sort_keys(normalised: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Sort positions in `normalised` by the NUL-terminated text starting at each of them."""
+    # keys are sorted by their first SORT_PREFIX_BYTES bytes in numpy, as fixed-width byte strings
+    padded = np.concatenate([normalised, np.zeros(SORT_PREFIX_BYTES, dtype=np.uint8)])
+    prefixes = np.empty((len(keys), SORT_PREFIX_BYTES), dtype=np.uint8)
+    for start in range(0, len(keys), SORT_CHUNK_SIZE):
+        end = start + SORT_CHUNK_SIZE
+        chunk = padded[
+            keys[start:end, None].astype(np.int64) + np.arange(SORT_PREFIX_BYTES)
+        ]
+        # blank out everything after the end of each label
+        chunk[np.cumsum(chunk == 0, axis=1) > 0] = 0
+        prefixes[start:end] = chunk
+
+    order = np.argsort(prefixes.view(f"S{SORT_PREFIX_BYTES}").ravel(), kind="stable")
+    keys = keys[order]
+    prefixes = prefixes[order]
+
+    # then runs of keys longer than SORT_PREFIX_BYTES which share their first SORT_PREFIX_BYTES bytes are sorted in
+    # full
+    same_as_next = np.all(prefixes[1:] == prefixes[:-1], axis=1) & (
+        prefixes[1:, -1] != 0
+    )
+    edges = np.flatnonzero(
+        np.diff(np.concatenate([[0], same_as_next, [0]]).astype(np.int8))
+    )
+    data = normalised.tobytes()
+    for run_start, run_end in zip(edges[::2], edges[1::2] + 1):
+        keys[run_start:run_end] = sorted(
+            keys[run_start:run_end].tolist(),
+            key=lambda position: _key_at(data, position),
+        )
+
+    return keys
+
+
+class PrefixIndex:
+    def __init__(
+        self,
+        uris: np.ndarray,
+        uri_offsets: np.ndarray,
+        scores: np.ndarray,
+        labels: np.ndarray,
+        label_offsets: np.ndarray,
+        label_uris: np.ndarray,
+        normalised: np.ndarray,
+        normalised_offsets: np.ndarray,
+        keys: np.ndarray,
+        cache_min_matches: int = 1_000,
+    ):
+        """Use `from_labels` or `load` to create an index.
+
+        Args:
+            uris (np.ndarray): UTF-8 encoded URIs
+            uri_offsets (np.ndarray): offset of each URI in `uris`, plus the length of `uris`
+            scores (np.ndarray): score of each URI, higher ranking first
+            labels (np.ndarray): UTF-8 encoded labels
+            label_offsets (np.ndarray): offset of each label in `labels`, plus the length of `labels`
+            label_uris (np.ndarray): URI of each label, as its position in `uri_offsets`
+            normalised (np.ndarray): UTF-8 encoded normalised labels, each followed by a NUL byte
+            normalised_offsets (np.ndarray): offset of each normalised label in `normalised`, plus the length of
+                `normalised`
+            keys (np.ndarray): positions of the start of each indexed word in `normalised`, sorted by the text from
+                there to the end of its label
+            cache_min_matches (int, optional): the top results of prefixes which match at least this many words are
+                cached, so that short prefixes are as quick to search for as long ones. Defaults to 1,000.
+        """
+        self._uris = uris.tobytes()
+        self._uri_offsets = uri_offsets
+        self._scores = scores
+        self._labels = labels.tobytes()
+        self._label_offsets = label_offsets
+        self._label_uris = label_uris
+        self._normalised = normalised.tobytes()
+        self._normalised_offsets = normalised_offsets
+        self._keys = keys
+        self.cache_min_matches = cache_min_matches
+
+        # prefix -> IDs of the top MAX_RESULTS labels
+        self._top_labels: Dict[bytes, np.ndarray] = {}
+        self._top_labels_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._label_uris)
+
+    @property
+    def n_uris(self) -> int:
+        return len(self._scores)
+
+    @classmethod
+    def from_labels(
+        cls,
+        entries: Iterable[Tuple[str, str]],
+        scores: Optional[Mapping[str, float]] = None,
+    ) -> "PrefixIndex":
+        """Build an index from (URI, label) pairs. A URI can have any number of labels, and is returned at most
+        once for each search.
+
+        Args:
+            entries (Iterable[Tuple[str, str]]): (URI, label) pairs
+            scores (Optional[Mapping[str, float]], optional): score of each URI, e.g. its number of connections.
+                URIs which aren't in `scores` have a score of 0. Defaults to None.
+        """
+        uri_ids: Dict[str, int] = {}
+        labels: List[bytes] = []
+        label_uris: List[int] = []
+        normalised: List[bytes] = []
+        seen = set()
+
+        for uri, label in entries:
+            normalised_label = normalise(label)[:MAX_NORMALISED_LENGTH].rstrip()
+            if not normalised_label:
+                continue
+
+            uri_id = uri_ids.setdefault(uri, len(uri_ids))
+            # labels which only differ in case or punctuation (e.g. in different languages) are only indexed once
+            if (uri_id, normalised_label) in seen:
+                continue
+            seen.add((uri_id, normalised_label))
+
+            labels.append(label.encode("utf-8"))
+            label_uris.append(uri_id)
+            normalised.append(normalised_label.encode("utf-8") + b"\0")
+
+        del seen
+        uris_buffer, uri_offsets = _pack([uri.encode("utf-8") for uri in uri_ids])
+        labels_buffer, label_offsets = _pack(labels)
+        normalised_buffer, normalised_offsets = _pack(normalised)
+        del labels, normalised
+
+        uri_scores = np.zeros(len(uri_ids), dtype=np.float32)
+        for uri, score in (scores or {}).items():
+            if uri in uri_ids:
+                uri_scores[uri_ids[uri]] = score
+
+        keys = cls._word_starts(normalised_buffer, normalised_offsets)
+        index = cls(
+            uris=uris_buffer,
+            uri_offsets=uri_offsets,
+            scores=uri_scores,
+            labels=labels_buffer,
+            label_offsets=label_offsets,
+            label_uris=np.array(label_uris, dtype=np.uint32),
+            normalised=normalised_buffer,
+            normalised_offsets=normalised_offsets,
+            keys=_sort_keys(normalised_buffer, keys),
+        )
+        logger.info(
+            f"Built search index of {len(index)} labels of {index.n_uris} URIs ({len(keys)} words)"
+        )
+
+        return index
+
+    @staticmethod
+    def _word_starts(normalised: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """Positions in `normalised` of the start of each of the first `MAX_WORDS` words of each label."""
+        offsets = offsets.astype(np.int64)
+        is_space = normalised == ord(" ")
+        # spaces_before[i] is the number of spaces before position i
+        spaces_before = np.zeros(len(normalised) + 1, dtype=np.int64)
+        np.cumsum(is_space, out=spaces_before[1:])
+
+        word_starts = np.flatnonzero(is_space) + 1
+        label_starts = offsets[np.searchsorted(offsets, word_starts, side="right") - 1]
+        word_numbers = spaces_before[word_starts] - spaces_before[label_starts]
+        keys = np.concatenate([offsets[:-1], word_starts[word_numbers < MAX_WORDS]])
+
+        return keys.astype(_offsets_dtype(len(normalised)))
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "PrefixIndex":
+        """Load an index saved with `save`."""
+        arrays = np.load(path)
+        index = cls(**{name: arrays[name] for name in arrays.files}, **kwargs)
+        logger.info(
+            f"Loaded search index of {len(index)} labels of {index.n_uris} URIs from {path}"
+        )
+
+        return index
+
+    def save(self, path: str):
+        """Save the index to a `.npz` file."""
+        np.savez(
+            path,
+            uris=np.frombuffer(self._uris, dtype=np.uint8),
+            uri_offsets=self._uri_offsets,
+            scores=self._scores,
+            labels=np.frombuffer(self._labels, dtype=np.uint8),
+            label_offsets=self._label_offsets,
+            label_uris=self._label_uris,
+            normalised=np.frombuffer(self._normalised, dtype=np.uint8),
+            normalised_offsets=self._normalised_offsets,
+            keys=self._keys,
+        )
+
+    def _range(self, prefix: bytes) -> Tuple[int, int]:
+        """Range of `keys` which start with `prefix`."""
+        data, keys, length = self._normalised, self._keys, len(prefix)
+
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = int(keys[mid])
+            end = start + length
+            if data[start:end] < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo
+
+        hi = len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = int(keys[mid])
+            end = start + length
+            if data[start:end] <= prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return first, lo
+
+    def _rank(self, prefix: bytes, first: int, last: int, limit: int) -> np.ndarray:
+        """IDs of the top `limit` labels among the words in `keys[first:last]`, at most one per URI."""
+        # keys and offsets have the same dtype, so neither is copied to compare them
+        positions = self._keys[first:last]
+        label_ids = (
+            np.searchsorted(self._normalised_offsets, positions, side="right") - 1
+        )
+        label_starts = self._normalised_offsets[label_ids]
+        at_start = positions == label_starts
+        # not counting the NUL at the end of each label
+        lengths = self._normalised_offsets[label_ids + 1] - label_starts - 1
+        exact = at_start & (lengths == len(prefix))
+        uri_ids = self._label_uris[label_ids]
+
+        # the last key is the most significant
+        order = np.lexsort((lengths, -self._scores[uri_ids], ~at_start, ~exact))
+        _, first_per_uri = np.unique(uri_ids[order], return_index=True)
+
+        return label_ids[order[np.sort(first_per_uri)[:limit]]]
+
+    def _top(self, prefix: bytes, limit: int) -> np.ndarray:
+        cached = self._top_labels.get(prefix)
+        if cached is not None:
+            return cached[:limit]
+
+        first, last = self._range(prefix)
+        if last - first < self.cache_min_matches:
+            return self._rank(prefix, first, last, limit)
+
+        top = self._rank(prefix, first, last, MAX_RESULTS)
+        with self._top_labels_lock:
+            self._top_labels[prefix] = top
+
+        return top[:limit]
+
+    def _result(self, label_id: int) -> dict:
+        uri_id = int(self._label_uris[label_id])
+        uri_start, uri_end = self._uri_offsets[uri_id], self._uri_offsets[uri_id + 1]
+        label_start, label_end = (
+            self._label_offsets[label_id],
+            self._label_offsets[label_id + 1],
+        )
+
+        return {
+            "uri": self._uris[uri_start:uri_end].decode("utf-8"),
+            "label": self._labels[label_start:label_end].decode("utf-8"),
+        }
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """Find entities with a label which starts with `query`, or has a word which does.
+
+        Args:
+            query (str): text typed so far
+            limit (int, optional): maximum number of results, at most `MAX_RESULTS`. Defaults to 10.
+
+        Returns:
+            List[dict]: the URI and matching label of each entity found, best match first
+        """
+        prefix = normalise(query)[:MAX_NORMALISED_LENGTH].rstrip().encode("utf-8")
+        if not prefix:
+            return []
+
+        return [
+            self._result(int(label_id))
+            for label_id in self._top(prefix, min(limit, MAX_RESULTS))
+        ]
+
+    def warm(self, prefixes: Optional[Iterable[str]] = None):
+        """Cache the top results of the prefixes which match the most words, so that the first searches after the
+        index is built are as quick as later ones. By default these are every one and two character prefix of
+        letters and digits."""
+        if prefixes is None:
+            chars = "abcdefghijklmnopqrstuvwxyz0123456789"
+            prefixes = list(chars) + [a + b for a in chars for b in chars]
+
+        for prefix in prefixes:
+            self._top(prefix.encode("utf-8"), MAX_RESULTS)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes used by each part of the index, and in total."""
+        usage = {
+            "uris": len(self._uris) + self._uri_offsets.nbytes,
+            "scores": self._scores.nbytes,
+            "labels": len(self._labels)
+            + self._label_offsets.nbytes
+            + self._label_uris.nbytes,
+            "normalised_labels": len(self._normalised)
+            + self._normalised_offsets.nbytes,
+            "keys": self._keys.nbytes,
+            "cached_results": sum(top.nbytes for top in self._top_labels.values()),
+        }
+        usage["total"] = sum(usage.values())
+
+        return usage
+
+    def stats(self) -> Dict:
+        """Number of URIs, labels and indexed words, and memory usage in bytes."""
+        memory = self.memory_usage()
+
+        return {
+            "uris": self.n_uris,
+            "labels": len(self),
+            "words": len(self._keys),
+            "cached_prefixes": len(self._top_labels),
+            "memory_bytes": memory,
+            "bytes_per_label": round(memory["total"] / max(len(self), 1), 1),
+        }
@@ -0,0 +1,65 @@
+"""Coalescing of identical in-flight calls, so that concurrent callers asking for the same thing share one upstream
+call and its result.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Hashable
+
+_registry: Dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    """Results are shared between every caller of the same call, so callers mustn't mutate them."""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): name of the upstream being called, used when reporting counters
+        """
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._counters = defaultdict(int)
+        _registry[name] = self
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """Run `fn()`, unless a call with the same `key` is already in flight, in which case wait for that call and
+        return its result (or raise its exception) instead.
+
+        Args:
+            key (Hashable): key identifying the call, e.g. the query being sent
+            fn (Callable[[], Awaitable]): function which makes the upstream call
+
+        Returns:
+            the result of `fn()`
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._counters["coalesced"] += 1
+            # shield so that one waiting caller being cancelled doesn't cancel the call for everyone
+            return await asyncio.shield(future)
+
+        self._counters["calls"] += 1
+        future = asyncio.ensure_future(fn())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        # mark the exception as retrieved in case every caller has gone away by the time it's raised
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Number of upstream calls made, and number of calls saved by sharing an in-flight call."""
+        return {
+            "calls": self._counters["calls"],
+            "coalesced": self._counters["coalesced"],
+            "in_flight": len(self._in_flight),
+        }
+
+
+def all_stats() -> Dict[str, Dict[str, int]]:
+    """Counters for every `SingleFlight` instance, keyed by name."""
+    return {name: single_flight.stats() for name, single_flight in _registry.items()}
@@ -0,0 +1,165 @@
+"""Snapshots of precomputed entity pages, so that `/view_connections` can be served without querying the KG.
+
+A snapshot is a single file containing one msgpack-encoded view model per entity, followed by an index of entity
+URIs (sorted) and the offsets of their view models. The file is memory-mapped, and the index is binary searched in
+place, so opening a snapshot is instant and only the pages which are requested are read.
+
+Layout:
+- `MAGIC`
+- view models, one after another
+- index: UTF-8 entity URIs one after another, then the offset of each URI (plus the end of the last) and the offset
+  and length of each URI's view model, as little-endian uint64s
+- footer: `MAGIC`, the number of entities, the offsets of the three parts of the index and the time the snapshot was
+  created (see `FOOTER`)
+"""
+import mmap
+import struct
+import time
+from typing import Optional
+import msgpack
+import numpy as np
+from api_utils import logging
+
+logger = logging.get_logger(__name__)
+
+MAGIC = b"HCSNAP01"
+FOOTER = struct.Struct("<8sQQQQd")
+
+
+class SnapshotWriter:
+    """Writes a snapshot file. View models can be added in any order, and the index is written by `close`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        # entity -> (offset, length) of its view model
+        self._entries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entity: str, view_model: dict):
+        """Add the view model for an entity. If the entity has already been added it is replaced."""
+        data = msgpack.packb(view_model, use_bin_type=True)
+        self._entries[entity] = (self._file.tell(), len(data))
+        self._file.write(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        entities = sorted(self._entries)
+        keys = [entity.encode("utf-8") for entity in entities]
+        key_offsets = np.zeros(len(keys) + 1, dtype="<u8")
+        key_offsets[1:] = np.cumsum([len(key) for key in keys])
+
+        # view models are stored in the order they were added, so each has its own start and end
+        record_offsets = np.array(
+            [self._entries[entity] for entity in entities], dtype="<u8"
+        ).reshape(-1, 2)
+
+        keys_start = self._file.tell()
+        self._file.write(b"".join(keys))
+        key_offsets_start = self._file.tell()
+        self._file.write(key_offsets.tobytes())
+        record_offsets_start = self._file.tell()
+        self._file.write(record_offsets.tobytes())
+        self._file.write(
+            FOOTER.pack(
+                MAGIC,
+                len(entities),
+                keys_start,
+                key_offsets_start,
+                record_offsets_start,
+                time.time(),
+            )
+        )
+        self._file.close()
+
+        logger.info(f"Wrote snapshot of {len(entities)} entities to {self.path}")
+
+
+class EntitySnapshot:
+    """Read-only access to a snapshot file written by `SnapshotWriter`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        footer_start = len(self._mmap) - FOOTER.size
+        (
+            magic,
+            self.n_entities,
+            keys_start,
+            key_offsets_start,
+            record_offsets_start,
+            self.created_at,
+        ) = FOOTER.unpack_from(self._mmap, footer_start)
+
+        if self._mmap.find(MAGIC, 0, len(MAGIC)) != 0 or magic != MAGIC:
+            raise ValueError(f"{path} isn't an entity snapshot")
+
+        self._keys_start = keys_start
+        self._key_offsets = np.frombuffer(
+            self._mmap, dtype="<u8", count=self.n_entities + 1, offset=key_offsets_start
+        )
+        self._record_offsets = np.frombuffer(
+            self._mmap,
+            dtype="<u8",
+            count=self.n_entities * 2,
+            offset=record_offsets_start,
+        ).reshape(-1, 2)
+
+        logger.info(
+            f"Loaded snapshot of {self.n_entities} entities from {path}, created "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.created_at))}"
+        )
+
+    def __len__(self) -> int:
+        return self.n_entities
+
+    def __contains__(self, entity: str) -> bool:
+        return self._find(entity) is not None
+
+    def _key(self, idx: int) -> bytes:
+        start = self._keys_start + int(self._key_offsets[idx])
+        end = self._keys_start + int(self._key_offsets[idx + 1])
+
+        return self._mmap[start:end]
+
+    def _find(self, entity: str) -> Optional[int]:
+        key = entity.encode("utf-8")
+        lo, hi = 0, self.n_entities
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo if lo < self.n_entities and self._key(lo) == key else None
+
+    def get(self, entity: str) -> Optional[dict]:
+        """Get the view model for an entity, or None if it isn't in the snapshot."""
+        idx = self._find(entity)
+        if idx is None:
+            return None
+
+        offset, length = (int(value) for value in self._record_offsets[idx])
+        end = offset + length
+
+        return msgpack.unpackb(self._mmap[offset:end], raw=False)
+
+    def close(self):
+        # the arrays viewing the mmap have to be released before it can be closed
+        self._key_offsets = self._record_offsets = None
+        self._mmap.close()
+        self._file.close()
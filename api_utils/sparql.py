@@ -1,9 +1,79 @@
 """Submodule for SPARQL queries
 """
-from typing import List
+import json
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 
+# keys that results are ordered by when paginating, in order of precedence. Labels are included so that an entity
+# with more than one label can't be split across a page boundary and lose a row.
+P_O_ORDER_KEYS = ["STR(?predicate)", "STR(?object)"]
+P_O_LABELS_ORDER_KEY = 'COALESCE(STR(?objectLabel), "")'
+S_P_ORDER_KEYS = ["STR(?predicate)", "STR(?subject)"]
+S_P_LABELS_ORDER_KEY = 'COALESCE(STR(?subjectLabel), "")'
 
-def get_p_o(h: str, labels: bool, limit: int = None):
+
+class Query(str):
+    """A SPARQL query built by one of the functions in this module. As well as being the query string, it records
+    which function built it (`shape`) and the arguments it was built with (`params`), so that backends which don't
+    speak SPARQL (e.g. `triplestore.LocalSPARQLConnector`) can answer it without parsing it."""
+
+    def __new__(cls, query: str, shape: str, **params):
+        obj = super().__new__(cls, query)
+        obj.shape = shape
+        obj.params = params
+
+        return obj
+
+
+def _literal(value: str) -> str:
+    """Quote a string as a SPARQL string literal."""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _keyset_filter(keys: List[str], after: List[str]) -> str:
+    """FILTER selecting rows which sort after `after` when ordered by `keys`, i.e. the rows on the next page."""
+    if len(after) != len(keys):
+        raise ValueError(f"Expected a key of {len(keys)} values, got {after}")
+
+    clauses = []
+    for idx, key in enumerate(keys):
+        equal_to_previous = [
+            f"{prev_key} = {_literal(value)}"
+            for prev_key, value in zip(keys[:idx], after)
+        ]
+        clauses.append(
+            "("
+            + " && ".join(equal_to_previous + [f"{key} > {_literal(after[idx])}"])
+            + ")"
+        )
+
+    return f"FILTER ({' || '.join(clauses)})"
+
+
+def _paginate(query: str, keys: List[str], after: Optional[List[str]]) -> str:
+    """Add a keyset filter and ORDER BY to `query`, which should end with the closing brace of its WHERE clause."""
+    if after is not None:
+        query = query[: query.rindex("}")] + f"    {_keyset_filter(keys, after)}\n}}"
+
+    return query + f" ORDER BY {' '.join(keys)} "
+
+
+def get_p_o(
+    h: str,
+    labels: bool,
+    limit: int = None,
+    paginate: bool = False,
+    after: Optional[List[str]] = None,
+) -> Query:
+    """
+    Args:
+        h (str): URI of the entity
+        labels (bool): whether to return labels of objects
+        limit (int, optional): maximum number of results
+        paginate (bool, optional): order results deterministically so that they can be paged through using `after`
+        after (Optional[List[str]], optional): key of the last result on the previous page, from `get_p_o_key`. Only
+            used if `paginate` is True.
+    """
     if labels:
         query = f"""
             PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -14,13 +84,50 @@ def get_p_o(h: str, labels: bool, limit: int = None):
     else:
         query = f"""SELECT * WHERE {{<{h}> ?predicate ?object.}}"""
 
+    if paginate:
+        query = _paginate(
+            query, P_O_ORDER_KEYS + ([P_O_LABELS_ORDER_KEY] if labels else []), after
+        )
+
     if limit:
         query += f"LIMIT {limit}"
 
-    return query
+    return Query(
+        query,
+        "p_o",
+        h=h,
+        labels=labels,
+        limit=limit,
+        paginate=paginate,
+        after=after,
+    )
 
 
-def get_s_p(h: str, labels: bool, limit: int = None):
+def get_p_o_key(binding: dict, labels: bool) -> List[str]:
+    """Get the key that a result of `get_p_o` is ordered by when paginating."""
+    key = [binding["predicate"]["value"], binding["object"]["value"]]
+    if labels:
+        key.append(binding.get("objectLabel", {}).get("value", ""))
+
+    return key
+
+
+def get_s_p(
+    h: str,
+    labels: bool,
+    limit: int = None,
+    paginate: bool = False,
+    after: Optional[List[str]] = None,
+) -> Query:
+    """
+    Args:
+        h (str): URI of the entity
+        labels (bool): whether to return labels of subjects
+        limit (int, optional): maximum number of results
+        paginate (bool, optional): order results deterministically so that they can be paged through using `after`
+        after (Optional[List[str]], optional): key of the last result on the previous page, from `get_s_p_key`. Only
+            used if `paginate` is True.
+    """
     if labels:
         query = f"""
             PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -31,18 +138,215 @@ def get_s_p(h: str, labels: bool, limit: int = None):
     else:
         query = f"""SELECT * WHERE {{?subject ?predicate <{h}>.}}"""
 
+    if paginate:
+        query = _paginate(
+            query, S_P_ORDER_KEYS + ([S_P_LABELS_ORDER_KEY] if labels else []), after
+        )
+
     if limit:
         query += f"LIMIT {limit}"
 
-    return query
+    return Query(
+        query,
+        "s_p",
+        h=h,
+        labels=labels,
+        limit=limit,
+        paginate=paginate,
+        after=after,
+    )
+
+
+def get_s_p_key(binding: dict, labels: bool) -> List[str]:
+    """Get the key that a result of `get_s_p` is ordered by when paginating."""
+    key = [binding["predicate"]["value"], binding["subject"]["value"]]
+    if labels:
+        key.append(binding.get("subjectLabel", {}).get("value", ""))
+
+    return key
+
+
+def _values(entities: Iterable[str]) -> str:
+    return f"VALUES ?entity {{{' '.join(f'<{ent}>' for ent in entities)}}}"
+
+
+def _connections_pattern(direction: str, labels: bool) -> str:
+    """Triple pattern for connections from or to `?entity`, with the labels of the other end if `labels` is set."""
+    if direction == "from":
+        pattern = "?entity ?predicate ?object."
+        label_pattern = "OPTIONAL {?object rdfs:label ?objectLabel}."
+    else:
+        pattern = "?subject ?predicate ?entity."
+        label_pattern = "OPTIONAL {?subject rdfs:label ?subjectLabel}."
+
+    return f"{pattern} {label_pattern}" if labels else pattern
+
 
+def get_connections(
+    parts: List[Tuple[str, str, Optional[List[str]]]],
+    labels: bool,
+    limit: int = None,
+    paginate: bool = False,
+    entity_labels: Iterable[str] = (),
+) -> Query:
+    """Get connections from and/or to several entities in one query, which is split back up by
+    `split_connections`. Each binding is the same as a binding of `get_p_o` (connections from an entity) or `get_s_p`
+    (connections to an entity), plus `entity`.
 
-def get_labels(entities: List[str]):
+    Without a limit, the connections in each direction are matched for every entity at once using VALUES. With a
+    limit, or when paginating, each entity and direction is a subquery with its own ORDER BY and LIMIT.
+
+    Args:
+        parts (List[Tuple[str, str, Optional[List[str]]]]): (entity URI, direction, after) for each set of connections
+            to get, where direction is "from" or "to" and after is the key of the last result on the previous page,
+            from `get_p_o_key` or `get_s_p_key` (None for the first page). Only one part for each entity and
+            direction should be included.
+        labels (bool): whether to return labels of objects and subjects
+        limit (int, optional): maximum number of results for each part
+        paginate (bool, optional): order the results of each part deterministically so that they can be paged
+            through using `after`
+        entity_labels (Iterable[str], optional): entities to also return the labels of, as `entity` and
+            `entityLabel` bindings. Defaults to none.
+    """
+    parts = [(ent, direction, after) for ent, direction, after in parts]
+    entity_labels = list(dict.fromkeys(entity_labels))
+    branches = []
+
+    if not (limit or paginate):
+        for direction in ("from", "to"):
+            entities = [
+                ent for ent, part_direction, _ in parts if part_direction == direction
+            ]
+            if entities:
+                branches.append(
+                    f"{_values(dict.fromkeys(entities))} {_connections_pattern(direction, labels)}"
+                )
+    else:
+        for ent, direction, after in parts:
+            subquery = f"SELECT * WHERE {{{_values([ent])} {_connections_pattern(direction, labels)}}}"
+            if paginate:
+                keys = (P_O_ORDER_KEYS if direction == "from" else S_P_ORDER_KEYS) + (
+                    [
+                        P_O_LABELS_ORDER_KEY
+                        if direction == "from"
+                        else S_P_LABELS_ORDER_KEY
+                    ]
+                    if labels
+                    else []
+                )
+                subquery = _paginate(subquery, keys, after)
+            if limit:
+                subquery += f"LIMIT {limit}"
+            branches.append(subquery)
+
+    if entity_labels:
+        branches.append(f"{_values(entity_labels)} ?entity rdfs:label ?entityLabel.")
+
+    union = "\n        UNION\n        ".join(f"{{ {branch} }}" for branch in branches)
+    query = f"""PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+    SELECT * WHERE {{
+        {union}
+    }}"""
+
+    return Query(
+        query,
+        "connections",
+        parts=parts,
+        labels=labels,
+        limit=limit,
+        paginate=paginate,
+        entity_labels=entity_labels,
+    )
+
+
+def split_connections(
+    bindings: List[dict], labels: bool, paginate: bool = False
+) -> Tuple[Dict[Tuple[str, str], List[dict]], Dict[str, Optional[str]]]:
+    """Split the results of `get_connections` back up by entity and direction.
+
+    Args:
+        bindings (List[dict]): results of a `get_connections` query
+        labels (bool): whether the query returned labels
+        paginate (bool, optional): whether the query was paginated, in which case the bindings for each entity and
+            direction are sorted by their key, as the order of results from subqueries isn't kept.
+
+    Returns:
+        Tuple[Dict[Tuple[str, str], List[dict]], Dict[str, Optional[str]]]: bindings without `entity` for each
+            (entity, direction) which has any, and the label of each entity whose label was asked for and found
+    """
+    connections = defaultdict(list)
+    entity_labels = {}
+
+    for binding in bindings:
+        binding = dict(binding)
+        ent = binding.pop("entity")["value"]
+        if "entityLabel" in binding:
+            entity_labels[ent] = binding["entityLabel"]["value"]
+        elif "object" in binding:
+            connections[(ent, "from")].append(binding)
+        else:
+            connections[(ent, "to")].append(binding)
+
+    if paginate:
+        for (ent, direction), part_bindings in connections.items():
+            key_builder = get_p_o_key if direction == "from" else get_s_p_key
+            part_bindings.sort(key=lambda binding: key_builder(binding, labels))
+
+    return dict(connections), entity_labels
+
+
+def get_labels(entities: List[str]) -> Query:
     ent_str = " ".join([f"<{ent}>" for ent in entities])
 
-    return f"""PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+    query = f"""PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
 
     SELECT ?s ?sLabel WHERE {{
         VALUES ?s {{{ent_str}}}.
         OPTIONAL {{?s rdfs:label ?sLabel}}.
     }} """
+
+    return Query(query, "labels", entities=list(entities))
+
+
+def get_top_entities(limit: Optional[int] = None) -> Query:
+    """Get URIs ordered by the number of connections to and from them, most connected first.
+
+    Args:
+        limit (Optional[int], optional): maximum number of results. If None, all URIs which are the subject or object
+            of a triple are returned.
+    """
+    query = """SELECT ?entity (COUNT(*) AS ?connections) WHERE {
+        { ?entity ?predicate ?object } UNION { ?subject ?predicate ?entity }
+        FILTER (isIRI(?entity))
+    } GROUP BY ?entity ORDER BY DESC(?connections) STR(?entity) """
+
+    if limit:
+        query += f"LIMIT {limit}"
+
+    return Query(query, "top_entities", limit=limit)
+
+
+def get_all_labels(page_size: int, after: Optional[str] = None) -> Query:
+    """Get the rdfs:labels of every URI in the KG, a page of `page_size` URIs (in order) at a time. All the labels of
+    each URI are on the same page.
+
+    Args:
+        page_size (int): number of URIs per page
+        after (Optional[str], optional): the last URI on the previous page, or None for the first page
+    """
+    after_filter = f"FILTER (STR(?s) > {_literal(after)})" if after is not None else ""
+
+    query = f"""PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+
+    SELECT ?s ?label WHERE {{
+        {{
+            SELECT DISTINCT ?s WHERE {{
+                ?s rdfs:label ?anyLabel .
+                FILTER (isIRI(?s))
+                {after_filter}
+            }} ORDER BY STR(?s) LIMIT {page_size}
+        }}
+        ?s rdfs:label ?label .
+    }} """
+
+    return Query(query, "all_labels", page_size=page_size, after=after)
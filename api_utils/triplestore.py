@@ -0,0 +1,744 @@
+"""In-process triple store, which can be used in place of a SPARQL endpoint to answer the queries built in
+`api_utils.sparql` from a local dump of the graph.
+
+Terms are interned to integer IDs, in sorted order, and triples are stored as three sorted copies of the ID
+triples: SPO (by subject), POS (by predicate) and OSP (by object). Looking up the triples with a given subject,
+predicate or object is then a binary search. Each term also has the rank of its value among all values, so that
+results can be ordered and paginated by STR() without decoding them, and only the terms on a page are decoded. The
+store can be saved to and loaded from a `.npz` file, so that a
+graph only has to be parsed once.
+
+Graphs in N-Triples format (`.nt` or `.nt.gz`) are parsed directly. Other formats (e.g. Turtle) need rdflib.
+"""
+import array
+import asyncio
+import functools
+import gzip
+import os
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from api_utils import logging, metrics, sparql
+
+logger = logging.get_logger(__name__)
+
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+
+# kinds of term, in the order they're sorted in. The extra part of a term is its datatype for literals and its
+# language for language-tagged literals, and empty otherwise.
+URI = 0
+BNODE = 1
+LITERAL = 2
+LANG_LITERAL = 3
+
+Term = Tuple[int, str, str]
+
+_IRI = r"<([^>]*)>"
+_BNODE = r"_:(\S+?)"
+_LITERAL = r'"((?:[^"\\]|\\.)*)"(?:@([A-Za-z0-9-]+)|\^\^<([^>]*)>)?'
+_NTRIPLES_LINE = re.compile(
+    rf"^\s*(?:{_IRI}|{_BNODE})\s+{_IRI}\s+(?:{_IRI}|{_BNODE}|{_LITERAL})\s*\.\s*$"
+)
+_ESCAPE = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+_ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+
+
+def _unescape(value: str) -> str:
+    if "\\" not in value:
+        return value
+
+    def _replace(match: re.Match) -> str:
+        code = match.group(1) or match.group(2)
+        if code:
+            return chr(int(code, 16))
+
+        return _ESCAPES.get(match.group(3), match.group(3))
+
+    return _ESCAPE.sub(_replace, value)
+
+
+def parse_ntriples(path: str) -> Iterator[Tuple[Term, Term, Term]]:
+    """Parse an N-Triples file, which can be gzipped."""
+    opener = gzip.open if path.endswith(".gz") else open
+
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+
+            match = _NTRIPLES_LINE.match(line)
+            if match is None:
+                raise ValueError(f"Invalid N-Triples at {path}:{line_number}: {line}")
+
+            (
+                s_iri,
+                s_bnode,
+                p_iri,
+                o_iri,
+                o_bnode,
+                o_literal,
+                o_lang,
+                o_datatype,
+            ) = match.groups()
+
+            subject = (
+                (URI, _unescape(s_iri), "")
+                if s_iri is not None
+                else (BNODE, s_bnode, "")
+            )
+            if o_iri is not None:
+                obj = (URI, _unescape(o_iri), "")
+            elif o_bnode is not None:
+                obj = (BNODE, o_bnode, "")
+            elif o_lang is not None:
+                obj = (LANG_LITERAL, _unescape(o_literal), o_lang)
+            else:
+                obj = (LITERAL, _unescape(o_literal), o_datatype or "")
+
+            yield subject, (URI, _unescape(p_iri), ""), obj
+
+
+def parse_with_rdflib(path: str) -> Iterator[Tuple[Term, Term, Term]]:
+    """Parse a graph in any format supported by rdflib, guessing the format from the file extension."""
+    try:
+        import rdflib
+    except ImportError as e:
+        raise ImportError(
+            "rdflib is needed to load graphs which aren't in N-Triples format"
+        ) from e
+
+    def _term(node) -> Term:
+        if isinstance(node, rdflib.BNode):
+            return (BNODE, str(node), "")
+        if isinstance(node, rdflib.Literal):
+            if node.language:
+                return (LANG_LITERAL, str(node), node.language)
+            return (LITERAL, str(node), str(node.datatype or ""))
+
+        return (URI, str(node), "")
+
+    graph = rdflib.Graph()
+    graph.parse(path, format=rdflib.util.guess_format(path))
+
+    for s, p, o in graph:
+        yield _term(s), _term(p), _term(o)
+
+
+def _rank_values(values: List[str]) -> np.ndarray:
+    """Rank of each of `values` in string order, where equal values have the same rank and the empty string (which a
+    missing label is ordered as) has a rank of 0."""
+    ranks = [0] * len(values)
+    rank = 0
+    previous = ""
+    for idx in sorted(range(len(values)), key=values.__getitem__):
+        if values[idx] != previous:
+            rank += 1
+            previous = values[idx]
+        ranks[idx] = rank
+
+    return np.array(ranks, dtype=np.int32 if len(values) < 2**31 else np.int64)
+
+
+def _after_mask(keys: List[np.ndarray], after: List[float]) -> np.ndarray:
+    """Mask of the rows whose keys sort after `after`, i.e. the rows that `sparql._keyset_filter` selects."""
+    mask = np.zeros(len(keys[0]), dtype=bool)
+    equal_to_previous = np.ones(len(keys[0]), dtype=bool)
+    for key, value in zip(keys, after):
+        mask |= equal_to_previous & (key > value)
+        equal_to_previous &= key == value
+
+    return mask
+
+
+def _pack_strings(strings: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into a UTF-8 buffer and the offsets of each string in it."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class TripleStore:
+    def __init__(
+        self,
+        kinds: np.ndarray,
+        values: np.ndarray,
+        value_offsets: np.ndarray,
+        extras: np.ndarray,
+        extra_offsets: np.ndarray,
+        spo: np.ndarray,
+        pos: np.ndarray,
+        osp: np.ndarray,
+        value_ranks: Optional[np.ndarray] = None,
+        term_cache_size: int = 100_000,
+    ):
+        """Use one of `from_triples`, `from_file`, `load` or `load_or_build` to create a store.
+
+        Args:
+            kinds (np.ndarray): kind of each term (`URI`, `BNODE`, `LITERAL` or `LANG_LITERAL`), sorted
+            values (np.ndarray): UTF-8 encoded values of all terms
+            value_offsets (np.ndarray): offset of each term's value in `values`, plus the length of `values`
+            extras (np.ndarray): UTF-8 encoded datatypes or languages of all terms
+            extra_offsets (np.ndarray): offset of each term's datatype or language in `extras`
+            spo (np.ndarray): 3 x n_triples array of subject, predicate and object IDs, sorted by subject, predicate
+                then object
+            pos (np.ndarray): the same triples as `spo` as rows of predicate, object and subject IDs, sorted in that
+                order
+            osp (np.ndarray): the same triples as `spo` as rows of object, subject and predicate IDs, sorted in that
+                order
+            value_ranks (Optional[np.ndarray], optional): rank of each term's value in string order, as computed by
+                `_rank_values`. Computed from `values` if not given, e.g. for stores saved without it.
+            term_cache_size (int, optional): number of decoded terms to keep in memory. Defaults to 100,000.
+        """
+        self.kinds = kinds
+        self._values = values.tobytes()
+        self._value_offsets = value_offsets
+        self._extras = extras.tobytes()
+        self._extra_offsets = extra_offsets
+        self.spo = spo
+        self.pos = pos
+        self.osp = osp
+
+        # terms are sorted by kind then value, so URIs come first, in order
+        self.n_uris = int(np.searchsorted(kinds, URI, side="right"))
+        self._decode = functools.lru_cache(maxsize=term_cache_size)(self._decode)
+        self.rdfs_label = self.lookup_uri(RDFS_LABEL)
+
+        if value_ranks is None:
+            value_ranks = _rank_values(
+                [self._decode.__wrapped__(term_id)[0] for term_id in range(len(kinds))]
+            )
+        self.value_ranks = value_ranks
+        # term IDs in order of their values, and the labels of all subjects, built when first needed
+        self._value_order: Optional[np.ndarray] = None
+        self._label_index: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_triples(cls, triples: Iterable[Tuple[Term, Term, Term]]) -> "TripleStore":
+        """Build a store from (subject, predicate, object) triples, where each term is a (kind, value, extra) tuple.
+        Duplicate triples are removed."""
+        term_ids = {}
+        ids = array.array("q")
+
+        for triple in triples:
+            for term in triple:
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(term_ids)
+                ids.append(term_id)
+
+        # renumber terms in sorted order
+        terms = list(term_ids)
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        new_ids = np.empty(len(terms), dtype=np.int64)
+        new_ids[order] = np.arange(len(terms))
+        terms = [terms[idx] for idx in order]
+
+        dtype = np.int32 if len(terms) < 2**31 else np.int64
+        triples_array = new_ids[np.frombuffer(ids, dtype=np.int64)].reshape(-1, 3)
+        # np.unique sorts rows, so the result is in SPO order
+        spo = np.unique(triples_array, axis=0).astype(dtype)
+        pos = spo[:, [1, 2, 0]]
+        pos = pos[np.lexsort(pos.T[::-1])]
+        osp = spo[:, [2, 0, 1]]
+        osp = osp[np.lexsort(osp.T[::-1])]
+
+        values, value_offsets = _pack_strings(term[1] for term in terms)
+        extras, extra_offsets = _pack_strings(term[2] for term in terms)
+
+        return cls(
+            kinds=np.array([term[0] for term in terms], dtype=np.uint8),
+            values=values,
+            value_offsets=value_offsets,
+            extras=extras,
+            extra_offsets=extra_offsets,
+            spo=np.ascontiguousarray(spo.T),
+            pos=np.ascontiguousarray(pos.T),
+            osp=np.ascontiguousarray(osp.T),
+            value_ranks=_rank_values([term[1] for term in terms]),
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "TripleStore":
+        """Build a store from a graph file. N-Triples files (`.nt`, optionally gzipped) are parsed directly, and
+        other formats are parsed with rdflib."""
+        if path.endswith((".nt", ".nt.gz")):
+            triples = parse_ntriples(path)
+        else:
+            triples = parse_with_rdflib(path)
+
+        store = cls.from_triples(triples)
+        logger.info(f"Loaded {len(store)} triples from {path}")
+
+        return store
+
+    @classmethod
+    def load(cls, path: str) -> "TripleStore":
+        """Load a store saved with `save`."""
+        arrays = np.load(path)
+        store = cls(**{name: arrays[name] for name in arrays.files})
+        logger.info(f"Loaded index of {len(store)} triples from {path}")
+
+        return store
+
+    @classmethod
+    def load_or_build(
+        cls, graph_path: Optional[str], index_path: Optional[str]
+    ) -> "TripleStore":
+        """Load the store from `index_path` if it exists. Otherwise build it from the graph at `graph_path`, and save
+        it to `index_path` (if given) for next time."""
+        if index_path and os.path.exists(index_path):
+            return cls.load(index_path)
+
+        if not graph_path:
+            raise ValueError(f"Index {index_path} doesn't exist and no graph was given")
+
+        store = cls.from_file(graph_path)
+        if index_path:
+            store.save(index_path)
+
+        return store
+
+    def save(self, path: str):
+        """Save the store to a `.npz` file."""
+        np.savez(
+            path,
+            kinds=self.kinds,
+            values=np.frombuffer(self._values, dtype=np.uint8),
+            value_offsets=self._value_offsets,
+            extras=np.frombuffer(self._extras, dtype=np.uint8),
+            extra_offsets=self._extra_offsets,
+            spo=self.spo,
+            pos=self.pos,
+            osp=self.osp,
+            value_ranks=self.value_ranks,
+        )
+
+    def __len__(self) -> int:
+        return self.spo.shape[1]
+
+    def _decode(self, term_id: int) -> Tuple[str, str]:
+        next_id = term_id + 1
+        start, end = self._value_offsets[term_id], self._value_offsets[next_id]
+        extra_start, extra_end = (
+            self._extra_offsets[term_id],
+            self._extra_offsets[next_id],
+        )
+
+        return (
+            self._values[start:end].decode("utf-8"),
+            self._extras[extra_start:extra_end].decode("utf-8"),
+        )
+
+    def value(self, term_id: int) -> str:
+        """Value of a term, e.g. the URI of a URI or the text of a literal."""
+        return self._decode(term_id)[0]
+
+    def term(self, term_id: int) -> dict:
+        """A term in the format of a SPARQL JSON result."""
+        value, extra = self._decode(term_id)
+        kind = self.kinds[term_id]
+
+        if kind == URI:
+            return {"type": "uri", "value": value}
+        elif kind == BNODE:
+            return {"type": "bnode", "value": value}
+        elif kind == LANG_LITERAL:
+            return {"type": "literal", "value": value, "xml:lang": extra}
+        elif extra:
+            return {"type": "literal", "value": value, "datatype": extra}
+
+        return {"type": "literal", "value": value}
+
+    def lookup_uri(self, uri: str) -> Optional[int]:
+        """ID of a URI, or None if it isn't in the store."""
+        lo, hi = 0, self.n_uris
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.value(mid) < uri:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo if lo < self.n_uris and self.value(lo) == uri else None
+
+    def rank(self, value: str) -> float:
+        """Rank of `value` among the values of the store's terms (see `value_ranks`). A value which isn't the value of
+        any term ranks half way between the values either side of it."""
+        if not value:
+            return 0
+
+        if self._value_order is None:
+            self._value_order = np.argsort(self.value_ranks, kind="stable")
+        order = self._value_order
+
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.value(int(order[mid])) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == len(order):
+            return (int(self.value_ranks[order[-1]]) if len(order) else 0) + 0.5
+
+        rank = int(self.value_ranks[order[lo]])
+        return rank if self.value(int(order[lo])) == value else rank - 0.5
+
+    @staticmethod
+    def _match(index: np.ndarray, term_id: int) -> Tuple[int, int]:
+        """Range of triples in `index` whose first term is `term_id`."""
+        # searching with a Python int would make numpy cast the whole of `index[0]` to int64 on every lookup
+        term_id = index.dtype.type(term_id)
+
+        return (
+            int(np.searchsorted(index[0], term_id, side="left")),
+            int(np.searchsorted(index[0], term_id, side="right")),
+        )
+
+    def predicate_objects(self, subject: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Predicates and objects of the triples with subject `subject`, ordered by predicate then object."""
+        start, end = self._match(self.spo, subject)
+        return self.spo[1, start:end], self.spo[2, start:end]
+
+    def subject_predicates(self, obj: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Subjects and predicates of the triples with object `obj`, ordered by subject then predicate."""
+        start, end = self._match(self.osp, obj)
+        return self.osp[1, start:end], self.osp[2, start:end]
+
+    def subject_objects(self, predicate: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Subjects and objects of the triples with predicate `predicate`, ordered by object then subject."""
+        start, end = self._match(self.pos, predicate)
+        return self.pos[2, start:end], self.pos[1, start:end]
+
+    def labels(self, subject: int) -> np.ndarray:
+        """IDs of the rdfs:labels of `subject`."""
+        if self.rdfs_label is None:
+            return self.spo[2, :0]
+
+        start, end = self._match(self.spo, subject)
+        predicates = self.spo[1, start:end]
+        rdfs_label = predicates.dtype.type(self.rdfs_label)
+        label_start = start + int(np.searchsorted(predicates, rdfs_label, side="left"))
+        label_end = start + int(np.searchsorted(predicates, rdfs_label, side="right"))
+
+        return self.spo[2, label_start:label_end]
+
+    def labels_of(self, subjects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """rdfs:labels of many subjects at once, as the position in `subjects` of the subject of each label and the
+        ID of the label. Labels are in the order of their subjects in `subjects`, then in order of ID."""
+        if self._label_index is None:
+            if self.rdfs_label is None:
+                label_subjects, label_ids = self.spo[0, :0], self.spo[2, :0]
+            else:
+                label_subjects, label_ids = self.subject_objects(self.rdfs_label)
+                order = np.lexsort((label_ids, label_subjects))
+                label_subjects, label_ids = label_subjects[order], label_ids[order]
+            self._label_index = (label_subjects, label_ids)
+        label_subjects, label_ids = self._label_index
+
+        subjects = subjects.astype(label_subjects.dtype, copy=False)
+        starts = np.searchsorted(label_subjects, subjects, side="left")
+        counts = np.searchsorted(label_subjects, subjects, side="right") - starts
+        # the nth label of a subject is at its start plus n
+        first_of_subject = np.repeat(np.cumsum(counts) - counts, counts)
+        nth = np.arange(int(counts.sum())) - first_of_subject
+
+        return (
+            np.repeat(np.arange(len(subjects)), counts),
+            label_ids[np.repeat(starts, counts) + nth],
+        )
+
+
+class LocalSPARQLConnector:
+    """Answers the queries built in `api_utils.sparql` from a `TripleStore`, with the same interface as
+    `db_connectors.SPARQLConnector`. Results are the same as a SPARQL endpoint's, except that rows are in index
+    order rather than an arbitrary order when the query isn't paginated."""
+
+    def __init__(self, store: TripleStore):
+        self.store = store
+        self._labelled_uris: Optional[np.ndarray] = None
+
+    async def close(self):
+        pass
+
+    async def get_sparql_results(self, query: sparql.Query) -> dict:
+        """Answer a query built by `sparql.get_p_o`, `sparql.get_s_p`, `sparql.get_connections`,
+        `sparql.get_labels`, `sparql.get_top_entities` or `sparql.get_all_labels`, in the SPARQL JSON results
+        format."""
+        if not isinstance(query, sparql.Query):
+            raise ValueError("Only queries built in api_utils.sparql can be answered")
+
+        handlers = {
+            "p_o": self._get_p_o,
+            "s_p": self._get_s_p,
+            "connections": self._get_connections,
+            "labels": self._get_labels,
+            "top_entities": self._get_top_entities,
+            "all_labels": self._get_all_labels,
+        }
+        if query.shape not in handlers:
+            raise ValueError(f"Unsupported query: {query.shape}")
+
+        # queries are answered in a thread, as one about a highly connected entity can take a while
+        with metrics.time_upstream("sparql"):
+            variables, bindings = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(handlers[query.shape], **query.params)
+            )
+
+        return {"head": {"vars": variables}, "results": {"bindings": bindings}}
+
+    def _select(
+        self,
+        predicates: np.ndarray,
+        others: np.ndarray,
+        variables: List[str],
+        labels: bool,
+        limit: Optional[int],
+        paginate: bool,
+        after: Optional[List[str]],
+    ) -> List[dict]:
+        """Turn the predicates and other ends (objects or subjects) of the triples matched by a `get_p_o` or `get_s_p`
+        query into its bindings, ordered and filtered by the query's keys if paginating. Rows are selected as term
+        IDs, and only the terms of the rows which are returned are decoded.
+
+        Args:
+            variables (List[str]): names of the predicate and the other end in the bindings, in order, followed by
+                the name of the other end's label
+        """
+        if limit and not paginate:
+            # labels can only add rows, so no more than `limit` triples are needed
+            predicates, others = predicates[:limit], others[:limit]
+
+        label_ids = np.full(len(others), -1, dtype=np.int64)
+        if labels:
+            # a row per label of the other end, or a row without a label if it has none, as
+            # `OPTIONAL {?other rdfs:label ?label}` would
+            positions, found = self.store.labels_of(others)
+            unlabelled = np.ones(len(others), dtype=bool)
+            unlabelled[positions] = False
+            rows = np.concatenate([positions, np.flatnonzero(unlabelled)])
+            label_ids = np.concatenate(
+                [found, np.full(int(unlabelled.sum()), -1)]
+            ).astype(np.int64)
+            # back in the order of the triples, then of the labels
+            order = np.argsort(rows, kind="stable")
+            rows, label_ids = rows[order], label_ids[order]
+            predicates, others = predicates[rows], others[rows]
+
+        if paginate:
+            # keys as in `sparql.get_p_o_key` and `sparql.get_s_p_key`, as ranks of values
+            ranks = self.store.value_ranks
+            keys = [ranks[predicates], ranks[others]]
+            if labels:
+                keys.append(np.where(label_ids >= 0, ranks[label_ids], 0))
+
+            selected = np.arange(len(others))
+            if after is not None:
+                selected = np.flatnonzero(
+                    _after_mask(keys, [self.store.rank(value) for value in after])
+                )
+            selected = selected[np.lexsort([key[selected] for key in reversed(keys)])]
+        else:
+            selected = np.arange(len(others))
+
+        if limit:
+            selected = selected[:limit]
+
+        predicate_var, other_var, label_var = variables
+        bindings = []
+        for predicate, other, label_id in zip(
+            predicates[selected].tolist(),
+            others[selected].tolist(),
+            label_ids[selected].tolist(),
+        ):
+            binding = {
+                predicate_var: self.store.term(predicate),
+                other_var: self.store.term(other),
+            }
+            if label_id >= 0:
+                binding[label_var] = self.store.term(label_id)
+            bindings.append(binding)
+
+        return bindings
+
+    def _get_p_o(
+        self,
+        h: str,
+        labels: bool,
+        limit: Optional[int] = None,
+        paginate: bool = False,
+        after: Optional[List[str]] = None,
+    ) -> Tuple[List[str], List[dict]]:
+        subject = self.store.lookup_uri(h)
+        predicates, objects = (
+            self.store.predicate_objects(subject)
+            if subject is not None
+            else (self.store.spo[1, :0], self.store.spo[2, :0])
+        )
+
+        return (
+            ["predicate", "object"] + (["objectLabel"] if labels else []),
+            self._select(
+                predicates,
+                objects,
+                ["predicate", "object", "objectLabel"],
+                labels,
+                limit,
+                paginate,
+                after,
+            ),
+        )
+
+    def _get_s_p(
+        self,
+        h: str,
+        labels: bool,
+        limit: Optional[int] = None,
+        paginate: bool = False,
+        after: Optional[List[str]] = None,
+    ) -> Tuple[List[str], List[dict]]:
+        obj = self.store.lookup_uri(h)
+        subjects, predicates = (
+            self.store.subject_predicates(obj)
+            if obj is not None
+            else (self.store.osp[1, :0], self.store.osp[2, :0])
+        )
+
+        bindings = self._select(
+            predicates,
+            subjects,
+            ["predicate", "subject", "subjectLabel"],
+            labels,
+            limit,
+            paginate,
+            after,
+        )
+
+        return (
+            ["subject", "predicate"] + (["subjectLabel"] if labels else []),
+            # in the same order as a SPARQL endpoint's bindings
+            [
+                {"subject": b["subject"], "predicate": b["predicate"], **b}
+                for b in bindings
+            ],
+        )
+
+    def _get_connections(
+        self,
+        parts: List[Tuple[str, str, Optional[List[str]]]],
+        labels: bool,
+        limit: Optional[int] = None,
+        paginate: bool = False,
+        entity_labels: List[str] = (),
+    ) -> Tuple[List[str], List[dict]]:
+        bindings = []
+        for ent, direction, after in parts:
+            get_part = self._get_p_o if direction == "from" else self._get_s_p
+            _, part_bindings = get_part(ent, labels, limit, paginate, after)
+            entity = {"type": "uri", "value": ent}
+            bindings += [{"entity": entity, **binding} for binding in part_bindings]
+
+        _, label_bindings = self._get_labels(entity_labels)
+        bindings += [
+            {"entity": binding["s"], "entityLabel": binding["sLabel"]}
+            for binding in label_bindings
+            if "sLabel" in binding
+        ]
+        variables = ["entity", "predicate", "object", "subject"]
+        if labels:
+            variables += ["objectLabel", "subjectLabel"]
+        if entity_labels:
+            variables.append("entityLabel")
+
+        return variables, bindings
+
+    def _get_labels(self, entities: List[str]) -> Tuple[List[str], List[dict]]:
+        bindings = []
+        for ent in entities:
+            term_id = self.store.lookup_uri(ent)
+            label_ids = self.store.labels(term_id) if term_id is not None else ()
+            for label_id in label_ids:
+                bindings.append(
+                    {
+                        "s": {"type": "uri", "value": ent},
+                        "sLabel": self.store.term(label_id),
+                    }
+                )
+
+            if not len(label_ids):
+                bindings.append({"s": {"type": "uri", "value": ent}})
+
+        return ["s", "sLabel"], bindings
+
+    def _get_top_entities(
+        self, limit: Optional[int] = None
+    ) -> Tuple[List[str], List[dict]]:
+        n_uris = self.store.n_uris
+        # URIs have the lowest IDs, and IDs are in sorted order so ties are broken by URI
+        connections = (
+            np.bincount(self.store.spo[0], minlength=n_uris)[:n_uris]
+            + np.bincount(self.store.spo[2], minlength=n_uris)[:n_uris]
+        )
+        top = np.argsort(-connections, kind="stable")
+        top = top[connections[top] > 0][:limit]
+
+        return ["entity", "connections"], [
+            {
+                "entity": self.store.term(int(term_id)),
+                "connections": {
+                    "type": "literal",
+                    "value": str(connections[term_id]),
+                    "datatype": "http://www.w3.org/2001/XMLSchema#integer",
+                },
+            }
+            for term_id in top
+        ]
+
+    def _get_all_labels(
+        self, page_size: int, after: Optional[str] = None
+    ) -> Tuple[List[str], List[dict]]:
+        if self._labelled_uris is None:
+            subjects = (
+                self.store.subject_objects(self.store.rdfs_label)[0]
+                if self.store.rdfs_label is not None
+                else self.store.spo[0, :0]
+            )
+            # URIs have the lowest IDs, in sorted order, so this is the order of STR(?s)
+            self._labelled_uris = np.unique(subjects[subjects < self.store.n_uris])
+
+        start = 0
+        if after is not None:
+            after_id = self.store.lookup_uri(after)
+            if after_id is not None:
+                start = int(
+                    np.searchsorted(
+                        self._labelled_uris,
+                        self._labelled_uris.dtype.type(after_id),
+                        side="right",
+                    )
+                )
+            else:
+                # binary search by value, for a URI which isn't in the store
+                lo, hi = 0, len(self._labelled_uris)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self.store.value(int(self._labelled_uris[mid])) <= after:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                start = lo
+
+        page_end = start + page_size
+        subjects = self._labelled_uris[start:page_end]
+        positions, label_ids = self.store.labels_of(subjects)
+        bindings = [
+            {"s": self.store.term(subject), "label": self.store.term(label_id)}
+            for subject, label_id in zip(
+                subjects[positions].tolist(), label_ids.tolist()
+            )
+        ]
+
+        return ["s", "label"], bindings
@@ -0,0 +1,250 @@
+"""Client for the vectors API in heritage-connector-vectors.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import httpx
+from api_utils import logging, concurrency, resilience
+from api_utils.singleflight import SingleFlight
+
+logger = logging.get_logger(__name__)
+
+
+class VectorsClient:
+    """Asynchronous client for the vectors API, using a pool of keep-alive connections.
+
+    Calls to `get_neighbours` arriving within `batch_window` seconds of each other (and with the same `k`) are merged
+    into one upstream request, and the response is split back out between the callers.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        timeout: float = 30.0,
+        max_connections: int = 50,
+        max_keepalive_connections: int = 20,
+        batch_window: float = 0.005,
+        max_batch_size: int = 64,
+        max_matrix_pairs: int = 100,
+        upstream: Optional[resilience.Upstream] = None,
+    ):
+        """
+        Args:
+            endpoint (str): base URL of the vectors API
+            timeout (float, optional): timeout in seconds. Defaults to 30.0.
+            max_connections (int, optional): maximum number of concurrent connections. Defaults to 50.
+            max_keepalive_connections (int, optional): maximum number of idle connections kept open. Defaults to 20.
+            batch_window (float, optional): time in seconds to wait for other `get_neighbours` calls to batch
+                together. Set to 0 to send every call straight away. Defaults to 0.005.
+            max_batch_size (int, optional): number of entities at which a batch is sent without waiting for the rest
+                of the window. Defaults to 64.
+            max_matrix_pairs (int, optional): maximum number of distinct pairs of entities in a distance matrix. Each
+                pair is a request to the vectors API. Defaults to 100.
+            upstream (Optional[resilience.Upstream], optional): retry, deadline and circuit breaker policy for
+                requests. Defaults to 3 attempts with no deadline other than `timeout` per attempt.
+        """
+        self.endpoint = endpoint
+        self.timeout = httpx.Timeout(timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_matrix_pairs = max_matrix_pairs
+        self.upstream = upstream or resilience.Upstream("vectors")
+
+        self._client = None
+        # batches waiting to be sent, keyed by k. Each item is a list of (entities, future) pairs.
+        self._pending: Dict[int, List[Tuple[List[str], asyncio.Future]]] = defaultdict(
+            list
+        )
+        self._flush_handles: Dict[int, asyncio.TimerHandle] = {}
+        self._single_flight = SingleFlight("vectors")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.endpoint,
+                timeout=self.timeout,
+                limits=self.limits,
+                headers={"Content-Type": "application/json"},
+            )
+
+        return self._client
+
+    async def close(self):
+        """Close all pooled connections to the vectors API."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path: str, body: dict):
+        """POST `body` to the vectors API and return the decoded response.
+
+        Raises:
+            KeyError: if the vectors API responds with 404, i.e. there's no embedding for an entity
+            ValueError: if the vectors API rejects the request with any other 4xx
+            resilience.UpstreamUnavailableError: if the vectors API is unavailable or responds with a 5xx
+        """
+        response = await self.upstream.request(
+            lambda: self.client.post(path, json=body)
+        )
+        if response.is_client_error:
+            detail = _get_error_detail(response)
+            if response.status_code == 404:
+                raise KeyError(detail)
+            raise ValueError(detail)
+
+        return response.json()
+
+    async def get_neighbours(self, entities: List[str], k: int) -> Dict[str, list]:
+        """Get the `k` nearest neighbours of each entity in `entities`.
+
+        Args:
+            entities (List[str]): normalised entity URIs
+            k (int): number of neighbours to return for each entity
+
+        Returns:
+            Dict[str, list]: mapping of each entity to a list of `[neighbour, distance]` pairs
+        """
+        return await self._single_flight.do(
+            ("neighbours", tuple(entities), k),
+            lambda: self._get_neighbours(entities, k),
+        )
+
+    async def _get_neighbours(self, entities: List[str], k: int) -> Dict[str, list]:
+        if self.batch_window <= 0:
+            return await self._post("/neighbours", {"entities": entities, "k": k})
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[k].append((entities, future))
+
+        if sum(len(ents) for ents, _ in self._pending[k]) >= self.max_batch_size:
+            self._schedule_flush(k, delay=0)
+        elif k not in self._flush_handles:
+            self._schedule_flush(k, delay=self.batch_window)
+
+        return await future
+
+    def _schedule_flush(self, k: int, delay: float):
+        handle = self._flush_handles.pop(k, None)
+        if handle is not None:
+            handle.cancel()
+
+        loop = asyncio.get_running_loop()
+        self._flush_handles[k] = loop.call_later(
+            delay, lambda: asyncio.ensure_future(self._flush(k))
+        )
+
+    async def _flush(self, k: int):
+        self._flush_handles.pop(k, None)
+        batch = self._pending.pop(k, [])
+        if not batch:
+            return
+
+        entities = list(dict.fromkeys(ent for ents, _ in batch for ent in ents))
+        logger.debug(
+            f"Sending {len(batch)} neighbours requests ({len(entities)} entities) as one batch"
+        )
+
+        try:
+            response = await self._post("/neighbours", {"entities": entities, "k": k})
+        except Exception as e:
+            # only a rejected request can be down to one caller's entities. If the API is unavailable, sending each
+            # request again would just fail again, and count against the circuit breaker each time.
+            if len(batch) == 1 or not isinstance(e, (KeyError, ValueError)):
+                for _, future in batch:
+                    self._set_result(future, exception=e)
+                return
+
+            # one bad entity shouldn't fail everyone else's request, so fall back to sending each one separately
+            logger.warning(
+                f"Batched neighbours request failed ({e!r}), retrying individually"
+            )
+            results = await asyncio.gather(
+                *[
+                    self._post("/neighbours", {"entities": ents, "k": k})
+                    for ents, _ in batch
+                ],
+                return_exceptions=True,
+            )
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self._set_result(future, exception=result)
+                else:
+                    self._set_result(future, result)
+            return
+
+        for ents, future in batch:
+            self._set_result(
+                future, {ent: response[ent] for ent in ents if ent in response}
+            )
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result=None, exception=None):
+        # the caller may have been cancelled while waiting
+        if future.done():
+            return
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def get_distance(self, entity_a: str, entity_b: str) -> float:
+        """Get the distance between the embeddings of two entities."""
+        return await self._single_flight.do(
+            ("distance", entity_a, entity_b),
+            lambda: self._post(
+                "/distance", {"entity_a": entity_a, "entity_b": entity_b}
+            ),
+        )
+
+    async def get_distance_matrix(
+        self, entities_a: List[str], entities_b: List[str], max_concurrency: int = 20
+    ) -> List[List[Optional[float]]]:
+        """Get the distance between every entity in `entities_a` and every entity in `entities_b`.
+
+        The vectors API only computes one distance per request, so this sends one request per distinct unordered pair
+        of entities, at most `max_concurrency` at a time. The distance from an entity to itself is requested too, so
+        that like `EmbeddingIndex.distance_matrix` an entity without an embedding has None all along its row and
+        column. Pairs which fail have a distance of None.
+
+        Raises:
+            ValueError: if there are more than `max_matrix_pairs` pairs
+        """
+        pairs = list({tuple(sorted((a, b))) for a in entities_a for b in entities_b})
+        if len(pairs) > self.max_matrix_pairs:
+            raise ValueError(
+                f"At most {self.max_matrix_pairs} pairs of entities can be compared using the vectors API"
+            )
+
+        distances = await concurrency.gather_with_concurrency(
+            asyncio.Semaphore(max_concurrency),
+            *[self._get_distance_or_none(a, b) for a, b in pairs],
+        )
+        pair_distances = dict(zip(pairs, distances))
+
+        return [
+            [pair_distances[tuple(sorted((a, b)))] for b in entities_b]
+            for a in entities_a
+        ]
+
+    async def _get_distance_or_none(self, entity_a: str, entity_b: str):
+        try:
+            return await self.get_distance(entity_a, entity_b)
+        except Exception as e:
+            logger.warning(
+                f"Failed to get distance between {entity_a} and {entity_b}: {e!r}"
+            )
+            return None
+
+
+def _get_error_detail(response: httpx.Response) -> str:
+    """The `detail` of an error response from the vectors API, or its body if it has none."""
+    try:
+        return str(response.json()["detail"])
+    except (ValueError, KeyError, TypeError):
+        return response.text
@@ -0,0 +1,115 @@
+"""Background warm-up of caches and upstream connections after the API starts, with readiness reported separately
+from liveness so that traffic is only sent to warm instances.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from api_utils import logging
+
+logger = logging.get_logger(__name__)
+
+
+def read_uris(uris: Optional[str] = None, uris_file: Optional[str] = None) -> List[str]:
+    """URIs from a comma-separated string and/or a file with one URI per line, in order and without duplicates.
+
+    Args:
+        uris (Optional[str], optional): comma-separated URIs. Defaults to None.
+        uris_file (Optional[str], optional): path to a file of URIs. Blank lines and lines starting with `#` are
+            ignored. Defaults to None.
+
+    Returns:
+        List[str]: URIs
+    """
+    all_uris = [uri.strip() for uri in (uris or "").split(",")]
+
+    if uris_file:
+        with open(uris_file) as f:
+            all_uris += [line.strip() for line in f if not line.startswith("#")]
+
+    return list(dict.fromkeys(uri for uri in all_uris if uri))
+
+
+class Warmup:
+    """Runs warm-up steps in the background, tracking progress. The instance is ready once every step has finished
+    (successfully or not) or the warm-up has run for `max_seconds`, so a slow or failing upstream can delay traffic
+    but not stop it altogether."""
+
+    def __init__(self, max_concurrency: int = 4, max_seconds: float = 300):
+        """
+        Args:
+            max_concurrency (int, optional): number of steps run at once. Defaults to 4.
+            max_seconds (float, optional): time after which the instance is ready even if steps are still
+                running. Defaults to 300.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_seconds = max_seconds
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"total": 0, "done": 0, "failed": 0}
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    def start(self, steps: Iterable[Callable[[], Awaitable]]):
+        """Start running `steps` in the background. If there are no steps the instance is ready straight away."""
+        steps = list(steps)
+        self._counters["total"] = len(steps)
+        self._started_at = time.monotonic()
+
+        if not steps:
+            self._finish()
+            return
+
+        self._task = asyncio.ensure_future(self._run(steps))
+
+    async def stop(self):
+        """Cancel the warm-up if it's still running."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, steps: List[Callable[[], Awaitable]]):
+        remaining = iter(steps)
+
+        async def _worker():
+            for step in remaining:
+                try:
+                    await step()
+                except Exception as e:
+                    self._counters["failed"] += 1
+                    logger.warning(f"Warm-up step failed: {e!r}")
+                self._counters["done"] += 1
+
+        workers = [
+            asyncio.ensure_future(_worker()) for _ in range(self.max_concurrency)
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*workers), self.max_seconds)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Warm-up didn't finish within {self.max_seconds}s, marking instance as ready"
+            )
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.ready = True
+        self._finished_at = time.monotonic()
+        logger.info(
+            f"Warm-up finished: {self._counters['done']}/{self._counters['total']} steps "
+            f"({self._counters['failed']} failed) in {self._finished_at - self._started_at:.1f}s"
+        )
+
+    def stats(self) -> Dict:
+        """Whether the instance is ready, the number of steps done and failed, and the time taken so far."""
+        end = self._finished_at if self._finished_at is not None else time.monotonic()
+
+        return {
+            "ready": self.ready,
+            **self._counters,
+            "seconds": round(end - self._started_at, 3)
+            if self._started_at is not None
+            else 0.0,
+        }
@@ -0,0 +1,282 @@
+"""Load benchmark of the API's endpoints against the local stand-ins in `benchmarks.stand_ins`.
+
+Starts the stand-ins and the API in subprocesses, then sends requests to `/connections`, `/labels`, `/neighbours`
+and `/view_connections` from a fixed number of concurrent clients, at each of a set of concurrency levels. Prints
+(or writes to `--output`) JSON with the throughput and p50/p95/p99 latency of each endpoint at each level, which
+can be diffed between commits.
+
+Settings for the API, e.g. `TRUST_UPSTREAM_RESPONSES`, are passed through from the environment. Labels are only
+cached in memory unless `LABEL_CACHE_PATH` is set.
+
+To run (from the repo root): `python -m benchmarks.endpoints`
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+import httpx
+from benchmarks import stand_ins
+
+ENDPOINTS = ["connections", "labels", "neighbours", "view_connections"]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"{' '.join(process.args)} exited with {process.returncode}"
+            )
+        try:
+            httpx.get(url, timeout=1).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+
+    raise TimeoutError(f"{url} didn't respond within {timeout}s")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    rank = max(int(round(pct / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def make_request_builders(
+    entities: List[str], hubs: List[str], hub_fraction: float, seed: int
+) -> Dict[str, Callable[[], dict]]:
+    """Functions returning the arguments of the next request to each endpoint, for `httpx.AsyncClient.request`.
+    Entities are hubs with probability `hub_fraction`."""
+    rng = random.Random(seed)
+
+    def entity() -> str:
+        return rng.choice(hubs if hubs and rng.random() < hub_fraction else entities)
+
+    return {
+        "connections": lambda: {
+            "method": "POST",
+            "url": "/connections",
+            "json": {"entities": [entity()], "labels": True},
+        },
+        "labels": lambda: {
+            "method": "POST",
+            "url": "/labels",
+            "json": {"uris": [entity() for _ in range(20)]},
+        },
+        "neighbours": lambda: {
+            "method": "POST",
+            "url": "/neighbours",
+            "json": {"entities": [entity()], "k": 10},
+        },
+        "view_connections": lambda: {
+            "method": "GET",
+            "url": "/view_connections",
+            "params": {"entity": entity()},
+        },
+    }
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    build_request: Callable[[], dict],
+    concurrency: int,
+    n_requests: int,
+) -> dict:
+    """Send `n_requests` requests from `concurrency` concurrent clients, each sending its next request as soon as
+    the last one completes."""
+    latencies = []
+    errors = 0
+    remaining = n_requests
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.request(**build_request())
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        "requests": n_requests,
+        "errors": errors,
+        "throughput_rps": n_requests / elapsed,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) * 1e3,
+            "p50": percentile(latencies, 50) * 1e3,
+            "p95": percentile(latencies, 95) * 1e3,
+            "p99": percentile(latencies, 99) * 1e3,
+        },
+    }
+
+
+async def run_benchmarks(
+    api_url: str,
+    entities: List[str],
+    hubs: List[str],
+    args: argparse.Namespace,
+) -> dict:
+    builders = make_request_builders(entities, hubs, args.hub_fraction, args.seed)
+    results = {}
+
+    async with httpx.AsyncClient(
+        base_url=api_url,
+        timeout=args.timeout,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=max(args.concurrency)),
+    ) as client:
+        for endpoint in args.endpoints:
+            results[endpoint] = {}
+            await run_level(client, builders[endpoint], 1, args.warmup)
+
+            for concurrency in args.concurrency:
+                results[endpoint][str(concurrency)] = await run_level(
+                    client, builders[endpoint], concurrency, args.requests
+                )
+
+    return results
+
+
+def main(args: argparse.Namespace) -> dict:
+    stand_ins_port, api_port = _free_port(), _free_port()
+    stand_ins_url = f"http://127.0.0.1:{stand_ins_port}"
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    env = dict(
+        os.environ,
+        SPARQL_ENDPOINT=f"{stand_ins_url}/sparql",
+        VECTORS_API=stand_ins_url,
+        WIKIDATA_API_URL=f"{stand_ins_url}/w/api.php",
+        VAM_API_URL=f"{stand_ins_url}/v2/object",
+        VECTORS_BACKEND="remote",
+    )
+    env.setdefault("LABEL_CACHE_PATH", "")
+    output = None if args.verbose else subprocess.DEVNULL
+
+    processes = []
+    try:
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.stand_ins",
+                    f"--port={stand_ins_port}",
+                ]
+                + stand_ins.stand_in_args(args),
+                env=env,
+                stdout=output,
+                stderr=output,
+            )
+        )
+        _wait_until_up(f"{stand_ins_url}/_entities", processes[0])
+
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "main:app",
+                    "--host=127.0.0.1",
+                    f"--port={api_port}",
+                    "--log-level=warning",
+                ],
+                env=env,
+                stdout=output,
+                stderr=output,
+            )
+        )
+        _wait_until_up(f"{api_url}/ready", processes[1])
+
+        graph_entities = httpx.get(f"{stand_ins_url}/_entities").json()
+        results = asyncio.run(
+            run_benchmarks(
+                api_url, graph_entities["entities"], graph_entities["hubs"], args
+            )
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    return {"commit": _git_commit(), "config": vars(args), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32],
+        help="numbers of concurrent clients",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="requests per endpoint at each concurrency level",
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=20, help="requests before each endpoint"
+    )
+    parser.add_argument(
+        "--hub-fraction",
+        type=float,
+        default=0.1,
+        help="fraction of requests for hub entities",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="request timeout in seconds"
+    )
+    parser.add_argument("--output", help="file to write results to")
+    parser.add_argument(
+        "--verbose", action="store_true", help="show output of the API and stand-ins"
+    )
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = json.dumps(main(args), indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(results)
+    else:
+        print(results)
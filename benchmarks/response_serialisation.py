@@ -0,0 +1,114 @@
+"""Benchmark of the CPU time spent turning SPARQL bindings into a response body, comparing FastAPI's usual path
+(validating against the response model, then serialising with the standard library) to the fast paths in
+`api_utils.responses`.
+
+To run (from the repo root): `python -m benchmarks.response_serialisation`
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from api_utils import responses
+import data_models
+
+PREDICATES = [
+    "http://www.w3.org/2000/01/rdf-schema#label",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#type",
+    "http://www.wikidata.org/prop/direct/P31",
+    "http://www.wikidata.org/prop/direct/P279",
+    "https://collection.sciencemuseumgroup.org.uk/objects/",
+    "http://xmlns.com/foaf/0.1/maker",
+]
+
+
+def make_bindings(n_bindings: int, seed: int = 0) -> List[dict]:
+    """Make `n_bindings` predicate-object bindings shaped like the SPARQL endpoint's, with a mix of URIs and literals
+    and labels on some of the URIs."""
+    rng = random.Random(seed)
+    bindings = []
+
+    for _ in range(n_bindings):
+        binding = {"predicate": {"type": "uri", "value": rng.choice(PREDICATES)}}
+
+        if rng.random() < 0.6:
+            binding["object"] = {
+                "type": "uri",
+                "value": f"http://www.wikidata.org/entity/Q{rng.randint(1, 10_000_000)}",
+            }
+            if rng.random() < 0.5:
+                binding["objectLabel"] = {
+                    "type": "literal",
+                    "value": f"label {rng.randint(1, 10_000_000)}",
+                }
+        else:
+            binding["object"] = {
+                "type": "literal",
+                "value": str(rng.randint(1800, 2020)),
+                "datatype": "http://www.w3.org/2001/XMLSchema#integer",
+            }
+
+        bindings.append(binding)
+
+    return bindings
+
+
+def cpu_ms(fn, repeat: int) -> float:
+    """Best CPU time of `repeat` calls to `fn`, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        times.append(time.process_time() - start)
+
+    return min(times) * 1e3
+
+
+def run(n_bindings: int, repeat: int) -> dict:
+    bindings = make_bindings(n_bindings)
+    field = create_response_field(
+        name="Response", type_=List[data_models.SPARQLPredicateObject]
+    )
+
+    def validated(response_class):
+        content = asyncio.run(
+            serialize_response(
+                field=field, response_content=bindings, exclude_unset=True
+            )
+        )
+        return response_class(content).body
+
+    assert json.loads(validated(JSONResponse)) == json.loads(
+        responses.FastJSONResponse(bindings).body
+    )
+
+    timings = {
+        "validated_stdlib_json": cpu_ms(lambda: validated(JSONResponse), repeat),
+        "validated_fast_json": cpu_ms(
+            lambda: validated(responses.FastJSONResponse), repeat
+        ),
+        "trusted_fast_json": cpu_ms(
+            lambda: responses.FastJSONResponse(bindings).body, repeat
+        ),
+    }
+
+    return {
+        "orjson": responses.orjson is not None,
+        "bindings": n_bindings,
+        "cpu_ms_per_10k_bindings": {
+            k: v * 10_000 / n_bindings for k, v in timings.items()
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bindings", type=int, default=10_000, help="bindings per run")
+    parser.add_argument("--repeat", type=int, default=5, help="runs (best is kept)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.bindings, args.repeat), indent=2))
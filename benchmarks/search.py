@@ -0,0 +1,105 @@
+"""Benchmark of the typeahead search index in `api_utils.search`: time to build it, memory used, and latency of
+searches, for synthetic labels.
+
+To run (from the repo root): `python -m benchmarks.search --labels 1000000`
+"""
+import argparse
+import json
+import random
+import time
+import numpy as np
+from api_utils import search
+
+
+def make_vocabulary(n_words: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return [
+        "".join(rng.choice(letters) for _ in range(rng.randint(2, 12)))
+        for _ in range(n_words)
+    ]
+
+
+def make_entries(n_labels: int, n_words: int, seed: int = 0) -> list:
+    """Make (URI, label) pairs with labels of 1-10 words, drawn from a vocabulary with a Zipfian distribution as in
+    real titles and names."""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(n_words, rng)
+    weights = 1 / np.arange(1, n_words + 1)
+    word_ids = np.random.default_rng(seed).choice(
+        n_words, size=n_labels * 10, p=weights / weights.sum()
+    )
+
+    entries = []
+    for i in range(n_labels):
+        n = rng.randint(1, 10)
+        start = i * 10
+        end = start + n
+        entries.append(
+            (
+                f"https://collection.sciencemuseumgroup.org.uk/objects/co{i}",
+                " ".join(vocabulary[word_id] for word_id in word_ids[start:end]),
+            )
+        )
+
+    return entries
+
+
+def make_queries(entries: list, n_queries: int, seed: int = 0) -> list:
+    """Prefixes of 1-10 characters of words in the labels, as typed into a search box."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        word = rng.choice(rng.choice(entries)[1].split())
+        queries.append(word[: rng.randint(1, 10)])
+
+    return queries
+
+
+def latencies_ms(index: search.PrefixIndex, queries: list, limit: int) -> dict:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, limit)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "p50": round(float(np.percentile(times, 50)), 4),
+        "p99": round(float(np.percentile(times, 99)), 4),
+        "max": round(float(np.max(times)), 4),
+    }
+
+
+def run(n_labels: int, n_words: int, n_queries: int, limit: int) -> dict:
+    entries = make_entries(n_labels, n_words)
+    scores = {uri: random.random() * 100 for uri, _ in entries}
+    queries = make_queries(entries, n_queries)
+
+    start = time.perf_counter()
+    index = search.PrefixIndex.from_labels(entries, scores)
+    build_seconds = time.perf_counter() - start
+
+    cold = latencies_ms(index, queries, limit)
+    start = time.perf_counter()
+    index.warm()
+    warm_seconds = time.perf_counter() - start
+
+    return {
+        "build_seconds": round(build_seconds, 2),
+        "warm_seconds": round(warm_seconds, 2),
+        "index": index.stats(),
+        "latency_ms_before_warm": cold,
+        "latency_ms": latencies_ms(index, queries, limit),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labels", type=int, default=1_000_000, help="labels indexed")
+    parser.add_argument(
+        "--words", type=int, default=100_000, help="distinct words in labels"
+    )
+    parser.add_argument("--queries", type=int, default=10_000, help="searches timed")
+    parser.add_argument("--limit", type=int, default=10, help="results per search")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.labels, args.words, args.queries, args.limit), indent=2))
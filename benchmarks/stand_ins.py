@@ -0,0 +1,413 @@
+"""Local stand-ins for the services the API depends on, for benchmarking without live services:
+
+- a SPARQL endpoint answering the queries built in `api_utils.sparql` from a synthetic graph, with a configurable
+  number of hub entities with many connections
+- the vectors API (`/neighbours` and `/distance`)
+- the Wikidata wbgetentities API (`/w/api.php`)
+- the V&A object API (`/v2/object/{id}`)
+
+Each service has a configurable latency, added to every request. `benchmarks.endpoints` starts these
+automatically, but they can also be run on their own (from the repo root): `python -m benchmarks.stand_ins`
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Form, Request
+import uvicorn
+from api_utils import sparql
+import utils
+
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+XSD_DATE = "http://www.w3.org/2001/XMLSchema#date"
+
+ENTITY_TEMPLATES = [
+    "https://collection.sciencemuseumgroup.org.uk/objects/co{}",
+    "https://collection.sciencemuseumgroup.org.uk/people/cp{}",
+    "http://www.wikidata.org/entity/Q{}",
+    "http://collections.vam.ac.uk/item/O{}",
+]
+
+LITERAL_PREDICATES = [
+    "https://schema.org/birthDate",
+    "https://schema.org/dateCreated",
+    "https://schema.org/foundingDate",
+]
+
+P_O_PATTERN = re.compile(r"<([^>]+)> \?predicate \?object")
+S_P_PATTERN = re.compile(r"\?subject \?predicate <([^>]+)>")
+VALUES_PATTERN = re.compile(r"VALUES \?s \{([^}]*)\}")
+ENTITY_VALUES_PATTERN = re.compile(r"VALUES \?entity \{([^}]*)\}")
+URI_PATTERN = re.compile(r"<([^>]+)>")
+LIMIT_PATTERN = re.compile(r"LIMIT (\d+)\s*$")
+ALL_LABELS_PATTERN = re.compile(r"SELECT DISTINCT \?s WHERE .*? LIMIT (\d+)", re.DOTALL)
+STRING_LITERAL_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"')
+
+
+def _expand_predicate(abbreviated: str) -> Optional[str]:
+    """Turn an abbreviated predicate from `utils.predicateManualGroups` back into a URI."""
+    prefix, _, local_name = abbreviated.partition(":")
+    for uri_prefix, abbreviation in utils.predicateAbbreviationMapping.items():
+        if abbreviation == prefix:
+            return uri_prefix + local_name
+
+    return None
+
+
+ENTITY_PREDICATES = [
+    uri
+    for uri in (
+        _expand_predicate(p)
+        for group in utils.predicateManualGroups.values()
+        for p in group
+    )
+    if uri is not None and uri != RDFS_LABEL and uri not in LITERAL_PREDICATES
+]
+
+
+class SyntheticGraph:
+    """A random graph of `n_entities` entities with about `degree` connections from each. The first `n_hubs`
+    entities also have `hub_size` connections both to and from them. V&A objects and half of the Wikidata entities
+    don't have an rdfs:label, so their labels have to be fetched from the V&A and Wikidata APIs."""
+
+    def __init__(
+        self,
+        n_entities: int = 10_000,
+        degree: int = 10,
+        n_hubs: int = 10,
+        hub_size: int = 2_000,
+        seed: int = 0,
+    ):
+        rng = random.Random(seed)
+        self.entities = [
+            ENTITY_TEMPLATES[idx % len(ENTITY_TEMPLATES)].format(idx + 1)
+            for idx in range(n_entities)
+        ]
+        self.hubs = self.entities[:n_hubs]
+        self.labels = {
+            ent: f"Entity {idx + 1}"
+            for idx, ent in enumerate(self.entities)
+            if "collections.vam.ac.uk" not in ent
+            and not ("wikidata.org" in ent and idx % 8 == 2)
+        }
+
+        # subject -> [(predicate, object term)], object -> [(subject, predicate)]
+        self.outgoing = defaultdict(list)
+        self.incoming = defaultdict(list)
+        self._triples = set()
+
+        for ent, label in self.labels.items():
+            self._add(ent, RDFS_LABEL, {"type": "literal", "value": label})
+
+        for ent in self.entities:
+            self._add(
+                ent,
+                rng.choice(LITERAL_PREDICATES),
+                {
+                    "type": "literal",
+                    "value": f"{rng.randint(1700, 2020)}-01-01",
+                    "datatype": XSD_DATE,
+                },
+            )
+            for _ in range(degree):
+                self._add_edge(ent, rng.choice(self.entities), rng)
+
+        for hub in self.hubs:
+            for _ in range(hub_size):
+                self._add_edge(hub, rng.choice(self.entities), rng)
+                self._add_edge(rng.choice(self.entities), hub, rng)
+
+    def _add(self, subject: str, predicate: str, obj: dict):
+        if (subject, predicate, obj["value"]) in self._triples:
+            return
+
+        self._triples.add((subject, predicate, obj["value"]))
+        self.outgoing[subject].append((predicate, obj))
+        if obj["type"] == "uri":
+            self.incoming[obj["value"]].append((subject, predicate))
+
+    def _add_edge(self, subject: str, obj: str, rng: random.Random):
+        self._add(subject, rng.choice(ENTITY_PREDICATES), {"type": "uri", "value": obj})
+
+    def _label_term(self, uri: str) -> Optional[dict]:
+        label = self.labels.get(uri)
+        return None if label is None else {"type": "literal", "value": label}
+
+    def get_p_o(self, h: str, labels: bool) -> List[dict]:
+        bindings = []
+        for predicate, obj in self.outgoing.get(h, []):
+            binding = {"predicate": {"type": "uri", "value": predicate}, "object": obj}
+            if labels and obj["type"] == "uri":
+                label = self._label_term(obj["value"])
+                if label is not None:
+                    binding["objectLabel"] = label
+            bindings.append(binding)
+
+        return bindings
+
+    def get_s_p(self, h: str, labels: bool) -> List[dict]:
+        bindings = []
+        for subject, predicate in self.incoming.get(h, []):
+            binding = {
+                "subject": {"type": "uri", "value": subject},
+                "predicate": {"type": "uri", "value": predicate},
+            }
+            if labels:
+                label = self._label_term(subject)
+                if label is not None:
+                    binding["subjectLabel"] = label
+            bindings.append(binding)
+
+        return bindings
+
+    def get_all_labels(self, page_size: int, after: Optional[str]) -> List[dict]:
+        labelled = sorted(ent for ent in self.labels if after is None or ent > after)
+        return [
+            {"s": {"type": "uri", "value": ent}, "label": self._label_term(ent)}
+            for ent in labelled[:page_size]
+        ]
+
+    def get_labels(self, entities: List[str]) -> List[dict]:
+        bindings = []
+        for ent in entities:
+            binding = {"s": {"type": "uri", "value": ent}}
+            label = self._label_term(ent)
+            if label is not None:
+                binding["sLabel"] = label
+            bindings.append(binding)
+
+        return bindings
+
+
+def _paginate(query: str, bindings: List[dict], order_keys: List[str], key_fn):
+    """Apply the ORDER BY and keyset FILTER added by `sparql._paginate` to `bindings`."""
+    bindings = sorted(bindings, key=key_fn)
+
+    if "FILTER" in query:
+        filter_start, filter_end = query.index("FILTER"), query.index("ORDER BY")
+        filter_str = query[filter_start:filter_end]
+        for key in order_keys:
+            filter_str = filter_str.replace(key, "")
+        # the last clause of the filter has the value of every key
+        literals = STRING_LITERAL_PATTERN.findall(filter_str)
+        last_clause_start = len(literals) - len(order_keys)
+        after = [json.loads(literal) for literal in literals[last_clause_start:]]
+        bindings = [b for b in bindings if key_fn(b) > after]
+
+    return bindings
+
+
+def _order_and_limit(
+    query: str, bindings: List[dict], direction: str, labels: bool
+) -> List[dict]:
+    """Apply the ORDER BY, keyset FILTER and LIMIT in a query for connections from or to one entity."""
+    if direction == "from":
+        order_keys = sparql.P_O_ORDER_KEYS + [sparql.P_O_LABELS_ORDER_KEY]
+        key_builder = sparql.get_p_o_key
+    else:
+        order_keys = sparql.S_P_ORDER_KEYS + [sparql.S_P_LABELS_ORDER_KEY]
+        key_builder = sparql.get_s_p_key
+
+    if "ORDER BY" in query:
+        n_keys = len(order_keys) if labels else len(order_keys) - 1
+        bindings = _paginate(
+            query,
+            bindings,
+            order_keys[:n_keys],
+            lambda binding: key_builder(binding, labels),
+        )
+
+    limit = LIMIT_PATTERN.search(query)
+    if limit:
+        bindings = bindings[: int(limit.group(1))]
+
+    return bindings
+
+
+def _answer_connections_query(graph: SyntheticGraph, query: str) -> List[dict]:
+    """Answer a query built by `sparql.get_connections`, one UNION branch at a time."""
+    labels = "rdfs:label ?objectLabel" in query or "rdfs:label ?subjectLabel" in query
+    body_start, body_end = query.index("{") + 1, query.rindex("}")
+    body = query[body_start:body_end]
+
+    bindings = []
+    for branch in body.split("UNION"):
+        branch = branch.strip()[1:-1].strip()
+        entities = URI_PATTERN.findall(ENTITY_VALUES_PATTERN.search(branch).group(1))
+
+        for ent in entities:
+            entity = {"type": "uri", "value": ent}
+            if "?entityLabel" in branch:
+                label = graph._label_term(ent)
+                if label is not None:
+                    bindings.append({"entity": entity, "entityLabel": label})
+                continue
+
+            direction = "from" if "?entity ?predicate ?object" in branch else "to"
+            get_part = graph.get_p_o if direction == "from" else graph.get_s_p
+            part_bindings = _order_and_limit(
+                branch, get_part(ent, labels), direction, labels
+            )
+            bindings += [{"entity": entity, **binding} for binding in part_bindings]
+
+    return bindings
+
+
+def answer_query(graph: SyntheticGraph, query: str) -> List[dict]:
+    """Answer one of the queries built in `api_utils.sparql` from `graph`."""
+    if ENTITY_VALUES_PATTERN.search(query):
+        return _answer_connections_query(graph, query)
+
+    if ALL_LABELS_PATTERN.search(query):
+        after = STRING_LITERAL_PATTERN.search(query)
+        return graph.get_all_labels(
+            int(ALL_LABELS_PATTERN.search(query).group(1)),
+            json.loads(after.group(0)) if after else None,
+        )
+
+    labels = "rdfs:label" in query
+    values = VALUES_PATTERN.search(query)
+
+    if values:
+        return graph.get_labels(URI_PATTERN.findall(values.group(1)))
+
+    if P_O_PATTERN.search(query):
+        bindings = graph.get_p_o(P_O_PATTERN.search(query).group(1), labels)
+        direction = "from"
+    elif S_P_PATTERN.search(query):
+        bindings = graph.get_s_p(S_P_PATTERN.search(query).group(1), labels)
+        direction = "to"
+    else:
+        return []
+
+    return _order_and_limit(query, bindings, direction, labels)
+
+
+def create_app(graph: SyntheticGraph, latencies: Dict[str, float]) -> FastAPI:
+    """Create the stand-in services. `latencies` maps each of "sparql", "vectors", "wikidata" and "vam" to the delay
+    added to each request to that service, in seconds."""
+    app = FastAPI()
+
+    @app.get("/_entities")
+    async def get_entities():
+        """Entities in the graph, for building benchmark requests."""
+        return {"entities": graph.entities, "hubs": graph.hubs}
+
+    @app.post("/sparql")
+    async def query_sparql(query: str = Form(...)):
+        await asyncio.sleep(latencies["sparql"])
+        return {"head": {}, "results": {"bindings": answer_query(graph, query)}}
+
+    @app.post("/neighbours")
+    async def get_neighbours(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latencies["vectors"])
+
+        response = {}
+        for ent in body["entities"]:
+            rng = random.Random(ent)
+            response[ent] = [
+                [neighbour, round((idx + 1) / (body["k"] + 1), 4)]
+                for idx, neighbour in enumerate(rng.sample(graph.entities, body["k"]))
+            ]
+
+        return response
+
+    @app.post("/distance")
+    async def get_distance(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latencies["vectors"])
+
+        return random.Random(body["entity_a"] + body["entity_b"]).random()
+
+    @app.get("/w/api.php")
+    async def get_wikidata_entities(ids: str):
+        await asyncio.sleep(latencies["wikidata"])
+
+        return {
+            "entities": {
+                qid: {"labels": {"en": {"language": "en", "value": f"Wikidata {qid}"}}}
+                for qid in ids.split("|")
+            }
+        }
+
+    @app.get("/v2/object/{object_id}")
+    async def get_vam_object(object_id: str):
+        await asyncio.sleep(latencies["vam"])
+
+        return {
+            "record": {
+                "titles": [{"title": f"V&A {object_id}", "type": "generic title"}],
+                "objectType": "object",
+            }
+        }
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Add the arguments configuring the stand-ins to `parser`."""
+    parser.add_argument(
+        "--entities", type=int, default=10_000, help="entities in the graph"
+    )
+    parser.add_argument(
+        "--degree", type=int, default=10, help="connections from each entity"
+    )
+    parser.add_argument("--hubs", type=int, default=10, help="hub entities")
+    parser.add_argument(
+        "--hub-size",
+        type=int,
+        default=2_000,
+        help="connections to and from each hub entity",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    for service in ("sparql", "vectors", "wikidata", "vam"):
+        parser.add_argument(
+            f"--{service}-latency",
+            type=float,
+            default=0,
+            help=f"latency added to each {service} request, in milliseconds",
+        )
+
+
+def stand_in_args(args: argparse.Namespace) -> List[str]:
+    """Command line arguments reproducing the stand-in configuration in `args`."""
+    return [
+        f"--entities={args.entities}",
+        f"--degree={args.degree}",
+        f"--hubs={args.hubs}",
+        f"--hub-size={args.hub_size}",
+        f"--seed={args.seed}",
+    ] + [
+        f"--{service}-latency={getattr(args, f'{service}_latency')}"
+        for service in ("sparql", "vectors", "wikidata", "vam")
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8890)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    graph = SyntheticGraph(
+        n_entities=args.entities,
+        degree=args.degree,
+        n_hubs=args.hubs,
+        hub_size=args.hub_size,
+        seed=args.seed,
+    )
+    latencies = {
+        service: getattr(args, f"{service}_latency") / 1000
+        for service in ("sparql", "vectors", "wikidata", "vam")
+    }
+
+    uvicorn.run(
+        create_app(graph, latencies),
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning",
+    )
@@ -0,0 +1,145 @@
+"""Micro-benchmark of the URI processing functions in `utils`, comparing them to the original implementations
+which they replaced.
+
+To run (from the repo root): `python -m benchmarks.uri_processing`
+"""
+import argparse
+import json
+import random
+import re
+import timeit
+import utils
+
+URI_TEMPLATES = [
+    "https://collection.sciencemuseumgroup.org.uk/objects/co{}/some-object-title",
+    "https://collection.sciencemuseumgroup.org.uk/people/cp{}",
+    "https://blog.sciencemuseum.org.uk/post-{}/",
+    "https://journal.sciencemuseum.ac.uk/article/{}",
+    "https://collections.vam.ac.uk/item/O{}/a-vam-object",
+    "https://www.wikidata.org/wiki/Q{}",
+    "http://www.wikidata.org/entity/Q{}",
+    "http://www.wikidata.org/prop/direct/P{}",
+    "http://www.heritageconnector.org/RDF/entity{}",
+    "a literal value {}",
+]
+
+
+def reference_abbreviateURI(uri: str) -> str:
+    if not isinstance(uri, str):
+        uri = str(uri)
+
+    for k, v in utils.predicateAbbreviationMapping.items():
+        if uri.startswith(k):
+            return f"{v}:{uri[len(k):]}"
+
+    return uri
+
+
+def reference_normaliseURI(uri: str) -> str:
+    try:
+        if "collection.sciencemuseumgroup" in uri:
+            return re.findall(
+                r"https:\/\/(?:collection\.sciencemuseum).(?:\w.+)\/(?:co|cd|cp|aa|ap)(?:\d+)",
+                uri,
+            )[0]
+        elif "blog.sciencemuseum.org.uk" in uri:
+            return uri
+        elif "https://journal.sciencemuseum.ac.uk" in uri:
+            return re.sub("https", "http", uri)
+        elif "collections.vam.ac.uk/item" in uri:
+            if "https" in uri:
+                uri = re.sub("https", "http", uri)
+            return re.findall(r"(http://collections.vam.ac.uk/item/[A-Za-z\d]+)", uri)[
+                0
+            ]
+        elif uri.startswith("https://www.wikidata.org/wiki/"):
+            return re.sub(
+                "https://www.wikidata.org/wiki/", "http://www.wikidata.org/entity/", uri
+            )
+        elif uri.startswith("https://www.wikidata.org/entity/"):
+            return re.sub("https", "http", uri)
+        else:
+            return uri
+
+    except Exception:
+        return uri
+
+
+def reference_assignGroupToURI(uri: str) -> str:
+    if "collection.sciencemuseumgroup" in uri:
+        return "Science Museum Group Collection"
+    elif "blog.sciencemuseum.org.uk" in uri:
+        return "Science Museum Blog"
+    elif "journal.sciencemuseum.ac.uk" in uri:
+        return "Science Museum Journal"
+    elif ("collections.vam.ac.uk" in uri) or (
+        "api.vam.ac.uk/v2/objects/search?" in uri
+    ):
+        return "V&A collection"
+    elif "http://www.wikidata.org/entity/" in uri:
+        return "Wikidata"
+    else:
+        return "Literal (raw value)"
+
+
+def make_uris(n_uris: int, n_distinct: int, seed: int = 0) -> list:
+    """Make `n_uris` URIs drawn from `n_distinct` distinct ones, mimicking the repetition in real responses."""
+    rng = random.Random(seed)
+    distinct = [
+        rng.choice(URI_TEMPLATES).format(rng.randint(1, 10_000_000))
+        for _ in range(n_distinct)
+    ]
+
+    return [rng.choice(distinct) for _ in range(n_uris)]
+
+
+def per_uri_ns(fn, uris: list, repeat: int) -> float:
+    return (
+        min(timeit.repeat(lambda: fn(uris), number=1, repeat=repeat)) / len(uris) * 1e9
+    )
+
+
+def run(n_uris: int, n_distinct: int, repeat: int) -> dict:
+    uris = make_uris(n_uris, n_distinct)
+    results = {}
+
+    for name, reference, single, batch in [
+        ("normalise", reference_normaliseURI, utils.normaliseURI, utils.normaliseURIs),
+        (
+            "abbreviate",
+            reference_abbreviateURI,
+            utils.abbreviateURI,
+            utils.abbreviateURIs,
+        ),
+        (
+            "group",
+            reference_assignGroupToURI,
+            utils.assignGroupToURI,
+            utils.assignGroupsToURIs,
+        ),
+    ]:
+        assert [reference(uri) for uri in uris] == batch(uris), name
+
+        results[name] = {
+            "before_ns_per_uri": per_uri_ns(
+                lambda us: [reference(uri) for uri in us], uris, repeat
+            ),
+            "after_ns_per_uri": per_uri_ns(
+                lambda us: [single(uri) for uri in us], uris, repeat
+            ),
+            "after_batch_ns_per_uri": per_uri_ns(batch, uris, repeat),
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uris", type=int, default=100_000, help="URIs per run")
+    parser.add_argument(
+        "--distinct", type=int, default=5_000, help="distinct URIs among them"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs (best is kept)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.uris, args.distinct, args.repeat), indent=2))
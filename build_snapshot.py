@@ -0,0 +1,93 @@
+"""Build a snapshot of the `/view_connections` pages of the most connected entities in the KG, or of a list of
+entities, for the API to serve when `ENTITY_SNAPSHOT_PATH` points to it. Uses the same configuration as the API, and
+should be rerun whenever the KG is rebuilt.
+
+To run: `python build_snapshot.py <path to snapshot> --top-n 10000`
+"""
+import argparse
+import asyncio
+import os
+from typing import List, Optional
+from api_utils import logging, snapshots, sparql
+import main
+import utils
+
+logger = logging.get_logger(__name__)
+
+
+async def get_top_entities(top_n: Optional[int]) -> List[str]:
+    """Get the `top_n` most connected entities in the KG, or all of them if `top_n` is None."""
+    results = await main.sparql_connector.get_sparql_results(
+        sparql.get_top_entities(top_n)
+    )
+
+    return [result["entity"]["value"] for result in results["results"]["bindings"]]
+
+
+async def build_snapshot(path: str, entities: List[str], max_concurrency: int):
+    """Build the view model of each entity, `max_concurrency` at a time, and write them to a snapshot at `path`.
+    The snapshot is written to a temporary file first, so an existing snapshot is only replaced once the new one
+    is complete."""
+    entities = list(dict.fromkeys(utils.normaliseURIs(entities)))
+    remaining = iter(entities)
+    n_failed = 0
+    tmp_path = f"{path}.tmp"
+
+    with snapshots.SnapshotWriter(tmp_path) as writer:
+
+        async def _worker():
+            nonlocal n_failed
+            for entity in remaining:
+                try:
+                    # pages without neighbours would be served until the next rebuild, so leave them to live queries
+                    view_model = await main.build_entity_view_model(
+                        entity, allow_missing_neighbours=False
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to build view of {entity}: {e!r}")
+                    n_failed += 1
+                    continue
+
+                writer.add(entity, view_model)
+                if len(writer) % 1000 == 0:
+                    logger.info(f"Built {len(writer)}/{len(entities)} entity views")
+
+        await asyncio.gather(*[_worker() for _ in range(max_concurrency)])
+
+    os.replace(tmp_path, path)
+    logger.info(
+        f"Snapshot of {len(entities) - n_failed} entities written to {path} ({n_failed} failed)"
+    )
+
+
+async def run(args: argparse.Namespace):
+    try:
+        if args.entities_file:
+            with open(args.entities_file) as f:
+                entities = [line.strip() for line in f if line.strip()]
+        else:
+            entities = await get_top_entities(args.top_n)
+
+        await build_snapshot(args.path, entities, args.concurrency)
+    finally:
+        await main.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="path to write the snapshot to")
+    parser.add_argument(
+        "--top-n",
+        type=int,
+        default=None,
+        help="number of entities to include, most connected first (default all)",
+    )
+    parser.add_argument(
+        "--entities-file",
+        help="file of entity URIs to include, one per line, instead of the most connected",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="entities built at once"
+    )
+
+    asyncio.run(run(parser.parse_args()))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, HttpUrl, Field
-from typing import Union, Optional, List, Dict
+from typing import Union, Optional, List, Dict, Literal
 
 """
 Request models
@@ -16,16 +16,35 @@ class DistanceRequest(BaseModel):
     entity_b: str
 
 
+class DistanceMatrixRequest(BaseModel):
+    entities: List[str]
+    entities_b: Optional[List[str]] = None
+    encoding: Literal["json", "base64"] = "json"
+
+
 class ConnectionsRequest(BaseModel):
     entities: List[str]
     labels: bool = False
     limit: Optional[int] = None
+    page_size: Optional[int] = Field(None, gt=0)
+    cursors: Dict[str, str] = {}
+
+
+class ConnectionsStreamRequest(BaseModel):
+    entities: List[str]
+    labels: bool = False
+    limit: Optional[int] = Field(None, gt=0)
+    chunk_size: int = Field(1000, gt=0)
 
 
 class LabelsRequest(BaseModel):
     uris: List[HttpUrl]
 
 
+class RecordsRequest(BaseModel):
+    uris: List[HttpUrl]
+
+
 """
 Response models
 """
@@ -55,9 +74,22 @@ class NeighboursResponse(BaseModel):
     __root__: Dict[str, List[list]]
 
 
+class DistanceMatrixResponse(BaseModel):
+    """Distances between each of `rows` and each of `columns`. With `json` encoding these are in `distances`, with
+    `null` for any pair that couldn't be computed. With `base64` encoding they are in `data` as base64-encoded
+    little-endian float32 values in row-major order, with NaN for any pair that couldn't be computed."""
+
+    rows: List[str]
+    columns: List[str]
+    shape: List[int]
+    distances: Optional[List[List[Optional[float]]]]
+    data: Optional[str]
+
+
 class EntityConnections(BaseModel):
     from_field: List[SPARQLPredicateObject] = Field(alias="from")
     to: List[SPARQLSubjectPredicate]
+    next_cursor: Optional[str]
 
 
 class ConnectionsResponse(BaseModel):
@@ -66,3 +98,21 @@ class ConnectionsResponse(BaseModel):
 
 class LabelsResponse(BaseModel):
     __root__: Dict[str, Union[str, None]]
+
+
+class Record(BaseModel):
+    """Summary of an entity from the Heritage Connector Elasticsearch index."""
+
+    uri: str
+    topconcept: Optional[str]
+    label: Optional[str]
+    description: Optional[Union[str, List[str]]]
+
+
+class RecordsResponse(BaseModel):
+    __root__: Dict[str, Optional[Record]]
+
+
+class SearchResult(BaseModel):
+    uri: str
+    label: str
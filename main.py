@@ -5,28 +5,200 @@ To run: `python api.py`
 """
 
 import argparse
-from collections import defaultdict
-import requests
+import array
+import asyncio
+import base64
 import json
+import math
+from collections import defaultdict
 import re
-from typing import List, Optional, Dict
-from fastapi import FastAPI
+from typing import List, Optional, Dict, Tuple, Union
+from urllib.parse import urlencode
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic.networks import HttpUrl
 import uvicorn
-from api_utils import logging, db_connectors, sparql
+from api_utils import (
+    logging,
+    db_connectors,
+    sparql,
+    concurrency,
+    http_clients,
+    vectors,
+    singleflight,
+    pagination,
+    responses,
+    metrics,
+    warmup,
+    resilience,
+    limiter,
+    search,
+)
 from dotenv import load_dotenv
+from elasticsearch import ElasticsearchException
 import os
+import sys
 import utils
 
 import data_models
 
 logger = logging.get_logger(__name__)
 load_dotenv()
-app = FastAPI()
-sparql_connector = db_connectors.SPARQLConnector(endpoint=os.environ["SPARQL_ENDPOINT"])
+app = FastAPI(default_response_class=responses.FastJSONResponse)
+if os.getenv("SPARQL_BACKEND", "remote") == "local":
+    from api_utils import triplestore
+
+    sparql_connector = triplestore.LocalSPARQLConnector(
+        triplestore.TripleStore.load_or_build(
+            graph_path=os.getenv("TRIPLESTORE_GRAPH_PATH"),
+            index_path=os.getenv("TRIPLESTORE_INDEX_PATH"),
+        )
+    )
+else:
+    sparql_connector = db_connectors.SPARQLConnector(
+        endpoint=os.environ["SPARQL_ENDPOINT"],
+        timeout=float(os.getenv("SPARQL_TIMEOUT", 30)),
+        max_connections=int(os.getenv("SPARQL_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(
+            os.getenv("SPARQL_MAX_KEEPALIVE_CONNECTIONS", 20)
+        ),
+        upstream=resilience.from_env("sparql", max_attempts=3, deadline=60),
+        limiter=limiter.from_env(
+            "sparql", max_limit=int(os.getenv("SPARQL_MAX_CONNECTIONS", 100))
+        ),
+    )
+if os.getenv("VECTORS_BACKEND", "remote") == "local":
+    from api_utils import embeddings
+
+    vectors_client = embeddings.EmbeddingIndex(
+        embeddings_path=os.environ["EMBEDDINGS_PATH"],
+        uris_path=os.environ["EMBEDDINGS_URIS_PATH"],
+        n_lists=int(os.getenv("EMBEDDINGS_IVF_LISTS", 0)),
+        n_probe=int(os.getenv("EMBEDDINGS_IVF_PROBES", 8)),
+        ivf_path=os.getenv("EMBEDDINGS_IVF_PATH"),
+    )
+else:
+    vectors_client = vectors.VectorsClient(
+        endpoint=os.environ["VECTORS_API"],
+        timeout=float(os.getenv("VECTORS_TIMEOUT", 30)),
+        max_connections=int(os.getenv("VECTORS_MAX_CONNECTIONS", 50)),
+        batch_window=float(os.getenv("VECTORS_BATCH_WINDOW", 0.005)),
+        max_batch_size=int(os.getenv("VECTORS_MAX_BATCH_SIZE", 64)),
+        max_matrix_pairs=int(os.getenv("DISTANCE_MATRIX_MAX_REMOTE_PAIRS", 100)),
+        upstream=resilience.from_env("vectors", max_attempts=3, deadline=30),
+    )
+if os.getenv("ELASTIC_SEARCH_CLUSTER"):
+    es_connector = db_connectors.ElasticsearchConnector(
+        es_cluster=os.environ["ELASTIC_SEARCH_CLUSTER"],
+        es_user=os.getenv("ELASTIC_SEARCH_USER"),
+        es_password=os.getenv("ELASTIC_SEARCH_PASSWORD"),
+        timeout=float(os.getenv("ELASTIC_SEARCH_TIMEOUT", 10)),
+        max_connections=int(os.getenv("ELASTIC_SEARCH_MAX_CONNECTIONS", 20)),
+        upstream=resilience.from_env("elasticsearch"),
+    )
+else:
+    es_connector = None
+ELASTIC_SEARCH_INDEX = os.getenv("ELASTIC_SEARCH_INDEX", "heritageconnector")
+ELASTIC_SEARCH_WIKI_INDEX = os.getenv("ELASTIC_SEARCH_WIKI_INDEX", "wikidump")
+# sources tried in turn for labels of entities which don't have one yet. Elasticsearch is skipped if it isn't
+# configured.
+_LABEL_SOURCES = [
+    source.strip()
+    for source in (os.getenv("LABEL_SOURCES") or "sparql,elasticsearch,external").split(
+        ","
+    )
+    if source.strip()
+]
+# where the labels in the /search index come from: "sparql", "elasticsearch" (ELASTIC_SEARCH_INDEX) or "none" to
+# turn search off
+SEARCH_INDEX_SOURCE = os.getenv("SEARCH_INDEX_SOURCE", "none")
+if SEARCH_INDEX_SOURCE not in ("sparql", "elasticsearch", "none"):
+    raise ValueError(
+        f"Unknown SEARCH_INDEX_SOURCE {SEARCH_INDEX_SOURCE}, must be sparql, elasticsearch or none"
+    )
+if SEARCH_INDEX_SOURCE == "elasticsearch" and es_connector is None:
+    raise ValueError(
+        "SEARCH_INDEX_SOURCE is elasticsearch but ELASTIC_SEARCH_CLUSTER isn't set"
+    )
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH")
+if SEARCH_INDEX_PATH and not SEARCH_INDEX_PATH.endswith(".npz"):
+    # PrefixIndex.save appends .npz to any other path, so the saved index would never be loaded
+    raise ValueError(f"SEARCH_INDEX_PATH {SEARCH_INDEX_PATH} must end in .npz")
+SEARCH_INDEX_PAGE_SIZE = int(os.getenv("SEARCH_INDEX_PAGE_SIZE", 10000))
+# number of most connected entities which rank above the rest in /search results
+SEARCH_RANK_TOP_N = int(os.getenv("SEARCH_RANK_TOP_N", 100000))
+# the search index is built from SPARQL with its own connector, so that its bulk queries don't count against the
+# deadline, circuit breaker and concurrency limit of user requests
+if SEARCH_INDEX_SOURCE == "sparql" and isinstance(
+    sparql_connector, db_connectors.SPARQLConnector
+):
+    search_index_sparql_connector = db_connectors.SPARQLConnector(
+        endpoint=os.environ["SPARQL_ENDPOINT"],
+        timeout=float(os.getenv("SEARCH_INDEX_SPARQL_TIMEOUT", 300)),
+        max_connections=1,
+        max_keepalive_connections=1,
+        upstream=resilience.from_env("search_index_sparql", max_attempts=2),
+        limiter=limiter.from_env(
+            "search_index_sparql",
+            initial_limit=1,
+            max_limit=1,
+            latency_target=float(os.getenv("SEARCH_INDEX_SPARQL_TIMEOUT", 300)),
+        ),
+    )
+else:
+    search_index_sparql_connector = sparql_connector
+search_index: Optional[search.PrefixIndex] = None
+search_index_task: Optional[asyncio.Task] = None
+# maximum number of URIs in a single /records request
+RECORDS_MAX_URIS = int(os.getenv("RECORDS_MAX_URIS", 1000))
+ENTITY_SNAPSHOT_PATH = os.getenv("ENTITY_SNAPSHOT_PATH")
+if ENTITY_SNAPSHOT_PATH and os.path.exists(ENTITY_SNAPSHOT_PATH):
+    from api_utils import snapshots
+
+    entity_snapshot = snapshots.EntitySnapshot(ENTITY_SNAPSHOT_PATH)
+else:
+    entity_snapshot = None
+# number of connections shown in each direction on each page of /view_connections
+CONNECTIONS_LIMIT = 150
+DISTANCE_MATRIX_MAX_ENTITIES = int(os.getenv("DISTANCE_MATRIX_MAX_ENTITIES", 1000))
+# maximum number of upstream queries and label lookups in flight for a single /connections request
+CONNECTIONS_MAX_CONCURRENCY = int(os.getenv("CONNECTIONS_MAX_CONCURRENCY", 10))
+# maximum number of entities whose connections are fetched in a single SPARQL query
+CONNECTIONS_MAX_ENTITIES_PER_QUERY = int(
+    os.getenv("CONNECTIONS_MAX_ENTITIES_PER_QUERY", 25)
+)
+# return SPARQL bindings from /connections and /predicate_object as they are, without validating them against the
+# response model. Only set this if the SPARQL endpoint is trusted to return well-formed results.
+TRUST_UPSTREAM_RESPONSES = (
+    os.getenv("TRUST_UPSTREAM_RESPONSES", "false").lower() == "true"
+)
+
+# entities linked from the /view_connections index page, with their images
+_ENTRY_POINT_URIS_IMAGES = {
+    "http://www.wikidata.org/entity/Q5928": "https://upload.wikimedia.org/wikipedia/commons/thumb/8/86/HendrixHoepla1967-2.jpg/220px-HendrixHoepla1967-2.jpg",  # Jimi Hendrix
+    "https://www.wikidata.org/wiki/Q35765": "https://upload.wikimedia.org/wikipedia/commons/thumb/4/4b/Osaka_montage.jpg/220px-Osaka_montage.jpg",  # Osaka
+    "https://www.wikidata.org/wiki/Q129864": "https://upload.wikimedia.org/wikipedia/commons/thumb/5/5c/Indian_Rebellion_of_1857.jpg/220px-Indian_Rebellion_of_1857.jpg",  # Indian Rebellion of 1857,
+    "https://www.wikidata.org/wiki/Q469027": "https://upload.wikimedia.org/wikipedia/commons/thumb/5/53/Issey_Miyake_Tokyo_2016.jpg/440px-Issey_Miyake_Tokyo_2016.jpg",  # Issey Miyake
+    "https://www.wikidata.org/wiki/Q46861": "https://upload.wikimedia.org/wikipedia/commons/thumb/c/c5/Unknown_Tibetan_Sanskrit_Text.jpg/440px-Unknown_Tibetan_Sanskrit_Text.jpg",  # Tibetan alphabet
+    "https://www.wikidata.org/wiki/Q585777": "https://upload.wikimedia.org/wikipedia/commons/thumb/7/75/Aerial_View_of_Brookhaven_National_Laboratory.jpg/440px-Aerial_View_of_Brookhaven_National_Laboratory.jpg",  # Brookhaven National Laboratory
+    "https://www.wikidata.org/wiki/Q9696": "https://upload.wikimedia.org/wikipedia/commons/thumb/c/c3/John_F._Kennedy%2C_White_House_color_photo_portrait.jpg/440px-John_F._Kennedy%2C_White_House_color_photo_portrait.jpg",  # John F Kennedy
+    "https://www.wikidata.org/wiki/Q172763": "https://live.staticflickr.com/65535/50046568722_73000066f0_z.jpg",  # Joy Division
+    "https://www.wikidata.org/wiki/Q8577": "https://upload.wikimedia.org/wikipedia/commons/thumb/3/3a/15-11-05_101_Monument.jpg/440px-15-11-05_101_Monument.jpg",  # 2012 Summer Olympics
+    "https://www.wikidata.org/wiki/Q9439": "https://upload.wikimedia.org/wikipedia/commons/thumb/e/e3/Queen_Victoria_by_Bassano.jpg/440px-Queen_Victoria_by_Bassano.jpg",  # Queen Victoria
+    # "https://www.wikidata.org/wiki/Q37922": "https://upload.wikimedia.org/wikipedia/commons/thumb/5/57/Nobel2008Literature_news_conference1.jpg/440px-Nobel2008Literature_news_conference1.jpg" # Nobel Prize in Literature
+}
+ENTRY_POINT_URIS_IMAGES = {
+    utils.normaliseURI(k): v for k, v in _ENTRY_POINT_URIS_IMAGES.items()
+}
+# prefetch labels, neighbours and connections for the entry points and popular entities after startup, and only
+# report the instance as ready at /ready once that's done
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+warmup_state = warmup.Warmup(
+    max_concurrency=int(os.getenv("WARMUP_MAX_CONCURRENCY", 4)),
+    max_seconds=float(os.getenv("WARMUP_MAX_SECONDS", 300)),
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,15 +206,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # so that browser clients can page through /predicate_object
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(metrics.ServerTimingMiddleware)
 
 templates = Jinja2Templates(directory="templates")
 templates.env.filters["abbreviateURI"] = utils.abbreviateURI
 
 
+@app.exception_handler(resilience.UpstreamUnavailableError)
+async def upstream_unavailable_handler(
+    request, exc: resilience.UpstreamUnavailableError
+):
+    """Respond with 503 when an upstream needed for the response is unavailable, rather than a 500."""
+    headers = (
+        {"Retry-After": str(math.ceil(exc.retry_after))}
+        if exc.retry_after is not None
+        else None
+    )
+
+    return responses.FastJSONResponse(
+        {"detail": str(exc)}, status_code=503, headers=headers
+    )
+
+
 @app.on_event("startup")
 async def startup():
-    pass
+    global search_index_task
+    warmup_state.start(get_warmup_steps() if WARMUP_ENABLED else [])
+    if SEARCH_INDEX_SOURCE != "none":
+        search_index_task = asyncio.ensure_future(load_or_build_search_index())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await warmup_state.stop()
+    if search_index_task is not None and not search_index_task.done():
+        search_index_task.cancel()
+    await sparql_connector.close()
+    if search_index_sparql_connector is not sparql_connector:
+        await search_index_sparql_connector.close()
+    await vectors_client.close()
+    if es_connector is not None:
+        await es_connector.close()
+    await http_clients.close_all()
+    if entity_snapshot is not None:
+        entity_snapshot.close()
 
 
 @app.post(
@@ -56,12 +266,43 @@ async def startup():
     response_model=List[data_models.SPARQLPredicateObject],
     response_model_exclude_unset=True,
 )
-async def get_predicate_object(uri: HttpUrl, labels: bool = False):
-    """Get all the predicate-object pairs for an entity with a specific URI. Optionally return the labels of all objects which have labels."""
+async def get_predicate_object(
+    uri: HttpUrl,
+    response: Response,
+    labels: bool = False,
+    page_size: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
+):
+    """Get all the predicate-object pairs for an entity with a specific URI. Optionally return the labels of all objects which have labels.
+
+    To page through the results, set `page_size`. If there are more results the response has an `X-Next-Cursor`
+    header, which can be passed back as `cursor` to get the next page.
+    """
     # TODO: return correct error if URL not in database
-    return sparql_connector.get_sparql_results(
-        sparql.get_p_o(utils.normaliseURI(uri), labels=labels)
-    )["results"]["bindings"]
+    if page_size is None:
+        if cursor:
+            raise HTTPException(
+                status_code=400, detail="cursor can only be used with page_size"
+            )
+        return trusted_response(
+            (
+                await sparql_connector.get_sparql_results(
+                    sparql.get_p_o(utils.normaliseURI(uri), labels=labels)
+                )
+            )["results"]["bindings"]
+        )
+
+    after = _decode_page_cursor(cursor, labels)[0] if cursor else None
+    bindings, next_after = await get_connections_page(
+        utils.normaliseURI(uri), "from", labels, page_size, after
+    )
+
+    headers = {}
+    if next_after is not None:
+        headers["X-Next-Cursor"] = pagination.encode_cursor([next_after])
+        response.headers.update(headers)
+
+    return trusted_response(bindings, headers)
 
 
 @app.post("/neighbours", response_model=data_models.NeighboursResponse)
@@ -86,41 +327,87 @@ async def get_neighbours(request: data_models.NeighboursRequest):
     ```
     """
 
-    entities_normalised = [utils.normaliseURI(uri) for uri in request.entities]
-
-    neighbours_api_endpoint = f"{os.environ['VECTORS_API']}/neighbours"
-    body = json.dumps(
-        {
-            "entities": entities_normalised,
-            "k": request.k,
-        }
-    )
-    headers = {
-        "Content-Type": "application/json",
-    }
-    response = requests.post(neighbours_api_endpoint, headers=headers, data=body)
+    entities_normalised = utils.normaliseURIs(request.entities)
 
-    return response.json()
+    try:
+        return await vectors_client.get_neighbours(entities_normalised, k=request.k)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"No embedding for {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/distance", response_model=float)
 async def get_distance(request: data_models.DistanceRequest):
     """Return the distance between two entities, represented by their KG embeddings vectors. A 'similarity' score can be calculated as `1-distance`."""
 
-    distance_api_endpoint = f"{os.environ['VECTORS_API']}/distance"
-    body = json.dumps(
-        {
-            "entity_a": utils.normaliseURI(request.entity_a),
-            "entity_b": utils.normaliseURI(request.entity_b),
-        }
+    try:
+        return await vectors_client.get_distance(
+            utils.normaliseURI(request.entity_a), utils.normaliseURI(request.entity_b)
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"No embedding for {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post(
+    "/distance/matrix",
+    response_model=data_models.DistanceMatrixResponse,
+    response_model_exclude_none=True,
+)
+async def get_distance_matrix(request: data_models.DistanceMatrixRequest):
+    """Return the distances between each pair of entities in `entities`, or between each entity in `entities` and
+    each entity in `entities_b` if it's given. Distances are computed in one pass rather than one request per pair.
+
+    With `encoding=json` the matrix is returned as nested lists in `distances`. With `encoding=base64` it's returned
+    in `data` as base64-encoded little-endian float32 values in row-major order, which is much smaller for large
+    matrices. Pairs that couldn't be computed are `null` or NaN respectively.
+
+    With the vectors API as the backend, each distinct pair of entities is a request to the API, so only small
+    matrices (`DISTANCE_MATRIX_MAX_REMOTE_PAIRS` pairs) can be computed.
+    """
+
+    rows = utils.normaliseURIs(request.entities)
+    columns = (
+        rows if request.entities_b is None else utils.normaliseURIs(request.entities_b)
     )
-    headers = {
-        "Content-Type": "application/json",
+
+    if max(len(rows), len(columns)) > DISTANCE_MATRIX_MAX_ENTITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {DISTANCE_MATRIX_MAX_ENTITIES} entities can be compared in each dimension",
+        )
+
+    try:
+        distances = await vectors_client.get_distance_matrix(rows, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response = {
+        "rows": request.entities,
+        "columns": request.entities
+        if request.entities_b is None
+        else request.entities_b,
+        "shape": [len(rows), len(columns)],
     }
 
-    response = requests.post(distance_api_endpoint, headers=headers, data=body)
+    if request.encoding == "base64":
+        values = array.array(
+            "f",
+            [
+                float("nan") if distance is None else distance
+                for row in distances
+                for distance in row
+            ],
+        )
+        if sys.byteorder != "little":
+            values.byteswap()
+        response["data"] = base64.b64encode(values.tobytes()).decode("ascii")
+    else:
+        response["distances"] = distances
 
-    return response.json()
+    return response
 
 
 @app.post(
@@ -130,44 +417,105 @@ async def get_distance(request: data_models.DistanceRequest):
 )
 async def get_connections(request: data_models.ConnectionsRequest):
     """Get connections *from* and *to* each entity in the request.
-    Connections *to* are all the subject-predicate pairs where the entity is the object, and connections *from* are all the predicate-object pairs where the entity is the subject."""
+    Connections *to* are all the subject-predicate pairs where the entity is the object, and connections *from* are all the predicate-object pairs where the entity is the subject.
 
-    response = {}
+    To page through connections, set `page_size` (which replaces `limit`). Each entity in the response then has a
+    `next_cursor`, which is `null` once there are no more connections to or from it. To get the next page, pass the
+    cursors back in `cursors`, keyed by entity.
+    """
 
-    for ent in request.entities:
-        ent_normalised = utils.normaliseURI(ent)
-        connections_from = sparql_connector.get_sparql_results(
-            sparql.get_p_o(ent_normalised, labels=request.labels, limit=request.limit)
-        )["results"]["bindings"]
+    return trusted_response(await fetch_connections(request))
 
-        connections_to = sparql_connector.get_sparql_results(
-            sparql.get_s_p(ent_normalised, labels=request.labels, limit=request.limit)
-        )["results"]["bindings"]
 
-        for predicate_object_dict in connections_from:
-            if (
-                "collections.vam.ac.uk" in predicate_object_dict["object"]["value"]
-            ) and "objectLabel" not in predicate_object_dict:
-                object_label = utils.get_vam_object_title(
-                    predicate_object_dict["object"]["value"]
-                )
-                if object_label is not None:
-                    predicate_object_dict["objectLabel"] = dict()
-                    predicate_object_dict["objectLabel"]["type"] = "literal"
-                    predicate_object_dict["objectLabel"]["value"] = object_label
+async def fetch_connections(
+    request: data_models.ConnectionsRequest, prefetch_entity_labels: bool = False
+) -> dict:
+    """Get the response to a `/connections` request, without wrapping it in a response if
+    `TRUST_UPSTREAM_RESPONSES` is set, so that it can be used by other endpoints.
 
-        for subject_predicate_dict in connections_to:
-            if (
-                "collections.vam.ac.uk" in subject_predicate_dict["subject"]["value"]
-            ) and "subjectLabel" not in subject_predicate_dict:
-                subject_label = utils.get_vam_object_title(
-                    subject_predicate_dict["subject"]["value"]
-                )
-                if subject_label is not None:
-                    subject_predicate_dict["subjectLabel"] = dict()
-                    subject_predicate_dict["subjectLabel"]["type"] = "literal"
-                    subject_predicate_dict["subjectLabel"]["value"] = subject_label
+    Args:
+        request (data_models.ConnectionsRequest)
+        prefetch_entity_labels (bool, optional): also get the KG labels of the entities in the request, in the same
+            queries as their connections, and add them to the label cache so that `get_labels` doesn't have to query
+            for them. Defaults to False.
+    """
+
+    entities_normalised = utils.normaliseURIs(request.entities)
+    paginate = request.page_size is not None
+    if request.cursors and not paginate:
+        raise HTTPException(
+            status_code=400, detail="cursors can only be used with page_size"
+        )
+    cursor_states = {
+        ent: (
+            _decode_connections_cursor(request.cursors[ent], request.labels)
+            if ent in request.cursors
+            else {"from": None, "to": None}
+        )
+        for ent in request.entities
+    }
+
+    # (normalised entity, direction, after) for each set of connections to get, skipping those already at the end
+    parts = list(
+        {
+            (ent_normalised, direction, json.dumps(cursor_states[ent][direction])): (
+                ent_normalised,
+                direction,
+                cursor_states[ent][direction],
+            )
+            for ent, ent_normalised in zip(request.entities, entities_normalised)
+            for direction in ("from", "to")
+            if cursor_states[ent][direction] != "end"
+        }.values()
+    )
+    part_results, entity_labels = await get_connection_parts(
+        parts,
+        request.labels,
+        limit=request.limit,
+        page_size=request.page_size,
+        entity_labels=entities_normalised if prefetch_entity_labels else (),
+    )
+    if prefetch_entity_labels:
+        await utils.cached_labels.set_many(
+            "kg", {ent: entity_labels.get(ent) for ent in entities_normalised}
+        )
 
+    def _get_bindings(
+        ent: str, ent_normalised: str, direction: str
+    ) -> Tuple[List[dict], Union[List[str], str, None]]:
+        """Get connections in one direction. Returns a copy of the bindings and, if paginating, the position to
+        continue from (None if at the start, "end" if there are no more pages)."""
+        after = cursor_states[ent][direction]
+        if after == "end":
+            return [], "end"
+
+        bindings, next_after = part_results[
+            (ent_normalised, direction, json.dumps(after))
+        ]
+        if not paginate:
+            return list(bindings), None
+
+        return list(bindings), "end" if next_after is None else next_after
+
+    results_from = [
+        _get_bindings(ent, ent_normalised, "from")
+        for ent, ent_normalised in zip(request.entities, entities_normalised)
+    ]
+    results_to = [
+        _get_bindings(ent, ent_normalised, "to")
+        for ent, ent_normalised in zip(request.entities, entities_normalised)
+    ]
+
+    await add_vam_labels(
+        [(connections_from, "object") for connections_from, _ in results_from]
+        + [(connections_to, "subject") for connections_to, _ in results_to]
+    )
+
+    response = {}
+
+    for ent, (connections_from, state_from), (connections_to, state_to) in zip(
+        request.entities, results_from, results_to
+    ):
         response.update(
             {
                 ent: {
@@ -177,9 +525,326 @@ async def get_connections(request: data_models.ConnectionsRequest):
             }
         )
 
+        if paginate:
+            response[ent]["next_cursor"] = (
+                None
+                if state_from == state_to == "end"
+                else pagination.encode_cursor({"from": state_from, "to": state_to})
+            )
+
     return response
 
 
+def trusted_response(
+    content, headers: Optional[Dict[str, str]] = None
+) -> Union[responses.FastJSONResponse, list, dict]:
+    """If `TRUST_UPSTREAM_RESPONSES` is set, wrap `content` in a response so that FastAPI serialises it as it is,
+    rather than validating it against the endpoint's `response_model` first. The response model is still used for
+    the OpenAPI schema. Otherwise return `content` unchanged."""
+    if TRUST_UPSTREAM_RESPONSES:
+        return responses.FastJSONResponse(content, headers=headers)
+
+    return content
+
+
+async def get_connections_page(
+    ent_normalised: str,
+    direction: str,
+    labels: bool,
+    page_size: int,
+    after: Optional[List[str]] = None,
+) -> Tuple[List[dict], Optional[List[str]]]:
+    """Get one page of connections from or to an entity, in a deterministic order.
+
+    Args:
+        ent_normalised (str): normalised URI of the entity
+        direction (str): `from` or `to`
+        labels (bool): whether to return labels
+        page_size (int): maximum number of connections to return
+        after (Optional[List[str]], optional): key of the last connection on the previous page. Defaults to None,
+            which returns the first page.
+
+    Returns:
+        Tuple[List[dict], Optional[List[str]]]: the page of connections, and the key to pass as `after` to get the
+            next page or None if this is the last page.
+    """
+    query_builder, key_builder = {
+        "from": (sparql.get_p_o, sparql.get_p_o_key),
+        "to": (sparql.get_s_p, sparql.get_s_p_key),
+    }[direction]
+
+    # one extra result is requested to find out whether there's another page
+    results = await sparql_connector.get_sparql_results(
+        query_builder(
+            ent_normalised,
+            labels=labels,
+            limit=page_size + 1,
+            paginate=True,
+            after=after,
+        )
+    )
+    bindings = results["results"]["bindings"][:page_size]
+
+    if len(results["results"]["bindings"]) > page_size:
+        return bindings, key_builder(bindings[-1], labels)
+
+    return bindings, None
+
+
+async def get_connection_parts(
+    parts: List[Tuple[str, str, Optional[List[str]]]],
+    labels: bool,
+    limit: Optional[int] = None,
+    page_size: Optional[int] = None,
+    entity_labels: List[str] = (),
+) -> Tuple[
+    Dict[Tuple[str, str, str], Tuple[List[dict], Optional[List[str]]]], Dict[str, str]
+]:
+    """Get connections for several entities and directions, fusing them into as few queries as possible (see
+    `sparql.get_connections`). Each query covers at most `CONNECTIONS_MAX_ENTITIES_PER_QUERY` entities, and at
+    most `CONNECTIONS_MAX_CONCURRENCY` queries are run at once.
+
+    Args:
+        parts (List[Tuple[str, str, Optional[List[str]]]]): (normalised entity, direction, after) for each set of
+            connections to get, where `after` is the key of the last connection on the previous page, or None
+        labels (bool): whether to return labels
+        limit (Optional[int], optional): maximum number of connections for each part, if not paginating
+        page_size (Optional[int], optional): number of connections in each page. If set, results are paginated.
+        entity_labels (List[str], optional): entities to also get the KG labels of. Defaults to none.
+
+    Returns:
+        Tuple[Dict[Tuple[str, str, str], Tuple[List[dict], Optional[List[str]]]], Dict[str, str]]: the bindings and
+            the `after` for the next page (None if this is the last page, or if not paginating) for each part, keyed
+            by (entity, direction, JSON-encoded `after`); and the label of each entity in `entity_labels` which has
+            one. Bindings may be shared with other requests, so mustn't be modified.
+    """
+    paginate = page_size is not None
+    max_parts = 2 * CONNECTIONS_MAX_ENTITIES_PER_QUERY
+
+    # an entity and direction can only appear once in each query, e.g. if two URIs normalise to the same entity but
+    # were sent with different cursors
+    chunks = []
+    for part in parts:
+        chunk = next(
+            (
+                chunk
+                for chunk in chunks
+                if len(chunk) < max_parts
+                and all(part[:2] != other[:2] for other in chunk)
+            ),
+            None,
+        )
+        if chunk is None:
+            chunk = []
+            chunks.append(chunk)
+        chunk.append(part)
+
+    async def _get_chunk(chunk: list, chunk_entity_labels: List[str]):
+        # one extra result is requested when paginating, to find out whether there's another page
+        results = await sparql_connector.get_sparql_results(
+            sparql.get_connections(
+                chunk,
+                labels,
+                limit=page_size + 1 if paginate else limit,
+                paginate=paginate,
+                entity_labels=chunk_entity_labels,
+            )
+        )
+        return sparql.split_connections(
+            results["results"]["bindings"], labels, paginate
+        )
+
+    # entity labels are fetched in the first query, or in a query of their own if there are no connections to get
+    chunk_results = await concurrency.gather_with_concurrency(
+        asyncio.Semaphore(CONNECTIONS_MAX_CONCURRENCY),
+        *[
+            _get_chunk(chunk, entity_labels if idx == 0 else ())
+            for idx, chunk in enumerate(chunks or ([[]] if entity_labels else []))
+        ],
+    )
+
+    part_results = {}
+    all_entity_labels = {}
+    for chunk, (connections, chunk_entity_labels) in zip(chunks, chunk_results):
+        for ent, direction, after in chunk:
+            bindings = connections.get((ent, direction), [])
+            next_after = None
+            if paginate and len(bindings) > page_size:
+                bindings = bindings[:page_size]
+                key_builder = (
+                    sparql.get_p_o_key if direction == "from" else sparql.get_s_p_key
+                )
+                next_after = key_builder(bindings[-1], labels)
+            part_results[(ent, direction, json.dumps(after))] = (bindings, next_after)
+    for _, chunk_entity_labels in chunk_results:
+        all_entity_labels.update(chunk_entity_labels)
+
+    return part_results, all_entity_labels
+
+
+def _is_valid_key(key, labels: bool) -> bool:
+    """Whether `key` is the key of a result of a paginated `get_p_o` or `get_s_p` query, with or without `labels`. A
+    cursor from a page with a different value of `labels` has a key of the wrong length."""
+    return (
+        isinstance(key, list)
+        and len(key) == len(sparql.P_O_ORDER_KEYS) + (1 if labels else 0)
+        and all(isinstance(value, str) for value in key)
+    )
+
+
+def _decode_page_cursor(cursor: str, labels: bool) -> list:
+    try:
+        state = pagination.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not (
+        isinstance(state, list) and len(state) == 1 and _is_valid_key(state[0], labels)
+    ):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+    return state
+
+
+def _decode_connections_cursor(cursor: str, labels: bool) -> dict:
+    try:
+        state = pagination.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def _is_valid_position(position) -> bool:
+        return position is None or position == "end" or _is_valid_key(position, labels)
+
+    if not (
+        isinstance(state, dict)
+        and state.keys() == {"from", "to"}
+        and all(_is_valid_position(position) for position in state.values())
+    ):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+    return state
+
+
+async def add_vam_labels(connections: List[Tuple[List[dict], str]]):
+    """Add labels to V&A objects which don't have one in the KG, using titles from the V&A API. Titles for all
+    the lists of bindings passed are fetched in one batch.
+
+    Query results may be shared with other requests, so labelled bindings are replaced with labelled copies rather
+    than being modified. The lists of bindings themselves are modified, so shouldn't be the ones returned by the
+    SPARQL connector.
+
+    Args:
+        connections (List[Tuple[List[dict], str]]): (bindings, field) pairs, where `field` is the name of the field in
+            each binding which may be a V&A object, i.e. `object` or `subject`.
+    """
+    vam_bindings = [
+        (bindings, idx, field)
+        for bindings, field in connections
+        for idx, binding in enumerate(bindings)
+        if ("collections.vam.ac.uk" in binding[field]["value"])
+        and f"{field}Label" not in binding
+    ]
+    vam_titles = await utils.get_vam_object_titles(
+        bindings[idx][field]["value"] for bindings, idx, field in vam_bindings
+    )
+
+    for bindings, idx, field in vam_bindings:
+        title = vam_titles[bindings[idx][field]["value"]]
+        if title is not None:
+            bindings[idx] = {
+                **bindings[idx],
+                f"{field}Label": {"type": "literal", "value": title},
+            }
+
+
+@app.post("/connections/stream", response_class=StreamingResponse)
+async def stream_connections(request: data_models.ConnectionsStreamRequest):
+    """Streaming version of `/connections`, for large numbers of entities or connections. Returns newline-delimited
+    JSON, with one line for each chunk of at most `chunk_size` connections:
+
+    ```
+    {"entity": "input_entity_1", "direction": "from", "bindings": [...]}
+    {"entity": "input_entity_2", "direction": "to", "bindings": [...]}
+    ...
+    ```
+
+    Connections for each entity and direction are fetched one page of `chunk_size` at a time, and lines are sent as
+    soon as each page arrives, so they arrive in no particular order and memory use is bounded by the chunk size
+    rather than the number of connections. Each entity and direction always produces at least one line, which has
+    empty `bindings` if there are no connections.
+    """
+
+    return StreamingResponse(
+        _generate_connections_ndjson(request), media_type="application/x-ndjson"
+    )
+
+
+async def _generate_connections_ndjson(request: data_models.ConnectionsStreamRequest):
+    semaphore = asyncio.Semaphore(CONNECTIONS_MAX_CONCURRENCY)
+    # lines waiting to be sent. This is bounded so that queries pause rather than piling up results in memory if the
+    # client reads slowly.
+    lines = asyncio.Queue(maxsize=CONNECTIONS_MAX_CONCURRENCY)
+    limit = request.limit
+
+    async def _stream_bindings(ent: str, direction: str):
+        ent_normalised = utils.normaliseURI(ent)
+        field = "object" if direction == "from" else "subject"
+        after = None
+        n_sent = 0
+
+        while True:
+            page_size = (
+                request.chunk_size
+                if limit is None
+                else min(request.chunk_size, limit - n_sent)
+            )
+            async with semaphore:
+                bindings, after = await get_connections_page(
+                    ent_normalised, direction, request.labels, page_size, after
+                )
+            await add_vam_labels([(bindings, field)])
+            await lines.put(
+                responses.dumps(
+                    {"entity": ent, "direction": direction, "bindings": bindings}
+                )
+                + b"\n"
+            )
+            n_sent += len(bindings)
+
+            if after is None or (limit is not None and n_sent >= limit):
+                break
+
+    tasks = [
+        asyncio.ensure_future(_stream_bindings(ent, direction))
+        for ent in request.entities
+        for direction in ("from", "to")
+    ]
+
+    async def _stream_all():
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            # gather doesn't cancel the other tasks when one fails, so stop them querying before reporting the error
+            for task in tasks:
+                task.cancel()
+            await lines.put(e)
+        else:
+            await lines.put(None)
+
+    producer = asyncio.ensure_future(_stream_all())
+
+    try:
+        while (line := await lines.get()) is not None:
+            if isinstance(line, Exception):
+                raise line
+            yield line
+    finally:
+        # the client may have disconnected with tasks still running (or waiting to put lines nobody will read)
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+
 def flatten_connections_response(connections_response, _id):
     """Process response from the /connections API to a format that can be easily displayed by the jinja2 template
     at `templates/connections.html`.
@@ -199,6 +864,11 @@ def flatten_connections_response(connections_response, _id):
             connection["predicate"]["value"]
         )
 
+        # objects with labels are in the KG, except V&A objects whose labels come from the V&A API in
+        # `add_vam_labels`. This is only used to filter Wikidata objects, which can only get labels from the KG.
+        processed_connection["in_kg"] = "objectLabel" in connection
+        processed_connection["group"] = _get_connection_group(connection["object"])
+
         if connection["object"]["type"] == "uri":
             if "objectLabel" in connection:
                 processed_connection[
@@ -219,6 +889,9 @@ def flatten_connections_response(connections_response, _id):
             connection["predicate"]["value"]
         )
 
+        processed_connection["in_kg"] = "subjectLabel" in connection
+        processed_connection["group"] = _get_connection_group(connection["subject"])
+
         if connection["subject"]["type"] == "uri":
             if "subjectLabel" in connection:
                 processed_connection[
@@ -236,61 +909,64 @@ def flatten_connections_response(connections_response, _id):
     return flattened_connections_data
 
 
+def _get_connection_group(value: dict) -> str:
+    """Group (see `utils.assignGroupToURI`) of the object or subject of a connection, from its SPARQL binding."""
+    if value["type"] == "uri":
+        return utils.assignGroupToURI(utils.normaliseURI(value["value"]))
+
+    return utils.assignGroupToURI(value["value"])
+
+
 def group_flattened_connections(flattened_connections: dict) -> dict:
     """Group the dict created by `flatten_connections_response` according to the manual groups
     set in `utils.predicateManualGroups`.
     """
 
     # each of the items in the from and to dicts takes the form {"group_name": [data, ...]}
-    grouped_connections = {"from": {}, "to": {}}
-    predicates_in_from = [item["predicate"] for item in flattened_connections["from"]]
-    predicates_in_to = [item["predicate"] for item in flattened_connections["to"]]
+    grouped_connections = {
+        "from": _group_connections(flattened_connections["from"], "object"),
+        "to": _group_connections(flattened_connections["to"], "subject"),
+    }
+
+    return grouped_connections
+
 
-    for group_name, abbreviated_predicates in utils.predicateManualGroups.items():
-        from_data = defaultdict(list)
+def _group_connections(connections: List[dict], field: str) -> dict:
+    """Group connections in one direction in a single pass, using the predicate -> group index in
+    `utils.predicateManualGroupIndex`. Within each group, connections are ordered by the position of their predicate
+    in the group and then by their original order, and grouped again by the `group` of their `field`."""
 
-        if group_name.startswith("Wikidata connections"):
+    # group name -> position of predicate in group -> connections
+    connections_by_group = defaultdict(lambda: defaultdict(list))
+
+    for item in connections:
+        for group_name, position in utils.predicateManualGroupIndex.get(
+            item["predicate"], ()
+        ):
             # if Wikidata, only include connections to other Wikidata items that are in the KG.
-            # We can identify these by matching on the HTML link pattern that is used for Wikidata records which have a label (i.e. they are in the Wikidata cache, thus in the KG).
-            for p in abbreviated_predicates:
-                if p in predicates_in_from:
-                    for i in flattened_connections["from"]:
-                        if (i["predicate"] == p) and (
-                            len(
-                                re.findall(
-                                    r"<a href='http://www.wikidata.org/entity/Q\d+'>.+\[WD:Q\d+\]</a>",
-                                    i["object"],
-                                )
-                            )
-                            > 0
-                        ):
-                            from_data[utils.assignGroupToURI(i["object"])].append(i)
-        else:
-            for p in abbreviated_predicates:
-                if p in predicates_in_from:
-                    for i in flattened_connections["from"]:
-                        if i["predicate"] == p:
-                            from_data[utils.assignGroupToURI(i["object"])].append(i)
-
-        if from_data:
-            grouped_connections["from"][group_name] = {
-                k: v for k, v in from_data.items() if v
-            }
+            if (
+                field == "object"
+                and group_name.startswith("Wikidata connections")
+                and not (item["in_kg"] and item["group"] == "Wikidata")
+            ):
+                continue
 
-        to_data = defaultdict(list)
+            connections_by_group[group_name][position].append(item)
 
-        for p in abbreviated_predicates:
-            if p in predicates_in_to:
-                for i in flattened_connections["to"]:
-                    if i["predicate"] == p:
-                        to_data[utils.assignGroupToURI(i["subject"])].append(i)
+    grouped = {}
 
-        if to_data:
-            grouped_connections["to"][group_name] = {
-                k: v for k, v in to_data.items() if v
-            }
+    for group_name in utils.predicateManualGroups:
+        if group_name not in connections_by_group:
+            continue
 
-    return grouped_connections
+        group_data = defaultdict(list)
+        for _, items in sorted(connections_by_group[group_name].items()):
+            for item in items:
+                group_data[item["group"]].append(item)
+
+        grouped[group_name] = dict(group_data)
+
+    return grouped
 
 
 async def process_neighbours_output(neighbours: List[list]):
@@ -333,37 +1009,23 @@ async def process_neighbours_output(neighbours: List[list]):
 
 
 @app.get("/view_connections", include_in_schema=False)
-async def view_connections_single_entity(entity: Optional[str] = None):
-    """View HTML template showing connections to and from each entity in the request."""
+async def view_connections_single_entity(
+    entity: Optional[str] = None, cursor: Optional[str] = None
+):
+    """View HTML template showing connections to and from each entity in the request. Connections are shown
+    `CONNECTIONS_LIMIT` at a time in each direction, with a link to the next page if there are more.
 
-    CONNECTIONS_LIMIT = 150
+    The first page is served from the entity snapshot at `ENTITY_SNAPSHOT_PATH` if there is one and it contains the
+    entity, and is built from live queries otherwise."""
 
     if entity is None:
-        entry_point_uris_images = {
-            "http://www.wikidata.org/entity/Q5928": "https://upload.wikimedia.org/wikipedia/commons/thumb/8/86/HendrixHoepla1967-2.jpg/220px-HendrixHoepla1967-2.jpg",  # Jimi Hendrix
-            "https://www.wikidata.org/wiki/Q35765": "https://upload.wikimedia.org/wikipedia/commons/thumb/4/4b/Osaka_montage.jpg/220px-Osaka_montage.jpg",  # Osaka
-            "https://www.wikidata.org/wiki/Q129864": "https://upload.wikimedia.org/wikipedia/commons/thumb/5/5c/Indian_Rebellion_of_1857.jpg/220px-Indian_Rebellion_of_1857.jpg",  # Indian Rebellion of 1857,
-            "https://www.wikidata.org/wiki/Q469027": "https://upload.wikimedia.org/wikipedia/commons/thumb/5/53/Issey_Miyake_Tokyo_2016.jpg/440px-Issey_Miyake_Tokyo_2016.jpg",  # Issey Miyake
-            "https://www.wikidata.org/wiki/Q46861": "https://upload.wikimedia.org/wikipedia/commons/thumb/c/c5/Unknown_Tibetan_Sanskrit_Text.jpg/440px-Unknown_Tibetan_Sanskrit_Text.jpg",  # Tibetan alphabet
-            "https://www.wikidata.org/wiki/Q585777": "https://upload.wikimedia.org/wikipedia/commons/thumb/7/75/Aerial_View_of_Brookhaven_National_Laboratory.jpg/440px-Aerial_View_of_Brookhaven_National_Laboratory.jpg",  # Brookhaven National Laboratory
-            "https://www.wikidata.org/wiki/Q9696": "https://upload.wikimedia.org/wikipedia/commons/thumb/c/c3/John_F._Kennedy%2C_White_House_color_photo_portrait.jpg/440px-John_F._Kennedy%2C_White_House_color_photo_portrait.jpg",  # John F Kennedy
-            "https://www.wikidata.org/wiki/Q172763": "https://live.staticflickr.com/65535/50046568722_73000066f0_z.jpg",  # Joy Division
-            "https://www.wikidata.org/wiki/Q8577": "https://upload.wikimedia.org/wikipedia/commons/thumb/3/3a/15-11-05_101_Monument.jpg/440px-15-11-05_101_Monument.jpg",  # 2012 Summer Olympics
-            "https://www.wikidata.org/wiki/Q9439": "https://upload.wikimedia.org/wikipedia/commons/thumb/e/e3/Queen_Victoria_by_Bassano.jpg/440px-Queen_Victoria_by_Bassano.jpg",  # Queen Victoria
-            # "https://www.wikidata.org/wiki/Q37922": "https://upload.wikimedia.org/wikipedia/commons/thumb/5/57/Nobel2008Literature_news_conference1.jpg/440px-Nobel2008Literature_news_conference1.jpg" # Nobel Prize in Literature
-        }
-        entry_point_uris = [
-            utils.normaliseURI(uri) for uri in entry_point_uris_images.keys()
-        ]
-        entry_point_uris_images = {
-            utils.normaliseURI(k): v for k, v in entry_point_uris_images.items()
-        }
         entry_point_uri_label_mapping = await (
-            get_labels(data_models.LabelsRequest(uris=entry_point_uris))
+            get_labels(data_models.LabelsRequest(uris=list(ENTRY_POINT_URIS_IMAGES)))
         )
         request = dict()
         request["entry_points"] = entry_point_uri_label_mapping
-        request["entry_points_images"] = entry_point_uris_images
+        request["entry_points_images"] = ENTRY_POINT_URIS_IMAGES
+        request["search_enabled"] = SEARCH_INDEX_SOURCE != "none"
         return templates.TemplateResponse(
             "connections_index.html", {"request": request}
         )
@@ -373,34 +1035,382 @@ async def view_connections_single_entity(entity: Optional[str] = None):
         logger.debug("redirecting")
         return RedirectResponse(url=f"/view_connections?entity={entity_redirect}")
 
+    view_model = None
+    if cursor is None and entity_snapshot is not None:
+        with metrics.time_stage("snapshot"):
+            view_model = entity_snapshot.get(entity)
+
+    if view_model is None:
+        view_model = await build_entity_view_model(entity, cursor)
+
+    with metrics.time_stage("render"):
+        return templates.TemplateResponse(
+            "connections.html",
+            {
+                "request": view_model["connections"],
+                "neighbours": view_model["neighbours"],
+                "id": view_model["id"],
+                "label": view_model["label"],
+                "next_page_url": view_model["next_page_url"],
+            },
+        )
+
+
+async def build_entity_view_model(
+    entity: str, cursor: Optional[str] = None, allow_missing_neighbours: bool = True
+) -> dict:
+    """Get everything shown on the `/view_connections` page for an entity, from live queries.
+
+    Args:
+        entity (str): normalised URI of the entity
+        cursor (Optional[str], optional): cursor for the page of connections to show, from the `next_page_url` of
+            the previous page. Defaults to None (the first page).
+        allow_missing_neighbours (bool, optional): whether to return the page without neighbours if they can't be
+            fetched, rather than raising. Defaults to True.
+
+    Returns:
+        dict: with keys `connections` (grouped connections), `neighbours`, `id`, `label` and `next_page_url`
+    """
+
     connections_request = data_models.ConnectionsRequest(
-        entities=[entity], labels=True, limit=CONNECTIONS_LIMIT
+        entities=[entity],
+        labels=True,
+        page_size=CONNECTIONS_LIMIT,
+        cursors={entity: cursor} if cursor else {},
     )
-    labels_request = data_models.LabelsRequest(uris=[entity])
-    label_response = await get_labels(labels_request)
+
+    async def _get_neighbours_to_display() -> list:
+        # neighbours are secondary to the page, so it's shown without them if they can't be fetched
+        neighbours_request = data_models.NeighboursRequest(entities=[entity], k=30)
+        try:
+            neighbours_response = await get_neighbours(neighbours_request)
+            return await process_neighbours_output(neighbours_response[entity])
+        except Exception as e:
+            if not allow_missing_neighbours:
+                raise
+            logger.warning(f"Showing {entity} without neighbours: {e!r}")
+            return []
+
+    # the entity's KG label comes back with its connections in one query, so getting its label afterwards only needs
+    # to go upstream if it has no KG label
+    connections, neighbours_response_to_display = await asyncio.gather(
+        fetch_connections(connections_request, prefetch_entity_labels=True),
+        _get_neighbours_to_display(),
+    )
+    label_response = await get_labels(data_models.LabelsRequest(uris=[entity]))
     ent_label = label_response[entity]
 
-    neighbours_request = data_models.NeighboursRequest(entities=[entity], k=30)
-    neighbours_response = await get_neighbours(neighbours_request)
-    neighbours_response_to_display = await process_neighbours_output(
-        neighbours_response[entity]
+    with metrics.time_stage("flatten"):
+        connections_processed = flatten_connections_response(connections, entity)
+    with metrics.time_stage("group"):
+        grouped_connections = group_flattened_connections(connections_processed)
+
+    next_page_url = (
+        f"/view_connections?{urlencode({'entity': entity, 'cursor': connections[entity]['next_cursor']})}"
+        if connections[entity]["next_cursor"]
+        else None
+    )
+
+    return {
+        "connections": grouped_connections,
+        "neighbours": neighbours_response_to_display,
+        "id": utils.vam_api_url_to_collection_url(entity),
+        "label": ent_label,
+        "next_page_url": next_page_url,
+    }
+
+
+def get_warmup_steps() -> List:
+    """Warm-up steps run in the background after startup: the labels on the `/view_connections` index page, then
+    the `/view_connections` page of each entry point and of each URI in `WARMUP_URIS` and `WARMUP_URIS_FILE`.
+
+    Only labels are cached by the API, but building each page also fills the label cache with the labels of its
+    connections and neighbours, and opens connections to each upstream service. Pages which are in the entity
+    snapshot are skipped, as they're served without any upstream calls."""
+    entities = utils.normaliseURIs(
+        list(ENTRY_POINT_URIS_IMAGES)
+        + warmup.read_uris(os.getenv("WARMUP_URIS"), os.getenv("WARMUP_URIS_FILE"))
     )
+    entities = [
+        entity
+        for entity in dict.fromkeys(entities)
+        if entity_snapshot is None or entity not in entity_snapshot
+    ]
+
+    async def _warm_index():
+        await get_labels(data_models.LabelsRequest(uris=list(ENTRY_POINT_URIS_IMAGES)))
+
+    def _warm_entity(entity: str):
+        return lambda: build_entity_view_model(entity)
+
+    return [_warm_index] + [_warm_entity(entity) for entity in entities]
+
 
-    connections = await get_connections(connections_request)
-    connections_processed = flatten_connections_response(connections, entity)
-    grouped_connections = group_flattened_connections(connections_processed)
+async def get_search_index_labels() -> List[Tuple[str, str]]:
+    """Get the URI and label of every labelled entity, for the search index. From SPARQL these are fetched
+    `SEARCH_INDEX_PAGE_SIZE` entities at a time."""
+    entries = []
+
+    if SEARCH_INDEX_SOURCE == "elasticsearch":
+        async for entry in es_connector.iter_labels(ELASTIC_SEARCH_INDEX):
+            entries.append(entry)
+
+        return entries
+
+    after = None
+    while True:
+        bindings = (
+            await search_index_sparql_connector.get_sparql_results(
+                sparql.get_all_labels(SEARCH_INDEX_PAGE_SIZE, after)
+            )
+        )["results"]["bindings"]
+        page_uris = {binding["s"]["value"] for binding in bindings}
+        entries += [
+            (binding["s"]["value"], binding["label"]["value"]) for binding in bindings
+        ]
+        logger.debug(f"Fetched {len(entries)} labels for the search index")
+
+        if len(page_uris) < SEARCH_INDEX_PAGE_SIZE:
+            return entries
+        after = max(page_uris)
+
+
+async def get_search_index_scores() -> Dict[str, float]:
+    """Get the number of connections of the `SEARCH_RANK_TOP_N` most connected entities, for ranking search results.
+    Ranking is only a nicety, so if the query fails results are ranked without it."""
+    if SEARCH_RANK_TOP_N <= 0:
+        return {}
+
+    try:
+        results = await search_index_sparql_connector.get_sparql_results(
+            sparql.get_top_entities(SEARCH_RANK_TOP_N)
+        )
+    except Exception as e:
+        logger.warning(f"Failed to get entity connection counts for search: {e!r}")
+        return {}
+
+    return {
+        result["entity"]["value"]: float(result["connections"]["value"])
+        for result in results["results"]["bindings"]
+    }
+
+
+async def load_or_build_search_index():
+    """Load the search index from `SEARCH_INDEX_PATH` if it exists, or build it (and save it there, if set), then
+    make it available to `/search`. CPU-bound steps run in a thread so that requests are still served meanwhile."""
+    global search_index
+    loop = asyncio.get_running_loop()
+
+    try:
+        if SEARCH_INDEX_PATH and os.path.exists(SEARCH_INDEX_PATH):
+            index = await loop.run_in_executor(
+                None, search.PrefixIndex.load, SEARCH_INDEX_PATH
+            )
+        else:
+            entries, scores = await asyncio.gather(
+                get_search_index_labels(), get_search_index_scores()
+            )
+            index = await loop.run_in_executor(
+                None, search.PrefixIndex.from_labels, entries, scores
+            )
+            del entries
+            if SEARCH_INDEX_PATH:
+                await loop.run_in_executor(None, index.save, SEARCH_INDEX_PATH)
+
+        await loop.run_in_executor(None, index.warm)
+    except Exception as e:
+        logger.warning(f"Failed to build search index: {e!r}")
+        return
+
+    search_index = index
+
+
+@app.get("/search", response_model=List[data_models.SearchResult])
+async def search_entities(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=search.MAX_RESULTS),
+):
+    """Find entities with a label which starts with `q`, or has a word which does, for typeahead search. Exact
+    matches come first, then labels starting with `q`, then labels with a word starting with `q`, each ranked by
+    the entity's number of connections."""
+    if search_index is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Search isn't enabled"
+            if SEARCH_INDEX_SOURCE == "none"
+            else "The search index is still being built",
+        )
 
-    entity = utils.vam_api_url_to_collection_url(entity)
+    with metrics.time_stage("search"):
+        return search_index.search(q, limit)
 
-    return templates.TemplateResponse(
-        "connections.html",
+
+@app.get("/search/stats", include_in_schema=False)
+async def get_search_stats():
+    """Size and memory usage of the search index."""
+    if search_index is None:
+        return {"ready": False}
+
+    return {"ready": True, **search_index.stats()}
+
+
+@app.get("/health", include_in_schema=False)
+async def get_health():
+    """Liveness check: the API is running, whether or not it's warmed up."""
+    return {"status": "ok"}
+
+
+@app.get("/ready", include_in_schema=False)
+async def get_ready():
+    """Readiness check: 200 once the warm-up after startup has finished, 503 until then."""
+    stats = warmup_state.stats()
+    if not stats["ready"]:
+        return responses.FastJSONResponse(stats, status_code=503)
+
+    return stats
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Latency metrics in the Prometheus text format."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/coalescing_stats", include_in_schema=False)
+async def get_coalescing_stats():
+    """Number of upstream calls made and saved by sharing identical in-flight calls, for each upstream."""
+    return singleflight.all_stats()
+
+
+@app.get("/upstream_status", include_in_schema=False)
+async def get_upstream_status():
+    """Circuit breaker state for each upstream, and concurrency limits for those which have them."""
+    return {
+        "circuit_breakers": resilience.all_stats(),
+        "concurrency_limits": limiter.all_stats(),
+    }
+
+
+async def get_kg_labels(uris: List[str]) -> Dict[str, Optional[str]]:
+    """Get the `rdfs:label` of each of `uris` from the KG, using cached labels where available.
+
+    Args:
+        uris (List[str]): normalised URIs
+
+    Returns:
+        Dict[str, Optional[str]]: mapping of URIs to their labels. URIs which aren't in the KG may be left out.
+    """
+    uri_label_mapping = await utils.cached_labels.get_many("kg", uris)
+    uris_to_query = [uri for uri in uris if uri not in uri_label_mapping]
+
+    if uris_to_query:
+        results = (
+            await sparql_connector.get_sparql_results(sparql.get_labels(uris_to_query))
+        )["results"]["bindings"]
+        kg_labels = {
+            res["s"]["value"]: res.get("sLabel", {}).get("value") for res in results
+        }
+        await utils.cached_labels.set_many("kg", kg_labels)
+        uri_label_mapping.update(kg_labels)
+
+    return uri_label_mapping
+
+
+async def get_elasticsearch_labels(uris: List[str]) -> Dict[str, Optional[str]]:
+    """Get the labels of `uris` from the Elasticsearch indices, using cached labels where available. Wikidata
+    entities are looked up by QID in `ELASTIC_SEARCH_WIKI_INDEX` and everything else by URI in `ELASTIC_SEARCH_INDEX`,
+    with one `mget` per index. If Elasticsearch is unavailable no labels are returned, so that the next source is
+    tried instead.
+
+    Args:
+        uris (List[str]): normalised URIs
+
+    Returns:
+        Dict[str, Optional[str]]: mapping of URIs to their labels, or None if they aren't in the index
+    """
+    uri_label_mapping = await utils.cached_labels.get_many("elasticsearch", uris)
+    uris_to_fetch = [uri for uri in uris if uri not in uri_label_mapping]
+    if not uris_to_fetch:
+        return uri_label_mapping
+
+    uri_qid_mapping = {
+        uri: re.findall(r"Q\d+", uri)[0]
+        for uri in uris_to_fetch
+        if "wikidata.org" in uri and re.findall(r"Q\d+", uri)
+    }
+    hc_uris = [uri for uri in uris_to_fetch if uri not in uri_qid_mapping]
+
+    try:
+        hc_docs, wiki_docs = await asyncio.gather(
+            es_connector.get_docs_by_uris(ELASTIC_SEARCH_INDEX, hc_uris),
+            es_connector.get_docs_by_uris(
+                ELASTIC_SEARCH_WIKI_INDEX, uri_qid_mapping.values(), simplify=False
+            ),
+        )
+    except (resilience.UpstreamUnavailableError, ElasticsearchException) as e:
+        logger.warning(f"Failed to get labels from Elasticsearch: {e!r}")
+        return uri_label_mapping
+
+    es_labels = {uri: (hc_docs[uri] or {}).get("label") for uri in hc_uris}
+    es_labels.update(
         {
-            "request": grouped_connections,
-            "neighbours": neighbours_response_to_display,
-            "id": entity,
-            "label": ent_label,
-        },
+            uri: (wiki_docs[qid] or {}).get("_source", {}).get("labels")
+            for uri, qid in uri_qid_mapping.items()
+        }
     )
+    await utils.cached_labels.set_many("elasticsearch", es_labels)
+    uri_label_mapping.update(es_labels)
+
+    return uri_label_mapping
+
+
+async def get_external_labels(uris: List[str]) -> Dict[str, Optional[str]]:
+    """Get the labels of Wikidata entities and V&A objects among `uris` from the Wikidata and V&A APIs.
+
+    Args:
+        uris (List[str]): normalised URIs
+
+    Returns:
+        Dict[str, Optional[str]]: mapping of Wikidata and V&A URIs to their labels
+    """
+    wikidata_uris = [
+        uri for uri in uris if ("wikidata.org" in uri) and re.findall(r"Q\d+", uri)
+    ]
+    vam_uris = [
+        uri
+        for uri in uris
+        if ("collections.vam.ac.uk/item" in uri) and uri not in wikidata_uris
+    ]
+
+    wikidata_labels, vam_labels = await asyncio.gather(
+        utils.get_wikidata_entity_labels(wikidata_uris),
+        utils.get_vam_object_titles(vam_uris),
+    )
+
+    return {**wikidata_labels, **vam_labels}
+
+
+LABEL_SOURCE_FUNCTIONS = {
+    "sparql": get_kg_labels,
+    "elasticsearch": get_elasticsearch_labels,
+    "external": get_external_labels,
+}
+_unknown_label_sources = set(_LABEL_SOURCES) - set(LABEL_SOURCE_FUNCTIONS)
+if _unknown_label_sources:
+    raise ValueError(
+        f"Unknown LABEL_SOURCES {sorted(_unknown_label_sources)}, must be in {list(LABEL_SOURCE_FUNCTIONS)}"
+    )
+LABEL_SOURCES = [
+    source
+    for source in _LABEL_SOURCES
+    if source != "elasticsearch" or es_connector is not None
+]
+
+
+@app.get("/labels/cache_stats", include_in_schema=False)
+async def get_label_cache_stats():
+    """Hit and miss counters for the label cache."""
+    return utils.cached_labels.stats()
 
 
 @app.post("/labels", response_model=data_models.LabelsResponse)
@@ -410,26 +1420,54 @@ async def get_labels(request: data_models.LabelsRequest):
     uris_normalised_to_uri_mapping = {
         utils.normaliseURI(uri): uri for uri in request.uris
     }
-    results = sparql_connector.get_sparql_results(
-        sparql.get_labels(uris_normalised_to_uri_mapping.keys())
-    )["results"]["bindings"]
     response = {k: None for k in request.uris}
+    uri_label_mapping = {uri: None for uri in uris_normalised_to_uri_mapping}
 
-    # TODO: this could be sped up by bundling all wikidata label requests into one list, and modifying
-    # `utils.get_wikidata_entity_label` to send up to 50 QIDs at a time to the wbgetentities API.
+    for source in LABEL_SOURCES:
+        uris_to_label = [uri for uri, label in uri_label_mapping.items() if not label]
+        if not uris_to_label:
+            break
 
-    for res in results:
-        item_label = res.get("sLabel", {}).get("value")
-        if not item_label:
-            if "collections.vam.ac.uk/item" in res["s"]["value"]:
-                item_label = utils.get_vam_object_title(res["s"]["value"])
-            if ("wikidata.org" in res["s"]["value"]) and re.findall(
-                r"Q\d+", res["s"]["value"]
-            ):
-                item_label = utils.get_wikidata_entity_label(res["s"]["value"])
+        source_labels = await LABEL_SOURCE_FUNCTIONS[source](uris_to_label)
+        metrics.LABELS_RESOLVED.inc(
+            sum(1 for label in source_labels.values() if label), source=source
+        )
+        uri_label_mapping.update(
+            {uri: label for uri, label in source_labels.items() if label}
+        )
+
+    for uri, item_label in uri_label_mapping.items():
+        # Response is keyed by URIs in request rather than normalised URIs
+        response[uris_normalised_to_uri_mapping[uri]] = item_label
+
+    return response
+
+
+@app.post("/records", response_model=data_models.RecordsResponse)
+async def get_records(request: data_models.RecordsRequest):
+    """Get the label, top concept and description of several entities from the Elasticsearch index, in one lookup.
+    Returns a dictionary mapping each input entity to its record if it's in the index, and `null` otherwise."""
+
+    if es_connector is None:
+        raise HTTPException(status_code=503, detail="Elasticsearch isn't configured")
+
+    if len(request.uris) > RECORDS_MAX_URIS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {RECORDS_MAX_URIS} URIs can be looked up at once",
+        )
+
+    uris_normalised_to_uri_mapping = {
+        utils.normaliseURI(uri): uri for uri in request.uris
+    }
+    response = {k: None for k in request.uris}
+    records = await es_connector.get_docs_by_uris(
+        ELASTIC_SEARCH_INDEX, uris_normalised_to_uri_mapping.keys()
+    )
 
+    for uri, record in records.items():
         # Response is keyed by URIs in request rather than normalised URIs
-        response[uris_normalised_to_uri_mapping[res["s"]["value"]]] = item_label
+        response[uris_normalised_to_uri_mapping[uri]] = record
 
     return response
 
@@ -2,11 +2,47 @@
 Utils and filters for use with jinja2. Used in `main.py`.
 """
 
+import asyncio
+from collections import defaultdict
+import functools
+import itertools
+import os
 import re
-import requests
-from api_utils import logging
+from typing import Callable, Dict, Iterable, List, Optional
+import httpx
+from api_utils import (
+    logging,
+    http_clients,
+    concurrency,
+    label_cache,
+    resilience,
+)
+from api_utils.singleflight import SingleFlight
 
 logger = logging.get_logger(__name__)
+cached_labels = label_cache.from_env()
+wikidata_single_flight = SingleFlight("wikidata")
+vam_single_flight = SingleFlight("vam")
+
+WIKIDATA_API_URL = os.getenv("WIKIDATA_API_URL", "https://www.wikidata.org/w/api.php")
+# wbgetentities accepts at most 50 IDs per request
+WIKIDATA_MAX_IDS_PER_REQUEST = 50
+WIKIDATA_MAX_CONCURRENT_REQUESTS = int(os.getenv("WIKIDATA_MAX_CONCURRENT_REQUESTS", 4))
+WIKIDATA_TIMEOUT = float(os.getenv("WIKIDATA_TIMEOUT", 10))
+
+VAM_API_URL = os.getenv("VAM_API_URL", "https://api.vam.ac.uk/v2/object")
+VAM_TIMEOUT = float(os.getenv("VAM_TIMEOUT", 5))
+VAM_MAX_CONCURRENT_REQUESTS = int(os.getenv("VAM_MAX_CONCURRENT_REQUESTS", 10))
+# time after which any V&A titles still being fetched are given up on
+VAM_ENRICHMENT_DEADLINE = float(os.getenv("VAM_ENRICHMENT_DEADLINE", 3))
+
+# labels from Wikidata and V&A are optional, so their calls are given up on quickly and left unlabelled when they fail
+wikidata_upstream = resilience.from_env(
+    "wikidata", max_attempts=2, deadline=WIKIDATA_TIMEOUT
+)
+vam_upstream = resilience.from_env(
+    "vam", max_attempts=2, deadline=VAM_ENRICHMENT_DEADLINE
+)
 
 predicateAbbreviationMapping = {
     "http://www.w3.org/2000/01/rdf-schema#": "RDFS",
@@ -160,43 +196,93 @@ predicateManualGroups = {
 }
 
 
+def _build_predicate_group_index(groups: Dict[str, List[str]]) -> Dict[str, list]:
+    """Map each abbreviated predicate to the (group name, position in group) pairs it appears in."""
+    index = defaultdict(list)
+    for group_name, abbreviated_predicates in groups.items():
+        for position, predicate in enumerate(abbreviated_predicates):
+            index[predicate].append((group_name, position))
+
+    return dict(index)
+
+
+predicateManualGroupIndex = _build_predicate_group_index(predicateManualGroups)
+
+
+class _PrefixIndex:
+    """Longest-prefix lookup over a fixed set of prefixes. Rather than testing every prefix in turn, each distinct
+    prefix length is tried once as a dictionary lookup, longest first."""
+
+    def __init__(self, prefixes: Iterable[str]):
+        self.prefixes = set(prefixes)
+        self.lengths = sorted({len(prefix) for prefix in self.prefixes}, reverse=True)
+
+    def longest_prefix(self, value: str) -> Optional[str]:
+        for length in self.lengths:
+            if value[:length] in self.prefixes:
+                return value[:length]
+
+        return None
+
+
+# built once at import: `predicateAbbreviationMapping` is treated as constant
+_abbreviation_prefix_index = _PrefixIndex(predicateAbbreviationMapping.keys())
+
+_smg_uri_pattern = re.compile(
+    r"https:\/\/(?:collection\.sciencemuseum).(?:\w.+)\/(?:co|cd|cp|aa|ap)(?:\d+)"
+)
+_vam_uri_pattern = re.compile(r"(http://collections.vam.ac.uk/item/[A-Za-z\d]+)")
+_wikidata_wiki_pattern = re.compile("https://www.wikidata.org/wiki/")
+
+# maximum number of distinct URIs remembered by each of `abbreviateURI`, `normaliseURI` and `assignGroupToURI`
+URI_CACHE_SIZE = int(os.getenv("URI_CACHE_SIZE", 100_000))
+
+
+@functools.lru_cache(maxsize=URI_CACHE_SIZE)
+def _abbreviate_uri(uri: str) -> str:
+    prefix = _abbreviation_prefix_index.longest_prefix(uri)
+    if prefix is None:
+        return uri
+
+    return f"{predicateAbbreviationMapping[prefix]}:{uri[len(prefix):]}"
+
+
 def abbreviateURI(uri: str) -> str:
     if not isinstance(uri, str):
         uri = str(uri)
 
-    for k, v in predicateAbbreviationMapping.items():
-        if uri.startswith(k):
-            return f"{v}:{uri[len(k):]}"
+    return _abbreviate_uri(uri)
 
-    return uri
 
+def abbreviateURIs(uris: Iterable[str]) -> List[str]:
+    """Batch version of `abbreviateURI`."""
+    return _map_distinct(abbreviateURI, uris)
 
-def normaliseURI(uri: str) -> str:
-    """Change URI from SMG, V&A or Wikidata to the form that exists in the KG"""
 
+def _search(pattern: re.Pattern, uri: str, group: int = 0) -> str:
+    match = pattern.search(uri)
+    if match is None:
+        raise ValueError(f"no match for {pattern.pattern}")
+
+    return match.group(group)
+
+
+@functools.lru_cache(maxsize=URI_CACHE_SIZE)
+def _normalise_uri(uri: str) -> str:
     try:
         if "collection.sciencemuseumgroup" in uri:
             # remove anything after cp/co/cd/aa (ID) from the end of the URL
-            return re.findall(
-                r"https:\/\/(?:collection\.sciencemuseum).(?:\w.+)\/(?:co|cd|cp|aa|ap)(?:\d+)",
-                uri,
-            )[0]
+            return _search(_smg_uri_pattern, uri)
         elif "blog.sciencemuseum.org.uk" in uri:
             return uri
         elif "https://journal.sciencemuseum.ac.uk" in uri:
-            return re.sub("https", "http", uri)
+            return uri.replace("https", "http")
         elif "collections.vam.ac.uk/item" in uri:
-            if "https" in uri:
-                uri = re.sub("https", "http", uri)
-            return re.findall(r"(http://collections.vam.ac.uk/item/[A-Za-z\d]+)", uri)[
-                0
-            ]
+            return _search(_vam_uri_pattern, uri.replace("https", "http"), group=1)
         elif uri.startswith("https://www.wikidata.org/wiki/"):
-            return re.sub(
-                "https://www.wikidata.org/wiki/", "http://www.wikidata.org/entity/", uri
-            )
+            return _wikidata_wiki_pattern.sub("http://www.wikidata.org/entity/", uri)
         elif uri.startswith("https://www.wikidata.org/entity/"):
-            return re.sub("https", "http", uri)
+            return uri.replace("https", "http")
         else:
             # return the input if it doesn't fit into any of the above categories
             return uri
@@ -206,9 +292,23 @@ def normaliseURI(uri: str) -> str:
         return uri
 
 
-def assignGroupToURI(uri: str) -> str:
-    """Returns a group for a URI e.g. science museum, v&a, wikidata. Should operate on the normalised URI produced by `normaliseURI`."""
+def normaliseURI(uri: str) -> str:
+    """Change URI from SMG, V&A or Wikidata to the form that exists in the KG"""
+
+    try:
+        return _normalise_uri(uri)
+    except TypeError:
+        # unhashable, so can't be memoised
+        return _normalise_uri.__wrapped__(uri)
+
+
+def normaliseURIs(uris: Iterable[str]) -> List[str]:
+    """Batch version of `normaliseURI`."""
+    return _map_distinct(normaliseURI, uris)
+
 
+@functools.lru_cache(maxsize=URI_CACHE_SIZE)
+def _assign_group_to_uri(uri: str) -> str:
     if "collection.sciencemuseumgroup" in uri:
         return "Science Museum Group Collection"
     elif "blog.sciencemuseum.org.uk" in uri:
@@ -225,51 +325,205 @@ def assignGroupToURI(uri: str) -> str:
         return "Literal (raw value)"
 
 
-def get_vam_object_title(object_url) -> str:
-    """"""
-    object_url = normaliseURI(object_url)
-    api_url = (
-        re.sub("collections.vam.ac.uk/item", "api.vam.ac.uk/v2/object", object_url)
-        + "?response_format=json"
+def assignGroupToURI(uri: str) -> str:
+    """Returns a group for a URI e.g. science museum, v&a, wikidata. Should operate on the normalised URI produced by `normaliseURI`."""
+
+    return _assign_group_to_uri(uri)
+
+
+def assignGroupsToURIs(uris: Iterable[str]) -> List[str]:
+    """Batch version of `assignGroupToURI`."""
+    return _map_distinct(assignGroupToURI, uris)
+
+
+def _map_distinct(fn: Callable[[str], str], values: Iterable[str]) -> List[str]:
+    """Apply `fn` to each of `values`, calling it once for each distinct value."""
+    values = list(values)
+    results = {value: fn(value) for value in dict.fromkeys(values)}
+
+    return [results[value] for value in values]
+
+
+def _get_vam_api_url(object_url: str) -> Optional[str]:
+    """Get the API URL for a normalised V&A collection URL, or None if it isn't a V&A object URL."""
+    match = re.match(r"http://collections.vam.ac.uk/item/([A-Za-z\d]+)", object_url)
+
+    return f"{VAM_API_URL}/{match.group(1)}" if match else None
+
+
+async def _fetch_vam_object_title(object_url: str) -> Optional[str]:
+    api_url = _get_vam_api_url(object_url)
+    if api_url is None:
+        return None
+
+    client = http_clients.get_client(
+        "vam",
+        timeout=VAM_TIMEOUT,
+        max_connections=VAM_MAX_CONCURRENT_REQUESTS,
+        max_keepalive_connections=VAM_MAX_CONCURRENT_REQUESTS,
     )
-    headers = {
-        "Accept": "application/json",
-    }
-    response = requests.get(api_url, headers=headers)
+    try:
+        response = await vam_upstream.request(
+            lambda: client.get(
+                api_url,
+                params={"response_format": "json"},
+                headers={"Accept": "application/json"},
+            )
+        )
+    except (httpx.HTTPError, resilience.UpstreamUnavailableError) as e:
+        logger.warning(f"V&A API request for {object_url} failed: {e!r}")
+        return None
 
     if response.status_code == 200:
-        response_json = response.json()
-        titles = response_json["record"].get("titles", [])
-        if titles:
-            generic_titles = [
-                v["title"] for v in titles if v["type"] == "generic title"
-            ]
-            if generic_titles:
-                return generic_titles[0]
-        else:
-            return response_json["record"].get("objectType")
+        title = _get_vam_title_from_record(response.json()["record"])
+        await cached_labels.set("vam", object_url, title)
+
+        return title
 
     else:
         return None
 
 
-def get_wikidata_entity_label(wiki_url) -> str:
-    qid = re.findall(r"Q\d+", wiki_url)[0]
-    api_url = f"https://www.wikidata.org/w/api.php?action=wbgetentities&props=labels&ids={qid}&format=json"
-    response = requests.get(api_url)
+async def get_vam_object_titles(object_urls: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Get titles for many V&A objects. URLs are normalised and deduplicated, cached titles are used where
+    available and the rest are fetched concurrently (at most `VAM_MAX_CONCURRENT_REQUESTS` at a time). Any titles
+    which haven't been fetched within `VAM_ENRICHMENT_DEADLINE` seconds are returned as None so that a slow V&A API
+    doesn't hold up the response.
+
+    Args:
+        object_urls (Iterable[str]): V&A collection URLs
+
+    Returns:
+        Dict[str, Optional[str]]: mapping of each URL in `object_urls` to its title, or None if it has no title or
+            couldn't be fetched in time
+    """
+
+    url_normalised_mapping = {url: normaliseURI(url) for url in object_urls}
+    title_mapping = await cached_labels.get_many(
+        "vam", set(url_normalised_mapping.values())
+    )
+    urls_to_fetch = [
+        url
+        for url in dict.fromkeys(url_normalised_mapping.values())
+        if url not in title_mapping
+    ]
+
+    if urls_to_fetch:
+        semaphore = asyncio.Semaphore(VAM_MAX_CONCURRENT_REQUESTS)
+
+        async def _fetch(url: str) -> Optional[str]:
+            async with semaphore:
+                return await vam_single_flight.do(
+                    url, lambda: _fetch_vam_object_title(url)
+                )
+
+        tasks = {asyncio.ensure_future(_fetch(url)): url for url in urls_to_fetch}
+        done, pending = await asyncio.wait(tasks, timeout=VAM_ENRICHMENT_DEADLINE)
+
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(
+                f"{len(pending)} V&A titles not fetched within {VAM_ENRICHMENT_DEADLINE}s"
+            )
+
+        for task in done:
+            if task.exception() is None:
+                title_mapping[tasks[task]] = task.result()
+            else:
+                logger.warning(
+                    f"Failed to get V&A title for {tasks[task]}: {task.exception()!r}"
+                )
+
+    return {
+        url: title_mapping.get(url_normalised)
+        for url, url_normalised in url_normalised_mapping.items()
+    }
 
-    if response.status_code == 200:
-        response_json = response.json()
-        return (
-            response_json["entities"]
-            .get(qid, {})
-            .get("labels", {})
-            .get("en", {})
-            .get("value", None)
-        )
 
+def _get_vam_title_from_record(record: dict) -> Optional[str]:
+    titles = record.get("titles", [])
+    if titles:
+        generic_titles = [v["title"] for v in titles if v["type"] == "generic title"]
+        if generic_titles:
+            return generic_titles[0]
     else:
-        return None
+        return record.get("objectType")
+
+
+async def _get_wikidata_labels_for_qids(qids: List[str]) -> Dict[str, Optional[str]]:
+    """Get English labels for up to `WIKIDATA_MAX_IDS_PER_REQUEST` QIDs in a single wbgetentities call."""
+
+    client = http_clients.get_client("wikidata", timeout=WIKIDATA_TIMEOUT)
+    try:
+        response = await wikidata_upstream.request(
+            lambda: client.get(
+                WIKIDATA_API_URL,
+                params={
+                    "action": "wbgetentities",
+                    "props": "labels",
+                    "languages": "en",
+                    "ids": "|".join(qids),
+                    "format": "json",
+                },
+            )
+        )
+    except (httpx.HTTPError, resilience.UpstreamUnavailableError) as e:
+        # leave the labels unfetched (and uncached) rather than failing the request
+        logger.warning(f"wbgetentities request failed: {e!r}")
+        return {}
+
+    if response.status_code != 200:
+        logger.warning(f"wbgetentities returned {response.status_code}")
+        return {}
+
+    entities = response.json().get("entities", {})
+
+    return {
+        qid: entities.get(qid, {}).get("labels", {}).get("en", {}).get("value", None)
+        for qid in qids
+    }
+
+
+async def get_wikidata_entity_labels(
+    wiki_urls: Iterable[str],
+) -> Dict[str, Optional[str]]:
+    """Get English labels for many Wikidata entities. QIDs are deduplicated and sent to the wbgetentities API in
+    chunks of `WIKIDATA_MAX_IDS_PER_REQUEST`, with the chunks fetched concurrently.
+
+    Args:
+        wiki_urls (Iterable[str]): Wikidata URLs, each containing a QID
+
+    Returns:
+        Dict[str, Optional[str]]: mapping of each URL in `wiki_urls` to its label, or None if it has no English label
+    """
+
+    url_qid_mapping = {url: re.findall(r"Q\d+", url)[0] for url in wiki_urls}
+    qid_label_mapping = await cached_labels.get_many(
+        "wikidata", url_qid_mapping.values()
+    )
+    qids_iter = iter(
+        qid
+        for qid in dict.fromkeys(url_qid_mapping.values())
+        if qid not in qid_label_mapping
+    )
+    chunks = iter(
+        lambda: list(itertools.islice(qids_iter, WIKIDATA_MAX_IDS_PER_REQUEST)), []
+    )
+
+    for chunk_labels in await concurrency.gather_with_concurrency(
+        asyncio.Semaphore(WIKIDATA_MAX_CONCURRENT_REQUESTS),
+        *[
+            wikidata_single_flight.do(
+                tuple(chunk), lambda chunk=chunk: _get_wikidata_labels_for_qids(chunk)
+            )
+            for chunk in chunks
+        ],
+    ):
+        await cached_labels.set_many("wikidata", chunk_labels)
+        qid_label_mapping.update(chunk_labels)
+
+    return {url: qid_label_mapping.get(qid) for url, qid in url_qid_mapping.items()}
 
 
 def vam_api_url_to_collection_url(api_url) -> str: